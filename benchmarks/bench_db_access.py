@@ -0,0 +1,118 @@
+"""
+Database work on the request path: p50/p99 latency of the DB part of a
+simulated handler, with --concurrency handlers in flight on one event loop.
+
+  to_thread   the old pattern: dedup SELECT and event INSERT each run through
+              asyncio.to_thread on a freshly opened connection
+  writer      the current pattern: in-memory dedup claim, event handed to the
+              writer thread's queue, and every --query-every requests a query
+              awaited on the writer connection via database.run_db
+
+    python benchmarks/bench_db_access.py --requests 5000 --concurrency 50,200
+
+Each mode gets its own throwaway SQLite file; AbuseIPDB reporting is off.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from http_tarpit import config, database
+from http_tarpit.request_handler import new_event_log_data
+
+HEADERS = {'Host': 'bench', 'User-Agent': 'bench-db-access', 'Accept': '*/*'}
+SELECT_REPORTED_SQL = "SELECT last_report_ts FROM reported_ips WHERE ip = ?"
+
+
+def make_event(i: int) -> dict:
+    ip = f"100.{(i >> 16) & 0xFF}.{(i >> 8) & 0xFF}.{i & 0xFF}"
+    return new_event_log_data(ip, 40000 + i % 20000, 80, 'GET', '/wp-login.php', '', 'HTTP/1.1',
+                              HEADERS['User-Agent'], HEADERS)
+
+
+def _select_reported(ip: str):
+    conn = database.get_db_connection()
+    try:
+        return conn.execute(SELECT_REPORTED_SQL, (ip,)).fetchone()
+    finally:
+        conn.close()
+
+
+def _count_reported(conn) -> int:
+    return conn.execute("SELECT COUNT(*) FROM reported_ips").fetchone()[0]
+
+
+async def handle_to_thread(i: int, query_every: int):
+    event = make_event(i)
+    await asyncio.to_thread(_select_reported, event['client_ip'])
+    await asyncio.to_thread(database.log_event_to_db, event)
+
+
+async def handle_writer(i: int, query_every: int):
+    event = make_event(i)
+    database.claim_ip_for_report(event['client_ip'])
+    database.enqueue_event(event)
+    if query_every and i % query_every == 0:
+        await database.run_db(_count_reported)
+
+
+async def run(mode: str, handler, requests: int, concurrency: int, query_every: int, first: int) -> dict:
+    latencies = []
+    next_request = iter(range(first, first + requests))
+
+    async def client():
+        for i in next_request:
+            started = time.perf_counter()
+            await handler(i, query_every)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    cuts = statistics.quantiles(latencies, n=100)
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'requests': requests,
+        'seconds': round(elapsed, 3),
+        'requests_per_s': round(requests / elapsed),
+        'p50_ms': round(cuts[49] * 1000, 3),
+        'p99_ms': round(cuts[98] * 1000, 3),
+    }
+
+
+async def bench(mode: str, requests: int, concurrency: int, query_every: int, first: int) -> dict:
+    if mode == 'writer':
+        database.start_event_writer()
+        try:
+            return await run(mode, handle_writer, requests, concurrency, query_every, first)
+        finally:
+            await asyncio.to_thread(database.stop_event_writer)
+    return await run(mode, handle_to_thread, requests, concurrency, query_every, first)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', default='50,200', help="comma-separated numbers of concurrent handlers")
+    parser.add_argument('--query-every', type=int, default=10, help="writer mode: requests per awaited query (0 = none)")
+    args = parser.parse_args()
+    config.ABUSEIPDB_ENABLED = False
+    first = 0 # every run gets fresh client IPs, so in-memory dedup claims are not already taken
+    with tempfile.TemporaryDirectory() as tmp:
+        for concurrency in (int(c) for c in args.concurrency.split(',')):
+            for mode in ('to_thread', 'writer'):
+                database.DB_FILE = Path(tmp) / f"{mode}-{concurrency}.db"
+                database.init_db()
+                print(json.dumps(asyncio.run(bench(mode, args.requests, concurrency, args.query_every, first))))
+                first += args.requests
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Memory and CPU per held connection: per-connection sleep loop vs the timer-wheel drip scheduler.
+
+Runs against in-memory fake transports, so it measures the scheduling cost
+alone (no sockets, no aiohttp):
+
+    python benchmarks/bench_drip.py --connections 50000 --delay 0.05 --duration 5
+
+Modes:
+  loop   one coroutine per connection doing write -> sleep(delay), like the old handle_request
+  wheel  DripScheduler plus one coroutine per connection awaiting its future (aiohttp handler path)
+  bare   DripScheduler with no per-connection coroutine at all (raw protocol path)
+"""
+import argparse
+import asyncio
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from http_tarpit.drip_scheduler import DripScheduler
+
+CHUNK = b'.'
+
+
+class FakeTransport:
+    __slots__ = ('written',)
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def is_closing(self):
+        return False
+
+    def get_write_buffer_size(self):
+        return 0
+
+
+async def _loop_connection(transport, total_bytes, delay):
+    sent = 0
+    while sent < total_bytes:
+        transport.write(CHUNK)
+        sent += len(CHUNK)
+        await asyncio.sleep(delay)
+
+
+async def _await_drip(drip):
+    await drip.future
+
+
+async def run_mode(mode: str, connections: int, delay: float, duration: float) -> dict:
+    total_bytes = 10 ** 9  # never finishes within the run
+    transports = [FakeTransport() for _ in range(connections)]
+    scheduler = DripScheduler(tick_seconds=delay / 10, slots=1024) if mode != 'loop' else None
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+
+    holders = []
+    for transport in transports:
+        if mode == 'loop':
+            holders.append(asyncio.create_task(_loop_connection(transport, total_bytes, delay)))
+        else:
+            drip = scheduler.add(transport, CHUNK, total_bytes, delay)
+            if mode == 'wheel':
+                holders.append(asyncio.create_task(_await_drip(drip)))
+            else:
+                holders.append(drip)
+    await asyncio.sleep(0)
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    await asyncio.sleep(duration)
+    cpu = time.process_time() - cpu_start
+    wall = time.monotonic() - wall_start
+
+    writes = sum(t.written for t in transports)
+    if scheduler is not None:
+        scheduler.stop()
+    for holder in holders:
+        if isinstance(holder, asyncio.Task):
+            holder.cancel()
+    await asyncio.gather(*(h for h in holders if isinstance(h, asyncio.Task)), return_exceptions=True)
+
+    return {
+        'mode': mode,
+        'connections': connections,
+        'delay_s': delay,
+        'duration_s': round(wall, 3),
+        'bytes_per_connection': round((held - before) / connections, 1),
+        'cpu_s': round(cpu, 4),
+        'cpu_pct': round(100 * cpu / wall, 1),
+        'writes': writes,
+        'cpu_us_per_write': round(1e6 * cpu / writes, 3) if writes else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=50000)
+    parser.add_argument('--delay', type=float, default=0.05)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--modes', default='loop,wheel,bare')
+    args = parser.parse_args()
+    for mode in args.modes.split(','):
+        result = asyncio.run(run_mode(mode, args.connections, args.delay, args.duration))
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Accepted connections per second and RSS per held connection: aiohttp engine vs the raw asyncio.Protocol engine.
+
+Each engine runs in its own server process (run_server with a throwaway
+SQLite file and AbuseIPDB disabled). The client opens --connections
+connections, --concurrency at a time, sends one request on each and waits
+for the response head; they are then held open while the server's RSS is
+read from /proc (Linux only):
+
+    python benchmarks/bench_engines.py --connections 5000 --concurrency 200
+
+Raise the open-files limit (ulimit -n) above --connections first.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+REQUEST = (
+    b"GET /wp-login.php?x=1 HTTP/1.1\r\nHost: bench\r\nUser-Agent: bench-engines\r\n"
+    b"X-Forwarded-For: 203.0.113.7\r\nX-Tarpit-Target-Port: 80\r\n\r\n"
+)
+
+
+def serve(engine: str, port: int, delay: float, db_file: str):
+    from http_tarpit import config, database
+    from http_tarpit.tarpit_server import run_server
+
+    config.HOST = "127.0.0.1"
+    config.PORT = port
+    config.TARPIT_ENGINE = engine
+    config.RESPONSE_DELAY_SECONDS = delay
+    config.ABUSEIPDB_ENABLED = False
+    database.DB_FILE = Path(db_file)
+    database.init_db()
+    asyncio.run(run_server())
+
+
+def rss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+async def wait_for_port(port: int, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            await asyncio.sleep(0.1)
+            continue
+        writer.close()
+        return
+    raise RuntimeError(f"server on port {port} did not come up")
+
+
+async def open_held_connection(port: int, semaphore, held: list):
+    async with semaphore:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(REQUEST)
+        await reader.readuntil(b"\r\n\r\n")
+        held.append(writer)
+
+
+async def run_client(pid: int, port: int, connections: int, concurrency: int, settle: float) -> dict:
+    await wait_for_port(port)
+    await asyncio.sleep(settle)
+    rss_before = rss_bytes(pid)
+    semaphore = asyncio.Semaphore(concurrency)
+    held = []
+    started = time.monotonic()
+    results = await asyncio.gather(
+        *(open_held_connection(port, semaphore, held) for _ in range(connections)),
+        return_exceptions=True,
+    )
+    elapsed = time.monotonic() - started
+    errors = sum(1 for r in results if isinstance(r, BaseException))
+    await asyncio.sleep(settle)
+    rss_held = rss_bytes(pid)
+    for writer in held:
+        writer.close()
+    return {
+        'connections': len(held),
+        'errors': errors,
+        'accept_seconds': round(elapsed, 3),
+        'accepted_per_second': round(len(held) / elapsed, 1) if elapsed else None,
+        'rss_before_mb': round(rss_before / 2 ** 20, 1),
+        'rss_held_mb': round(rss_held / 2 ** 20, 1),
+        'rss_bytes_per_connection': round((rss_held - rss_before) / len(held), 1) if held else None,
+    }
+
+
+def bench_engine(engine: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        server = subprocess.Popen([
+            sys.executable, __file__, "--serve", engine, "--port", str(args.port),
+            "--delay", str(args.delay), "--db-file", str(Path(tmp) / "bench.db"),
+        ])
+        try:
+            result = asyncio.run(run_client(server.pid, args.port, args.connections, args.concurrency, args.settle))
+        finally:
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+    return {'engine': engine, **result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=30.0, help="drip delay; long, so dripping stays out of the numbers")
+    parser.add_argument('--settle', type=float, default=1.0)
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--engines', default='aiohttp,protocol')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--db-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.delay, args.db_file)
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = min(hard, args.connections + 256)
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+    os.environ.setdefault('TARPIT_WORKERS', '1')
+    for engine in args.engines.split(','):
+        print(json.dumps(bench_engine(engine, args)))
+
+
+if __name__ == '__main__':
+    main()
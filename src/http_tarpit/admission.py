@@ -0,0 +1,205 @@
+import logging
+import resource
+import socket
+import struct
+
+from . import config
+from .utils.geoip_lookup import cached_geoip_data
+from .utils.client_address import client_address
+
+log = logging.getLogger(__name__)
+
+ADMIT = "admit"   # full tarpit hold
+SHORT = "short"   # over budget: drip ADMISSION_SHORT_DRIP_BYTES, then finish
+CLOSE = "close"   # over budget: close right away
+RESET = "reset"   # over budget / no capacity left: abort with RST
+
+SHED_ACTIONS = (SHORT, CLOSE, RESET)
+
+_LINGER_RST = struct.pack('ii', 1, 0)
+
+
+def max_total_holds() -> int:
+    """ADMISSION_MAX_TOTAL, or what RLIMIT_NOFILE leaves after ADMISSION_FD_RESERVE descriptors."""
+    if config.ADMISSION_MAX_TOTAL:
+        return config.ADMISSION_MAX_TOTAL
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        soft = 1 << 20
+    return max(1, soft - config.ADMISSION_FD_RESERVE)
+
+
+def prefix_key(addr):
+    """The /24 (IPv4) or /48 (IPv6) a parsed client address belongs to; None for unparsable addresses."""
+    if addr is None:
+        return None
+    return addr.packed[:3] if addr.version == 4 else addr.packed[:6]
+
+
+class Hold:
+    __slots__ = ('ip', 'prefix', 'asn', 'action', 'released')
+
+    def __init__(self, ip, prefix, asn, action):
+        self.ip = ip
+        self.prefix = prefix
+        self.asn = asn
+        self.action = action
+        self.released = False
+
+    @property
+    def max_bytes(self) -> int:
+        return config.ADMISSION_SHORT_DRIP_BYTES if self.action == SHORT else config.MAX_RESPONSE_BYTES
+
+
+class AdmissionController:
+    """
+    Counts live holds in total and per IP, /24 (or /48) and ASN, all in plain
+    dicts, so admit() and release() are O(1). A client over one of its
+    budgets is shed with `shed_action`; once the total ceiling is reached
+    every new client is reset, because a short drip would still cost a
+    descriptor. Short drips count against the total but not against the
+    per-source budgets. Runs on the event loop thread only.
+    """
+
+    def __init__(self, max_total: int = None, max_per_ip: int = None, max_per_prefix: int = None,
+                 max_per_asn: int = None, shed_action: str = None):
+        self.max_total = max_total or max_total_holds()
+        self.max_per_ip = max_per_ip or config.ADMISSION_MAX_PER_IP
+        self.max_per_prefix = max_per_prefix or config.ADMISSION_MAX_PER_PREFIX
+        self.max_per_asn = max_per_asn or config.ADMISSION_MAX_PER_ASN
+        self.shed_action = shed_action or config.ADMISSION_SHED_ACTION
+        if self.shed_action not in SHED_ACTIONS:
+            raise ValueError(f"Unknown admission shed action: {self.shed_action!r}")
+        self.total = 0
+        self.peak_total = 0
+        self._per_ip = {}
+        self._per_prefix = {}
+        self._per_asn = {}
+        self.admitted = 0
+        self.shed = {'total': 0, 'ip': 0, 'prefix': 0, 'asn': 0}
+
+    def admit(self, ip_address: str, asn: int = None, addr=None) -> Hold:
+        if self.total >= self.max_total:
+            self.shed['total'] += 1
+            return Hold(ip_address, None, None, RESET)
+        prefix = prefix_key(addr if addr is not None else client_address(ip_address).addr)
+        if self._per_ip.get(ip_address, 0) >= self.max_per_ip:
+            reason = 'ip'
+        elif prefix is not None and self._per_prefix.get(prefix, 0) >= self.max_per_prefix:
+            reason = 'prefix'
+        elif asn and self._per_asn.get(asn, 0) >= self.max_per_asn:
+            reason = 'asn'
+        else:
+            reason = None
+        if reason is not None:
+            self.shed[reason] += 1
+            hold = Hold(ip_address, None, None, self.shed_action)
+            if hold.action == SHORT:
+                self._add_total(1)
+            return hold
+
+        self.admitted += 1
+        self._add_total(1)
+        self._per_ip[ip_address] = self._per_ip.get(ip_address, 0) + 1
+        if prefix is not None:
+            self._per_prefix[prefix] = self._per_prefix.get(prefix, 0) + 1
+        if asn:
+            self._per_asn[asn] = self._per_asn.get(asn, 0) + 1
+        return Hold(ip_address, prefix, asn or None, ADMIT)
+
+    def assign_asn(self, hold: Hold, asn):
+        """Counts an admitted hold against its ASN once the GeoIP lookup has found it."""
+        if hold.action != ADMIT or hold.released or hold.asn is not None or not asn:
+            return
+        hold.asn = asn
+        self._per_asn[asn] = self._per_asn.get(asn, 0) + 1
+
+    def release(self, hold: Hold):
+        if hold.released or hold.action in (CLOSE, RESET):
+            hold.released = True
+            return
+        hold.released = True
+        self._add_total(-1)
+        if hold.action != ADMIT:
+            return
+        self._decrement(self._per_ip, hold.ip)
+        if hold.prefix is not None:
+            self._decrement(self._per_prefix, hold.prefix)
+        if hold.asn is not None:
+            self._decrement(self._per_asn, hold.asn)
+
+    def stats(self) -> dict:
+        return {
+            'active_holds': self.total,
+            'peak_holds': self.peak_total,
+            'max_holds': self.max_total,
+            'tracked_ips': len(self._per_ip),
+            'tracked_prefixes': len(self._per_prefix),
+            'tracked_asns': len(self._per_asn),
+            'admitted': self.admitted,
+            'shed_total_ceiling': self.shed['total'],
+            'shed_per_ip': self.shed['ip'],
+            'shed_per_prefix': self.shed['prefix'],
+            'shed_per_asn': self.shed['asn'],
+            'shed_action': self.shed_action,
+        }
+
+    def _add_total(self, delta: int):
+        self.total += delta
+        if self.total > self.peak_total:
+            self.peak_total = self.total
+
+    @staticmethod
+    def _decrement(counts: dict, key):
+        remaining = counts.get(key, 0) - 1
+        if remaining > 0:
+            counts[key] = remaining
+        else:
+            counts.pop(key, None)
+
+
+def shed_connection(transport, action: str):
+    """Drops a connection without a response: a plain close, or an RST for RESET."""
+    if transport is None or transport.is_closing():
+        return
+    if action == RESET:
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER_RST)
+            except OSError:
+                pass
+        transport.abort()
+    else:
+        transport.close()
+
+
+_controller = None
+
+def get_admission_controller() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+        log.info(f"Admission control: max {_controller.max_total} holds, "
+                 f"{_controller.max_per_ip}/IP, {_controller.max_per_prefix}/prefix, {_controller.max_per_asn}/ASN, "
+                 f"shedding with '{_controller.shed_action}'")
+    return _controller
+
+def admit_client(client):
+    """Admission decision for a new request from a ClientAddress, or None when admission control is off."""
+    if not config.ADMISSION_ENABLED:
+        return None
+    geoip_data = cached_geoip_data(client.ip)
+    return get_admission_controller().admit(client.ip, geoip_data.get('asn_number') if geoip_data else None,
+                                            client.addr)
+
+def assign_hold_asn(hold, geoip_data):
+    if hold is not None and geoip_data:
+        get_admission_controller().assign_asn(hold, geoip_data.get('asn_number'))
+
+def release_hold(hold):
+    if hold is not None:
+        get_admission_controller().release(hold)
+
+def get_admission_stats() -> dict:
+    return _controller.stats() if _controller is not None else {}
@@ -9,19 +9,89 @@ load_dotenv(dotenv_path=BASE_DIR/'.env')
 
 HOST = "127.0.0.1"
 PORT = 8080        
+SERVER_BACKLOG = 128
+TARPIT_ENGINE = os.getenv("TARPIT_ENGINE", "aiohttp") # "aiohttp" or "protocol" (raw asyncio.Protocol, no aiohttp request parsing)
+SERVER_WORKERS = int(os.getenv("TARPIT_WORKERS", "1")) # >1 forks workers sharing the port via SO_REUSEPORT
+SHUTDOWN_GRACE_SECONDS = 30 # on SIGTERM trapped clients keep dripping this long, then their events are finalized
+RESTART_DRAIN_SECONDS = int(os.getenv("TARPIT_RESTART_DRAIN_SECONDS", "600")) # same after a SIGHUP hand-off, while the successor accepts
+WORKER_RESTART_DELAY_SECONDS = 1.0
+SIDE_PORT_BIND_TIMEOUT_SECONDS = 30 # a successor waits this long for its predecessor to release the metrics / live event ports
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108")) # workers listen on METRICS_PORT + worker index
+METRICS_LOOP_LAG_INTERVAL_SECONDS = 0.5
+LIVE_EVENTS_ENABLED = os.getenv("LIVE_EVENTS_ENABLED", "0") == "1" # SSE / WebSocket event stream and rolling aggregates for dashboards
+LIVE_EVENTS_HOST = os.getenv("LIVE_EVENTS_HOST", "127.0.0.1")
+LIVE_EVENTS_PORT = int(os.getenv("LIVE_EVENTS_PORT", "9110")) # workers listen on LIVE_EVENTS_PORT + worker index
+LIVE_EVENTS_TOKEN = os.getenv("LIVE_EVENTS_TOKEN", "") # when set, required as "Authorization: Bearer <token>" or ?token=
+LIVE_EVENTS_RING_SIZE = 10000 # recent events kept in memory for replay (Last-Event-ID, /events/recent)
+LIVE_EVENTS_SUBSCRIBER_QUEUE = 1000 # events waiting for one subscriber; a subscriber this far behind is dropped
+LIVE_EVENTS_HEARTBEAT_SECONDS = 15
+LIVE_WINDOW_MINUTES = 60 # per-minute aggregates kept for /windows
+LIVE_WINDOW_MAX_KEYS = 1000 # distinct values per dimension and minute; the rest count as "(other)"
 LOG_DIR = BASE_DIR / "logs" 
 LOG_FILE = LOG_DIR / "tarpit.log" 
+LOG_QUEUE_SIZE = 10000 # records waiting for the logging thread; extra records are dropped
+LOG_ROTATE_MAX_BYTES = 50 * 1024 * 1024
+LOG_ROTATE_INTERVAL_SECONDS = 24 * 3600
+LOG_BACKUP_COUNT = 14 # rotated files are gzipped
 LOG_LEVEL = logging.INFO 
 CONSOLE_LOG_LEVEL = logging.WARNING 
 
 # bd config
 DATABASE_DIR = BASE_DIR / "data"
 SQLITE_DB_FILE = DATABASE_DIR / "tarpit_events.db"
+DB_WRITER_QUEUE_SIZE = 10000 # events waiting for the writer thread; extra events are dropped
+DB_WRITER_BATCH_SIZE = 500
+DB_WRITER_FLUSH_INTERVAL_SECONDS = 1.0
+DB_LOOKUP_CACHE_MAX_ENTRIES = 50000 # interned user agent / path / header set ids kept in memory, per table
+DB_STATEMENT_CACHE_SIZE = 256 # prepared statements kept by the writer connection (sqlite3 default: 128)
+DB_PARTITIONING_ENABLED = os.getenv("DB_PARTITIONING_ENABLED", "1") == "1"
+DB_PARTITION_PERIOD = os.getenv("DB_PARTITION_PERIOD", "week") # "day" | "week"; the main DB keeps only the current one
+DB_PARTITION_DIR = DATABASE_DIR / "partitions"
+DB_PARTITION_COMPACT_AFTER_DAYS = int(os.getenv("DB_PARTITION_COMPACT_AFTER_DAYS", "28")) # older partitions are rewritten as Parquet (needs the "parquet" extra); 0 = never
+DB_RETENTION_DAYS = int(os.getenv("DB_RETENTION_DAYS", "365")) # partitions and archives older than this are deleted; 0 = keep forever
+DB_PARTITION_MAINTENANCE_INTERVAL_SECONDS = 3600
+DB_PARTITION_MOVE_BATCH = 10000 # events moved per transaction, so the writer thread is never blocked for long
+SESSIONS_ENABLED = os.getenv("SESSIONS_ENABLED", "1") == "1"
+SESSION_IDLE_TIMEOUT_SECONDS = 1800 # a session ends this long after its last finished request
+SESSION_MAX_ACTIVE = 100000 # open sessions kept in memory; the least recently active is ended first
+SESSION_MAX_TRACKED_PATHS = 1024 # distinct paths counted per session
+SESSION_SWEEP_INTERVAL_SECONDS = 30
+ANALYSIS_CACHE_FILE = DATABASE_DIR / "analysis_cache.db" # incremental aggregates for the analyze CLI
 
 # tarpit config
 RESPONSE_DELAY_SECONDS = 1.5
 RESPONSE_CHUNK = b'.'
 MAX_RESPONSE_BYTES = 1200
+DRIP_TICKS_PER_DELAY = 10 # timer wheel resolution: ticks per RESPONSE_DELAY_SECONDS
+DRIP_WHEEL_SLOTS = 1024
+DRIP_MAX_WRITE_BUFFER = 64 * 1024 # skip a drip while this much is still unsent to the client
+DRIP_STRATEGY = os.getenv("DRIP_STRATEGY", "fixed") # fixed | exponential | gzip_bomb | header_trickle (protocol engine only) | adaptive (picks one per client)
+DRIP_EXPONENTIAL_FACTOR = 1.5
+DRIP_MAX_DELAY_SECONDS = 60
+DRIP_ENDLESS_MAX_BYTES = 256 * 1024 # wire bytes for the endless strategies (gzip_bomb, header_trickle)
+DRIP_GZIP_SLICE_BYTES = 64
+SIGNATURE_RULES_FILE = Path(os.getenv("SIGNATURE_RULES_FILE", Path(__file__).resolve().parent / "signatures.json"))
+DRIP_SCRIPTED_UA_PATTERN = r"curl|wget|python|go-http-client|java/|okhttp|libwww|zgrab|masscan|nmap|httpclient|axios|node-fetch"
+ADAPTIVE_MIN_HOLD_SECONDS = 60 # a client that got away faster is switched to the next strategy
+ADAPTIVE_GZIP_MIN_VISITS = 3
+CLIENT_PROFILE_MAX_ENTRIES = 100000
+CLIENT_PROFILE_TTL_SECONDS = 24 * 3600
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_MAX_TOTAL = 0 # concurrent holds per process; 0 = RLIMIT_NOFILE minus ADMISSION_FD_RESERVE
+ADMISSION_FD_RESERVE = 256 # descriptors kept free for the DB, logs, GeoIP and outbound HTTP
+ADMISSION_MAX_PER_IP = 8
+ADMISSION_MAX_PER_PREFIX = 64 # per /24 (IPv4) or /48 (IPv6)
+ADMISSION_MAX_PER_ASN = 2000
+ADMISSION_SHED_ACTION = os.getenv("ADMISSION_SHED_ACTION", "short") # short | close | reset, for clients over a per-source budget
+ADMISSION_SHORT_DRIP_BYTES = 16
+RAW_MAX_HEADER_BYTES = 16 * 1024 # request line + headers; bigger requests get a 400 from the protocol engine
+# Peers whose X-Forwarded-For / X-Real-IP / PROXY headers are believed; anyone else is taken at their socket address.
+# Loopback only by default: list proxies on other hosts explicitly, e.g. "127.0.0.0/8,::1/128,10.0.0.5/32".
+TRUSTED_PROXY_CIDRS = os.getenv("TARPIT_TRUSTED_PROXIES", "127.0.0.0/8,::1/128")
+PROXY_PROTOCOL = os.getenv("TARPIT_PROXY_PROTOCOL", "0") == "1" # every connection starts with a PROXY v1/v2 header from a trusted proxy
+RAW_REQUEST_TIMEOUT_SECONDS = 75 # protocol engine: drop connections that don't finish a request head in time
 
 ABUSEIPDB_API_KEY = os.getenv("ABUSEIPDB_API_KEY",None)
 ABUSEIPDB_ENABLED = bool(ABUSEIPDB_API_KEY)
@@ -29,12 +99,43 @@ ABUSEIPDB_CONFIDENCE_SCORE = 90
 ABUSEIPDB_COMMENT_PREFIX = "HTTP Tarpit detected bot activity:"
 ABUSEIPDB_CATEGORIES = "14,21,19" # 14 = Port Scan, 21 = Web App Atack, 19 = Bad Web Bot (?18 = Brute?)
 ABUSEIPDB_REPORT_INTERVAL_MINUTES = 40
+ABUSEIPDB_API_BASE_URL = os.getenv("ABUSEIPDB_API_BASE_URL", "https://api.abuseipdb.com/api/v2")
+ABUSEIPDB_DAILY_QUOTA = 1000 # free plan report limit; spread evenly over the day by the token bucket
+ABUSEIPDB_BURST = 10
+ABUSEIPDB_WORKERS = 2
+ABUSEIPDB_QUEUE_SIZE = 1000
+ABUSEIPDB_MAX_RETRIES = 5
+ABUSEIPDB_RETRY_BASE_DELAY_SECONDS = 2.0
+ABUSEIPDB_REQUEST_TIMEOUT_SECONDS = 30
+ABUSEIPDB_BULK_ENABLED = os.getenv("ABUSEIPDB_BULK_ENABLED", "0") == "1"
+ABUSEIPDB_BULK_DAILY_QUOTA = 5 # bulk-report calls per day on the free plan
+ABUSEIPDB_BULK_MIN_BATCH = 50 # smaller batches are sent as single reports
+ABUSEIPDB_BULK_MAX_BATCH = 10000 # API limit per CSV
+ABUSEIPDB_BULK_MAX_AGE_SECONDS = 600
+REPORT_CACHE_MAX_ENTRIES = 100000 # in-memory "last reported" entries, oldest evicted first
+
+# IPs whose requests matched a signature are dropped at the kernel for FIREWALL_BLOCK_TTL_SECONDS.
+FIREWALL_ENABLED = os.getenv("FIREWALL_ENABLED", "0") == "1"
+FIREWALL_BACKEND = os.getenv("FIREWALL_BACKEND", "nftables") # nftables | ipset | none (export file only)
+FIREWALL_BLOCK_SIGNATURES = os.getenv("FIREWALL_BLOCK_SIGNATURES", "") # comma-separated rule names; empty = any signature match
+FIREWALL_BLOCK_TTL_SECONDS = int(os.getenv("FIREWALL_BLOCK_TTL_SECONDS", str(24 * 3600)))
+FIREWALL_MAX_ENTRIES = 65536 # blocked IPs per process; the oldest are unblocked first
+FIREWALL_APPLY_INTERVAL_SECONDS = 10 # changes are applied to the kernel set in one batch per interval
+FIREWALL_COMMAND_TIMEOUT_SECONDS = 30
+FIREWALL_NFT_TABLE = os.getenv("FIREWALL_NFT_TABLE", "inet tarpit")
+FIREWALL_NFT_SETS = ("blocklist4", "blocklist6") # IPv4, IPv6
+FIREWALL_IPSET_SETS = ("tarpit4", "tarpit6") # IPv4, IPv6
+FIREWALL_EXPORT_FILE = DATABASE_DIR / "blocklist.txt" # flat list for other hosts, one IP per line
 
 GEOLITE2_CITY_DB_PATH = BASE_DIR / "data" / "GeoLite2-City.mmdb"
 GEOLITE2_ASN_DB_PATH = BASE_DIR / "data" / "GeoLite2-ASN.mmdb"
 
 GEOIP_CITY_ENABLED = GEOLITE2_CITY_DB_PATH.exists()
 GEOIP_ASN_ENABLED = GEOLITE2_ASN_DB_PATH.exists()
+GEOIP_CACHE_MAX_ENTRIES = 50000
+GEOIP_CACHE_TTL_SECONDS = 6 * 3600
+GEOIP_RELOAD_CHECK_SECONDS = 300 # mtime polling interval for hot-reloading the .mmdb files
 
 LOG_DIR.mkdir(parents=True, exist_ok=True)
-DATABASE_DIR.mkdir(parents=True, exist_ok=True)
\ No newline at end of file
+DATABASE_DIR.mkdir(parents=True, exist_ok=True)
+DB_PARTITION_DIR.mkdir(parents=True, exist_ok=True)
\ No newline at end of file
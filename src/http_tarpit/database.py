@@ -1,24 +1,264 @@
+import asyncio
 import sqlite3
 import logging
 import json
 import datetime
+import hashlib
+import importlib.util
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
 
 from . import config
+from .metrics import DB_FLUSH_SECONDS
 
 log = logging.getLogger(__name__)
 
 DB_FILE = config.SQLITE_DB_FILE
 
+EVENT_COLUMNS = (
+    "timestamp", "client_ip", "client_port", "target_port", "http_method", "path_id",
+    "http_query", "user_agent_id", "header_set_id", "response_status", "bytes_sent", "duration_s",
+    "error_message", "country_iso_code", "country_name", "city_name", "latitude", "longitude",
+    "asn_number", "asn_organization", "reported_to_abuseipdb", "abuseipdb_report_timestamp", "signatures",
+)
+INSERT_EVENT_SQL = f"INSERT INTO events ({', '.join(EVENT_COLUMNS)}) VALUES ({', '.join('?' * len(EVENT_COLUMNS))})"
+SESSION_COLUMNS = (
+    "client_ip", "fingerprint", "user_agent_id", "started_at", "ended_at", "requests", "distinct_paths",
+    "target_ports", "held_seconds", "bytes_sent", "country_iso_code", "asn_number", "reported_to_abuseipdb",
+)
+INSERT_SESSION_SQL = f"INSERT INTO sessions ({', '.join(SESSION_COLUMNS)}) VALUES ({', '.join('?' * len(SESSION_COLUMNS))})"
+UPSERT_REPORTED_IP_SQL = (
+    "INSERT INTO reported_ips (ip, last_report_ts) VALUES (?, ?) "
+    "ON CONFLICT(ip) DO UPDATE SET last_report_ts = excluded.last_report_ts"
+)
+SAVE_PENDING_REPORT_SQL = (
+    "INSERT OR REPLACE INTO abuseipdb_backlog (ip, target_port, comment, report_timestamp, categories, created_ts, "
+    "owner_pid) VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+DELETE_PENDING_REPORT_SQL = "DELETE FROM abuseipdb_backlog WHERE ip = ?"
+DELETE_REPORTED_IP_SQL = "DELETE FROM reported_ips WHERE ip = ? AND abs(last_report_ts - ?) < 0.001"
+REVOKE_EVENT_REPORT_SQL = (
+    "UPDATE events SET reported_to_abuseipdb = 0, abuseipdb_report_timestamp = NULL "
+    "WHERE client_ip = ? AND abuseipdb_report_timestamp = ?"
+)
+
 def get_db_connection():
     try:
         conn = sqlite3.connect(str(DB_FILE))
         conn.row_factory= sqlite3.Row
+        conn.execute('PRAGMA busy_timeout = 5000')
         return conn
     except sqlite3.Error as e:
         log.exception(f"SQLite error connecting to database {DB_FILE}: {e}")
         return None
 
+def _apply_writer_pragmas(conn):
+    # WAL lets readers (dedup checks, analysis) run while the writer commits,
+    # synchronous=NORMAL drops the fsync per commit that WAL makes unnecessary.
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA cache_size = -16000')
+    conn.execute('PRAGMA wal_autocheckpoint = 1000')
+
+def _migrate_v1(conn):
+    """The original single wide events table, plus the report bookkeeping tables."""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            client_ip TEXT NOT NULL,
+            client_port INTEGER,
+            target_port INTEGER,
+            http_method TEXT,
+            http_path TEXT,
+            http_query TEXT,
+            user_agent TEXT,
+            headers_json TEXT,
+            response_status INTEGER,
+            bytes_sent INTEGER,
+            duration_s REAL,
+            error_message TEXT,
+            country_iso_code TEXT,
+            country_name TEXT,
+            city_name TEXT,
+            latitude REAL,
+            longitude REAL,
+            asn_number INTEGER,
+            asn_organization TEXT,
+            reported_to_abuseipdb INTEGER DEFAULT 0, -- 0 = нет, 1 = да
+            abuseipdb_report_timestamp TEXT
+        )
+    ''')
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(events)')}
+    if 'target_port' not in columns:
+        cursor.execute('ALTER TABLE events ADD COLUMN target_port INTEGER')
+        log.info("Added column 'target_port' to existing 'events' table.")
+    _init_reported_ips_table(cursor)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS abuseipdb_backlog (
+            ip TEXT PRIMARY KEY,
+            target_port INTEGER,
+            comment TEXT,
+            report_timestamp TEXT,
+            created_ts REAL NOT NULL,
+            owner_pid INTEGER -- process that queued the report; rows of dead owners are adopted
+        )
+    ''')
+
+_V2_STATEMENTS = (
+    'CREATE TABLE user_agents (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)',
+    'CREATE TABLE paths (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)',
+    '''
+        CREATE TABLE header_sets (
+            id INTEGER PRIMARY KEY,
+            fingerprint BLOB NOT NULL UNIQUE, -- blake2b-128 of headers_json
+            headers_json TEXT NOT NULL
+        )
+    ''',
+    'INSERT OR IGNORE INTO user_agents (value) SELECT DISTINCT user_agent FROM events WHERE user_agent IS NOT NULL',
+    'INSERT OR IGNORE INTO paths (value) SELECT DISTINCT http_path FROM events WHERE http_path IS NOT NULL',
+    '''
+        INSERT OR IGNORE INTO header_sets (fingerprint, headers_json)
+            SELECT header_fingerprint(headers_json), headers_json FROM (
+                SELECT DISTINCT headers_json FROM events WHERE headers_json IS NOT NULL
+            )
+    ''',
+    '''
+        CREATE TABLE events_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            client_ip TEXT NOT NULL,
+            client_port INTEGER,
+            target_port INTEGER,
+            http_method TEXT,
+            path_id INTEGER REFERENCES paths (id),
+            http_query TEXT,
+            user_agent_id INTEGER REFERENCES user_agents (id),
+            header_set_id INTEGER REFERENCES header_sets (id),
+            response_status INTEGER,
+            bytes_sent INTEGER,
+            duration_s REAL,
+            error_message TEXT,
+            country_iso_code TEXT,
+            country_name TEXT,
+            city_name TEXT,
+            latitude REAL,
+            longitude REAL,
+            asn_number INTEGER,
+            asn_organization TEXT,
+            reported_to_abuseipdb INTEGER DEFAULT 0,
+            abuseipdb_report_timestamp TEXT
+        )
+    ''',
+    '''
+        INSERT INTO events_v2
+            SELECT e.id, e.timestamp, e.client_ip, e.client_port, e.target_port, e.http_method, p.id, e.http_query,
+                   ua.id, hs.id, e.response_status, e.bytes_sent, e.duration_s, e.error_message,
+                   e.country_iso_code, e.country_name, e.city_name, e.latitude, e.longitude,
+                   e.asn_number, e.asn_organization, e.reported_to_abuseipdb, e.abuseipdb_report_timestamp
+            FROM events e
+            LEFT JOIN paths p ON p.value = e.http_path
+            LEFT JOIN user_agents ua ON ua.value = e.user_agent
+            LEFT JOIN header_sets hs ON hs.fingerprint = header_fingerprint(e.headers_json)
+            ORDER BY e.id
+    ''',
+    'DROP TABLE events',
+    'ALTER TABLE events_v2 RENAME TO events',
+    'CREATE INDEX idx_events_timestamp ON events (timestamp)',
+    'CREATE INDEX idx_events_client_ip_timestamp ON events (client_ip, timestamp)',
+    '''
+        CREATE VIEW event_details AS
+            SELECT e.id, e.timestamp, e.client_ip, e.client_port, e.target_port, e.http_method,
+                   p.value AS http_path, e.http_query, ua.value AS user_agent, hs.headers_json,
+                   hs.fingerprint AS header_fingerprint, e.response_status, e.bytes_sent, e.duration_s,
+                   e.error_message, e.country_iso_code, e.country_name, e.city_name, e.latitude, e.longitude,
+                   e.asn_number, e.asn_organization, e.reported_to_abuseipdb, e.abuseipdb_report_timestamp
+            FROM events e
+            LEFT JOIN paths p ON p.id = e.path_id
+            LEFT JOIN user_agents ua ON ua.id = e.user_agent_id
+            LEFT JOIN header_sets hs ON hs.id = e.header_set_id
+    ''',
+)
+
+def _migrate_v2(conn):
+    """
+    Moves User-Agents, paths and header sets into interned lookup tables
+    referenced by id, and indexes events by time and by client. Existing
+    rows are copied into the new table in one pass; event_details joins the
+    lookups back into the v1 column names for ad-hoc queries.
+    """
+    conn.create_function('header_fingerprint', 1, header_fingerprint, deterministic=True)
+    for sql in _V2_STATEMENTS:
+        conn.execute(sql)
+
+def _migrate_v3(conn):
+    """Per-(IP, client fingerprint) sessions, one row per session once it goes idle."""
+    conn.execute('''
+        CREATE TABLE sessions (
+            id INTEGER PRIMARY KEY,
+            client_ip TEXT NOT NULL,
+            fingerprint TEXT NOT NULL, -- header order + User-Agent + Accept* hash, see sessions.request_fingerprint
+            user_agent_id INTEGER REFERENCES user_agents (id),
+            started_at TEXT NOT NULL,
+            ended_at TEXT NOT NULL,
+            requests INTEGER NOT NULL,
+            distinct_paths INTEGER,
+            target_ports INTEGER,
+            held_seconds REAL,
+            bytes_sent INTEGER,
+            country_iso_code TEXT,
+            asn_number INTEGER,
+            reported_to_abuseipdb INTEGER DEFAULT 0
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_sessions_ended_at ON sessions (ended_at)')
+    conn.execute('CREATE INDEX idx_sessions_client_ip_started_at ON sessions (client_ip, started_at)')
+    conn.execute('CREATE INDEX idx_sessions_fingerprint ON sessions (fingerprint)')
+
+def _migrate_v4(conn):
+    """Matched signature rule names per event, and per-report AbuseIPDB categories in the backlog."""
+    conn.execute('ALTER TABLE events ADD COLUMN signatures TEXT') # comma-separated rule names, NULL when none
+    conn.execute('ALTER TABLE abuseipdb_backlog ADD COLUMN categories TEXT') # NULL = ABUSEIPDB_CATEGORIES
+    conn.execute('DROP VIEW event_details')
+    conn.execute(f'CREATE VIEW event_details AS {_EVENT_DETAILS_SELECT.format(events="events")}')
+
+# (user_version, migration) in order. A migration runs once, in its own
+# transaction, and never changes after it has shipped: add a new one instead.
+MIGRATIONS = (
+    (1, _migrate_v1),
+    (2, _migrate_v2),
+    (3, _migrate_v3),
+    (4, _migrate_v4),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def migrate(conn):
+    """Brings the database up to SCHEMA_VERSION, tracking progress in PRAGMA user_version."""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema v{version} is newer than this code (v{SCHEMA_VERSION})")
+    for target, migration in MIGRATIONS:
+        if version >= target:
+            continue
+        log.info(f"Migrating database {DB_FILE} from schema v{version} to v{target}...")
+        started = time.monotonic()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {target}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        version = target
+        log.info(f"Database migrated to schema v{target} in {time.monotonic() - started:.1f}s")
+
 def init_db():
     conn = get_db_connection()
     if not conn:
@@ -26,137 +266,889 @@ def init_db():
         return
     
     try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS events (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                client_ip TEXT NOT NULL,
-                client_port INTEGER,
-                target_port INTEGER,
-                http_method TEXT,
-                http_path TEXT,
-                http_query TEXT,
-                user_agent TEXT,
-                headers_json TEXT,
-                response_status INTEGER,
-                bytes_sent INTEGER,
-                duration_s REAL,
-                error_message TEXT,
-                country_iso_code TEXT,
-                country_name TEXT,
-                city_name TEXT,
-                latitude REAL,
-                longitude REAL,
-                asn_number INTEGER,
-                asn_organization TEXT,
-                reported_to_abuseipdb INTEGER DEFAULT 0, -- 0 = нет, 1 = да
-                abuseipdb_report_timestamp TEXT
-            )
-        ''')
-        try:
-            cursor.execute('ALTER TABLE events ADD COLUMN target_port INTEGER')
-            log.info("Added column 'target_port' to existing 'events' table.")
-        except sqlite3.OperationalError as e:
-            if 'duplicate column name' in str(e).lower():
-                pass
-            else:
-                raise 
-        conn.commit()
-        log.info(f"Database {DB_FILE} Initialized successfully. Table 'events' created or already exists.")
+        _apply_writer_pragmas(conn)
+        migrate(conn)
+        log.info(f"Database {DB_FILE} initialized at schema v{SCHEMA_VERSION}.")
     except sqlite3.Error as e:
-        log.exception(f"Error initializing database table 'events': {e}")
+        log.exception(f"Error initializing database {DB_FILE}: {e}")
     finally:
         if conn:
             conn.close()
 
+def _init_reported_ips_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reported_ips (
+            ip TEXT PRIMARY KEY,
+            last_report_ts REAL NOT NULL -- unix epoch seconds
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reported_ips_last_report_ts ON reported_ips (last_report_ts)')
+    cursor.execute('SELECT 1 FROM reported_ips LIMIT 1')
+    if cursor.fetchone() is None:
+        # One-off backfill from the wide events table for databases created before reported_ips existed.
+        cursor.execute('''
+            INSERT OR IGNORE INTO reported_ips (ip, last_report_ts)
+            SELECT client_ip, MAX((julianday(abuseipdb_report_timestamp) - 2440587.5) * 86400.0)
+            FROM events
+            WHERE reported_to_abuseipdb = 1 AND abuseipdb_report_timestamp IS NOT NULL
+            GROUP BY client_ip
+        ''')
+        if cursor.rowcount and cursor.rowcount > 0:
+            log.info(f"Backfilled {cursor.rowcount} rows into 'reported_ips' from 'events'.")
+
+def header_fingerprint(headers_json):
+    if headers_json is None:
+        return None
+    return hashlib.blake2b(headers_json.encode('utf-8'), digest_size=16).digest()
+
+
+class LookupTable:
+    """
+    Interns values of one lookup table (user_agents, paths, header_sets) to
+    their row ids. Ids are cached in memory, so a known value costs a dict
+    lookup; an unknown one a SELECT and at most one INSERT on the caller's
+    connection. The cache is simply dropped when full, and after a failed
+    transaction, whose inserted ids may have been rolled back.
+    """
+
+    def __init__(self, table: str, key_column: str, extra_columns: tuple = (), max_entries: int = None):
+        self.max_entries = max_entries or config.DB_LOOKUP_CACHE_MAX_ENTRIES
+        self._select_sql = f"SELECT id FROM {table} WHERE {key_column} = ?"
+        columns = (key_column, *extra_columns)
+        self._insert_sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        self._ids = {}
+
+    def id_for(self, conn, key, *extra):
+        if key is None:
+            return None
+        row_id = self._ids.get(key)
+        if row_id is not None:
+            return row_id
+        row = conn.execute(self._select_sql, (key,)).fetchone()
+        row_id = row[0] if row is not None else conn.execute(self._insert_sql, (key, *extra)).lastrowid
+        if len(self._ids) >= self.max_entries:
+            self._ids.clear()
+        self._ids[key] = row_id
+        return row_id
+
+    def clear(self):
+        self._ids.clear()
+
+
+_user_agents = LookupTable('user_agents', 'value')
+_paths = LookupTable('paths', 'value')
+_header_sets = LookupTable('header_sets', 'fingerprint', ('headers_json',))
+
+def _clear_lookup_caches():
+    for table in (_user_agents, _paths, _header_sets):
+        table.clear()
+
+def _event_to_row(conn, event_data: dict) -> tuple:
+    geoip_data_dict = event_data.get('geoip_data')
+    if geoip_data_dict is None: 
+        geoip_data_dict = {}
+    headers_json = json.dumps(event_data.get('headers', {}))
+    return (
+        event_data.get('timestamp', datetime.datetime.now(datetime.timezone.utc).isoformat()),
+        event_data.get('client_ip'),
+        event_data.get('client_port'),
+        event_data.get('target_port'),
+        event_data.get('http_method'),
+        _paths.id_for(conn, event_data.get('http_path')),
+        event_data.get('http_query'),
+        _user_agents.id_for(conn, event_data.get('user_agent')),
+        _header_sets.id_for(conn, header_fingerprint(headers_json), headers_json),
+        event_data.get('response_status'),
+        event_data.get('bytes_sent'),
+        event_data.get('duration_s'),
+        event_data.get('error_message'),
+        geoip_data_dict.get('country_iso_code'),
+        geoip_data_dict.get('country_name'),
+        geoip_data_dict.get('city_name'),
+        geoip_data_dict.get('latitude'),
+        geoip_data_dict.get('longitude'),
+        geoip_data_dict.get('asn_number'),
+        geoip_data_dict.get('asn_organization'),
+        *_report_state(event_data),
+        ','.join(event_data['signatures']) if event_data.get('signatures') else None,
+    )
+
+# (ip, report timestamp) claims whose report failed; events still being held
+# when the failure comes back are written as not reported.
+_revoked_report_claims = {}
+
+def _report_state(event_data: dict) -> tuple:
+    report_timestamp = event_data.get('abuseipdb_report_timestamp')
+    if report_timestamp and (event_data.get('client_ip'), report_timestamp) in _revoked_report_claims:
+        return 0, None
+    return event_data.get('reported_to_abuseipdb', 0), report_timestamp
+
+def _session_to_row(conn, session: dict) -> tuple:
+    return tuple(
+        _user_agents.id_for(conn, session.get('user_agent')) if column == 'user_agent_id' else session.get(column)
+        for column in SESSION_COLUMNS
+    )
+
+# Statements whose queued payloads need converting to parameter tuples on the
+# writer thread (keeps json.dumps and friends off the event loop).
+_ROW_BUILDERS = {
+    INSERT_EVENT_SQL: _event_to_row,
+    INSERT_SESSION_SQL: _session_to_row,
+}
+
 def log_event_to_db(event_data: dict):
+    """Synchronous single-event insert, for scripts running without the writer thread."""
     conn = get_db_connection()
     if not conn:
         log.error("Cannot log event to DB: connection failed.")
         return
-    geoip_data_dict = event_data.get('geoip_data')
-    if geoip_data_dict is None: 
-        geoip_data_dict = {}
-    sql_data = {
-        "timestamp": event_data.get('timestamp', datetime.datetime.now(datetime.timezone.utc).isoformat()),
-        "client_ip": event_data.get('client_ip'),
-        "client_port": event_data.get('client_port'),
-        "target_port": event_data.get('target_port'),
-        "http_method": event_data.get('http_method'),
-        "http_path": event_data.get('http_path'),
-        "http_query": event_data.get('http_query'),
-        "user_agent": event_data.get('user_agent'),
-        "headers_json": json.dumps(event_data.get('headers', {})),
-        "response_status": event_data.get('response_status'),
-        "bytes_sent": event_data.get('bytes_sent'),
-        "duration_s": event_data.get('duration_s'),
-        "error_message": event_data.get('error_message'),
-        "country_iso_code": geoip_data_dict.get('country_iso_code'),
-        "country_name": geoip_data_dict.get('country_name'),
-        "city_name": geoip_data_dict.get('city_name'),
-        "latitude": geoip_data_dict.get('latitude'),
-        "longitude": geoip_data_dict.get('longitude'),
-        "asn_number": geoip_data_dict.get('asn_number'),
-        "asn_organization": geoip_data_dict.get('asn_organization'),
-        "reported_to_abuseipdb": event_data.get('reported_to_abuseipdb', 0),
-        "abuseipdb_report_timestamp": event_data.get('abuseipdb_report_timestamp')
-    }
-
-    columns = ', '.join(sql_data.keys())
-    placeholders = ', '.join('?' * len(sql_data))
-    sql = f'INSERT INTO events ({columns}) VALUES ({placeholders})'
-    values = tuple(sql_data.values())
-
     try:
         cursor = conn.cursor()
-        cursor.execute(sql, values)
+        cursor.execute(INSERT_EVENT_SQL, _event_to_row(conn, event_data))
         conn.commit()
-        log.debug(f"Event logged to database for IP: {sql_data['client_ip']}")
+        log.debug(f"Event logged to database for IP: {event_data.get('client_ip')}")
     except sqlite3.Error as e:
-        log.exception(f"Error logging event to database for IP {sql_data['client_ip']}: {e}")
+        conn.rollback()
+        _clear_lookup_caches()
+        log.exception(f"Error logging event to database for IP {event_data.get('client_ip')}: {e}")
     finally:
         if conn:
             conn.close()
 
-def check_ip_reported_recently(ip_address: str) -> bool:
+
+# Queue markers for EventWriter.call() items and for waking the thread on stop().
+_CALL = object()
+_WAKE = object()
+
+def _resolve_future(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class EventWriter:
+    """
+    Single writer thread owning one persistent connection.
+
+    Producers call submit() from the event loop; it never blocks and drops the
+    item when the bounded queue is full. The thread flushes when a batch is
+    full or the flush interval elapses, one transaction per flush, consecutive
+    items for the same statement going through executemany.
+
+    call() runs a function on the same connection and thread, after the rows
+    queued before it have been flushed, and returns an awaitable: the few
+    queries the event loop needs (cross-worker claims, the report backlog)
+    use the warm connection and its statement cache instead of opening a
+    connection on the default executor.
+    """
+
+    def __init__(self, db_file=None, queue_size=None, batch_size=None, flush_interval=None):
+        self.db_file = str(db_file or DB_FILE)
+        self.batch_size = batch_size or config.DB_WRITER_BATCH_SIZE
+        self.flush_interval = flush_interval or config.DB_WRITER_FLUSH_INTERVAL_SECONDS
+        self._queue = queue.Queue(maxsize=queue_size or config.DB_WRITER_QUEUE_SIZE)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.submitted = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="sqlite-event-writer", daemon=True)
+        self._thread.start()
+        log.info(f"SQLite event writer started (batch={self.batch_size}, interval={self.flush_interval}s, queue={self._queue.maxsize})")
+
+    def submit(self, sql: str, params) -> bool:
+        try:
+            self._queue.put_nowait((sql, params))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                log.warning(f"SQLite writer queue full, dropped {self.dropped} items so far")
+            return False
+        self.submitted += 1
+        return True
+
+    def call(self, fn, *args) -> asyncio.Future:
+        """Schedules fn(conn, *args) on the writer thread; await the result. Event loop thread only."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self._stop_event.is_set():
+            future.set_exception(sqlite3.OperationalError("SQLite writer is stopping"))
+            return future
+        try:
+            self._queue.put_nowait((_CALL, (fn, args, future, loop)))
+        except queue.Full:
+            future.set_exception(sqlite3.OperationalError("SQLite writer queue full"))
+        return future
+
+    def stop(self, timeout: float = 30.0):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        try:
+            self._queue.put_nowait((_WAKE, None))
+        except queue.Full:
+            pass # the thread is not waiting for items then
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            log.error(f"SQLite event writer did not finish within {timeout}s, {self._queue.qsize()} items left unwritten")
+        else:
+            log.info(f"SQLite event writer stopped. Stats: {self.stats()}")
+        self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self._queue.maxsize,
+            'submitted': self.submitted,
+            'dropped': self.dropped,
+            'written': self.written,
+            'failed': self.failed,
+            'flushes': self.flushes,
+            'last_flush_seconds': round(self.last_flush_seconds, 6),
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, cached_statements=config.DB_STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA busy_timeout = 5000')
+        _apply_writer_pragmas(conn)
+        return conn
+
+    def _run(self):
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            log.exception(f"SQLite event writer could not open {self.db_file}: {e}")
+            return
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    while True:
+                        if item[0] is _CALL:
+                            if batch:
+                                self._flush(conn, batch)
+                                batch = []
+                            self._call(conn, *item[1])
+                        elif item[0] is not _WAKE:
+                            batch.append(item)
+                            if len(batch) >= self.batch_size:
+                                break
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+                stopping = self._stop_event.is_set()
+                now = time.monotonic()
+                if batch and (len(batch) >= self.batch_size or now >= deadline or stopping):
+                    self._flush(conn, batch)
+                    batch = []
+                if now >= deadline:
+                    deadline = now + self.flush_interval
+                if stopping and not batch and self._queue.empty():
+                    break
+        finally:
+            conn.close()
+
+    def _flush(self, conn, batch):
+        started = time.monotonic()
+        try:
+            with conn:
+                group_sql, group = None, []
+                for sql, params in batch:
+                    if sql != group_sql and group:
+                        self._execute_group(conn, group_sql, group)
+                        group = []
+                    group_sql = sql
+                    group.append(params)
+                if group:
+                    self._execute_group(conn, group_sql, group)
+            self.written += len(batch)
+        except sqlite3.Error as e:
+            self.failed += len(batch)
+            _clear_lookup_caches()
+            log.exception(f"SQLite event writer failed to flush {len(batch)} items: {e}")
+        self.flushes += 1
+        self.last_flush_seconds = time.monotonic() - started
+        DB_FLUSH_SECONDS.observe(self.last_flush_seconds)
+
+    def _call(self, conn, fn, args, future, loop):
+        result = error = None
+        try:
+            result = fn(conn, *args)
+        except Exception as e:
+            error = e
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            loop.call_soon_threadsafe(_resolve_future, future, result, error)
+        except RuntimeError:
+            pass # the loop is gone; nobody is waiting any more
+
+    def _execute_group(self, conn, sql, group):
+        builder = _ROW_BUILDERS.get(sql)
+        if builder is not None:
+            group = [builder(conn, params) for params in group]
+        conn.executemany(sql, group)
+
+
+_event_writer = None
+
+def start_event_writer() -> EventWriter:
+    global _event_writer
+    if _event_writer is None:
+        _event_writer = EventWriter()
+        _event_writer.start()
+    return _event_writer
+
+def stop_event_writer():
+    global _event_writer
+    if _event_writer is not None:
+        _event_writer.stop()
+        _event_writer = None
+
+def get_event_writer_stats() -> dict:
+    return _event_writer.stats() if _event_writer is not None else {}
+
+def _with_connection(fn, *args):
     conn = get_db_connection()
     if not conn:
+        raise sqlite3.OperationalError(f"cannot open {DB_FILE}")
+    try:
+        return fn(conn, *args)
+    finally:
+        conn.close()
+
+async def run_db(fn, *args):
+    """
+    Runs fn(conn, *args) on the writer thread's connection; on a fresh
+    connection in a worker thread when the writer is not running.
+    fn owns its transaction (use `with conn:`).
+    """
+    if _event_writer is not None:
+        return await _event_writer.call(fn, *args)
+    return await asyncio.to_thread(_with_connection, fn, *args)
+
+def enqueue_session(session: dict) -> bool:
+    """Hands a finished session to the writer thread, falling back to a direct insert when it is not running."""
+    if _event_writer is not None:
+        return _event_writer.submit(INSERT_SESSION_SQL, session)
+    conn = get_db_connection()
+    if not conn:
+        return False
+    try:
+        with conn:
+            conn.execute(INSERT_SESSION_SQL, _session_to_row(conn, session))
+        return True
+    except sqlite3.Error as e:
+        _clear_lookup_caches()
+        log.exception(f"Error writing session for IP {session.get('client_ip')}: {e}")
+        return False
+    finally:
+        conn.close()
+
+def enqueue_event(event_data: dict) -> bool:
+    """Hands an event to the writer thread, falling back to a direct insert when it is not running."""
+    if _event_writer is None:
+        log_event_to_db(event_data)
+        return True
+    return _event_writer.submit(INSERT_EVENT_SQL, event_data)
+
+class ReportedIPCache:
+    """
+    Per-IP "last reported" timestamps with TTL expiry and a size cap.
+
+    Entries are kept in report order, so the oldest one is evicted first when
+    the cap is reached. All methods are synchronous and meant to be called from
+    the event loop thread, which makes claim() an atomic check-and-set.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def last_report_ts(self, ip_address: str, now: float = None):
+        ts = self._entries.get(ip_address)
+        if ts is None:
+            return None
+        if (now or time.time()) - ts >= self.ttl_seconds:
+            del self._entries[ip_address]
+            return None
+        return ts
+
+    def was_reported(self, ip_address: str, now: float = None) -> bool:
+        if self.last_report_ts(ip_address, now) is not None:
+            self.hits += 1
+            return True
+        self.misses += 1
         return False
 
-    interval_minutes = config.ABUSEIPDB_REPORT_INTERVAL_MINUTES
+    def mark(self, ip_address: str, ts: float):
+        self._entries[ip_address] = ts
+        self._entries.move_to_end(ip_address)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def claim(self, ip_address: str, now: float = None) -> bool:
+        now = now or time.time()
+        if self.was_reported(ip_address, now):
+            return False
+        self.mark(ip_address, now)
+        return True
+
+    def forget(self, ip_address: str):
+        self._entries.pop(ip_address, None)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
 
+
+_reported_ip_cache = ReportedIPCache(
+    ttl_seconds=config.ABUSEIPDB_REPORT_INTERVAL_MINUTES * 60,
+    max_entries=config.REPORT_CACHE_MAX_ENTRIES,
+)
+
+def warm_reported_ip_cache():
+    conn = get_db_connection()
+    if not conn:
+        log.error("Cannot warm reported IP cache: connection failed.")
+        return
+    threshold = time.time() - _reported_ip_cache.ttl_seconds
     try:
         cursor = conn.cursor()
-        threshold_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=interval_minutes)
-        threshold_iso = threshold_time.isoformat(timespec='microseconds')
+        cursor.execute('''
+            SELECT ip, last_report_ts FROM (
+                SELECT ip, last_report_ts FROM reported_ips
+                WHERE last_report_ts >= ?
+                ORDER BY last_report_ts DESC
+                LIMIT ?
+            ) ORDER BY last_report_ts ASC
+        ''', (threshold, _reported_ip_cache.max_entries))
+        for row in cursor:
+            _reported_ip_cache.mark(row['ip'], row['last_report_ts'])
+        log.info(f"Reported IP cache warmed with {len(_reported_ip_cache)} entries.")
+    except sqlite3.Error as e:
+        log.exception(f"Error warming reported IP cache: {e}")
+    finally:
+        conn.close()
+
+def _submit_write(sql: str, params: tuple):
+    if _event_writer is not None:
+        _event_writer.submit(sql, params)
+        return
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        with conn:
+            conn.execute(sql, params)
+    except sqlite3.Error as e:
+        log.exception(f"Error executing write outside the event writer: {e}")
+    finally:
+        conn.close()
 
-        log.debug(f"Checking DB for reports for IP {ip_address} since {threshold_iso}")
+def check_ip_reported_recently(ip_address: str) -> bool:
+    was_reported = _reported_ip_cache.was_reported(ip_address)
+    log.debug(f"Reported IP cache: IP {ip_address} {'was' if was_reported else 'was not'} reported recently.")
+    return was_reported
 
-        cursor.execute('''
-            SELECT abuseipdb_report_timestamp FROM events
-            WHERE client_ip = ?
-              AND reported_to_abuseipdb = 1
-              AND abuseipdb_report_timestamp >= ?
-            ORDER BY abuseipdb_report_timestamp DESC
-            LIMIT 1
-        ''', (ip_address, threshold_iso))
-
-        result = cursor.fetchone()
-
-        was_reported = bool(result)
-        if was_reported:
-            # Используем result['abuseipdb_report_timestamp'] если result не None
-            report_ts = result['abuseipdb_report_timestamp'] if result else 'N/A'
-            log.debug(f"Checked DB: IP {ip_address} found with recent report timestamp: {report_ts}")
-        else:
-            log.debug(f"Checked DB: IP {ip_address} not found with recent report timestamp.")
+def claim_ip_for_report(ip_address: str):
+    """
+    Atomically checks and marks ip_address as reported.
+
+    Returns the ISO timestamp of the claim, or None when the IP was already
+    reported within ABUSEIPDB_REPORT_INTERVAL_MINUTES. Because there is no
+    await between the check and the mark, two concurrent requests from the
+    same IP cannot both win.
+    """
+    now = time.time()
+    if not _reported_ip_cache.claim(ip_address, now):
+        return None
+    if config.SERVER_WORKERS <= 1:
+        _submit_write(UPSERT_REPORTED_IP_SQL, (ip_address, now))
+    # With several worker processes the shared row is only taken by
+    # claim_ips_across_workers, right before the report is sent.
+    return datetime.datetime.fromtimestamp(now, datetime.timezone.utc).isoformat()
+
+def release_ip_report_claim(ip_address: str, report_timestamp: str):
+    """Undoes claim_ip_for_report after the report was rejected, so the IP can be reported again."""
+    if not report_timestamp:
+        return
+    claim_ts = datetime.datetime.fromisoformat(report_timestamp).timestamp()
+    cached_ts = _reported_ip_cache.last_report_ts(ip_address)
+    if cached_ts is not None and abs(cached_ts - claim_ts) < 0.001:
+        _reported_ip_cache.forget(ip_address)
+    now = time.time()
+    if len(_revoked_report_claims) >= _reported_ip_cache.max_entries:
+        expired = [key for key, ts in _revoked_report_claims.items() if now - ts > config.MAX_RESPONSE_BYTES * config.RESPONSE_DELAY_SECONDS * 2]
+        for key in expired:
+            del _revoked_report_claims[key]
+    _revoked_report_claims[(ip_address, report_timestamp)] = now
+    _submit_write(DELETE_REPORTED_IP_SQL, (ip_address, claim_ts))
+    _submit_write(REVOKE_EVENT_REPORT_SQL, (ip_address, report_timestamp))
 
-        return was_reported
+async def claim_ips_across_workers(claims) -> set:
+    """
+    Cross-process dedup for multi-worker mode: takes the reported_ips row for
+    each (ip, report_timestamp) unless another worker holds a live claim.
+    Each conditional upsert is atomic in SQLite, so exactly one worker wins.
+    Returns the set of IPs this process may report.
+    """
+    try:
+        return await run_db(_claim_ips, claims)
+    except sqlite3.Error as e:
+        log.exception(f"Error claiming {len(claims)} IPs across workers: {e}")
+        return set()
 
+def _claim_ips(conn, claims) -> set:
+    threshold = time.time() - _reported_ip_cache.ttl_seconds
+    won = set()
+    try:
+        with conn:
+            for ip_address, report_timestamp in claims:
+                claim_ts = datetime.datetime.fromisoformat(report_timestamp).timestamp() if report_timestamp else time.time()
+                cursor = conn.execute('''
+                    INSERT INTO reported_ips (ip, last_report_ts) VALUES (?, ?)
+                    ON CONFLICT(ip) DO UPDATE SET last_report_ts = excluded.last_report_ts
+                    WHERE reported_ips.last_report_ts < ? OR abs(reported_ips.last_report_ts - excluded.last_report_ts) < 0.001
+                ''', (ip_address, claim_ts, threshold))
+                if cursor.rowcount == 1:
+                    won.add(ip_address)
     except sqlite3.Error as e:
-        log.exception(f"Error checking if IP {ip_address} was reported: {e}")
+        log.exception(f"Error claiming {len(claims)} IPs across workers: {e}")
+    return won
+
+def get_reported_ip_cache_stats() -> dict:
+    return _reported_ip_cache.stats()
+
+def save_pending_report(ip_address: str, target_port: int, comment: str, report_timestamp: str,
+                        categories: str = None):
+    _submit_write(SAVE_PENDING_REPORT_SQL,
+                  (ip_address, target_port, comment, report_timestamp, categories, time.time(), os.getpid()))
+
+def delete_pending_report(ip_address: str):
+    _submit_write(DELETE_PENDING_REPORT_SQL, (ip_address,))
+
+def _pid_alive(pid) -> bool:
+    if not pid:
         return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+async def load_pending_reports(limit: int = None) -> list:
+    """
+    Returns backlog rows owned by this process or by a process that no longer
+    exists, taking ownership of the latter so no other worker reloads them.
+    """
+    try:
+        return await run_db(_load_pending_reports, limit)
+    except sqlite3.Error as e:
+        log.exception(f"Cannot load AbuseIPDB backlog: {e}")
+        return []
+
+def _load_pending_reports(conn, limit: int = None) -> list:
+    pid = os.getpid()
+    try:
+        with conn:
+            cursor = conn.execute(
+                'SELECT ip, target_port, comment, report_timestamp, categories, owner_pid FROM abuseipdb_backlog '
+                'ORDER BY created_ts'
+            )
+            rows = []
+            for row in cursor.fetchall():
+                if limit is not None and len(rows) >= limit:
+                    break
+                owner = row['owner_pid']
+                if owner != pid:
+                    if _pid_alive(owner):
+                        continue
+                    adopted = conn.execute(
+                        'UPDATE abuseipdb_backlog SET owner_pid = ? WHERE ip = ? AND owner_pid IS ?',
+                        (pid, row['ip'], owner)
+                    )
+                    if adopted.rowcount != 1:
+                        continue
+                rows.append({key: row[key] for key in ('ip', 'target_port', 'comment', 'report_timestamp', 'categories')})
+            return rows
+    except sqlite3.Error as e:
+        log.exception(f"Error loading AbuseIPDB backlog: {e}")
+        return []
+
+# Time partitions. The main database only keeps events of the current day or
+# ISO week (the hot partition), so the writer, the report revocation UPDATE
+# and VACUUM/backups stay cheap; dedup state lives in reported_ips and never
+# reads older events. Older events are moved into one SQLite file per period
+# under DB_PARTITION_DIR, rewritten as Parquet after
+# DB_PARTITION_COMPACT_AFTER_DAYS and deleted after DB_RETENTION_DAYS. The
+# space they free in the main file is reused by new events.
+
+PARTITION_PERIODS = ('day', 'week')
+
+def partition_start(day: datetime.date, period: str = None) -> datetime.date:
+    period = period or config.DB_PARTITION_PERIOD
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    raise ValueError(f"Unknown partition period: {period!r} (expected one of {PARTITION_PERIODS})")
+
+def partition_end(start: datetime.date, period: str = None) -> datetime.date:
+    return start + datetime.timedelta(days=1 if (period or config.DB_PARTITION_PERIOD) == 'day' else 7)
+
+def partition_name(start: datetime.date, period: str = None) -> str:
+    if (period or config.DB_PARTITION_PERIOD) == 'day':
+        return f"events-{start.isoformat()}"
+    year, week, _ = start.isocalendar()
+    return f"events-{year}-W{week:02d}"
+
+def _parse_partition_name(stem: str):
+    """(start, period) for a partition file stem, or None for files that are not partitions."""
+    key = stem.removeprefix('events-')
+    try:
+        if '-W' in key:
+            year, week = key.split('-W')
+            return datetime.date.fromisocalendar(int(year), int(week), 1), 'week'
+        return datetime.date.fromisoformat(key), 'day'
+    except ValueError:
+        return None
+
+def list_partitions(partition_dir: Path = None) -> list:
+    """(start, end, path) of every partition file, SQLite and Parquet, oldest first."""
+    partition_dir = Path(partition_dir or config.DB_PARTITION_DIR)
+    partitions = []
+    for path in partition_dir.glob('events-*'):
+        if path.suffix not in ('.db', '.parquet'):
+            continue
+        parsed = _parse_partition_name(path.stem)
+        if parsed is not None:
+            start, period = parsed
+            partitions.append((start, partition_end(start, period), path))
+    partitions.sort()
+    return partitions
+
+def _attach_partition(conn, path: Path, alias: str):
+    """
+    Attaches a partition file, adding any events columns introduced by later
+    migrations to its table first (partitions are never migrated on their own),
+    so SELECT * lines up with the hot table.
+    """
+    conn.execute(f'ATTACH DATABASE ? AS {alias}', (str(path),))
+    existing = [row[1] for row in conn.execute(f'PRAGMA {alias}.table_info(events)')]
+    if not existing:
+        return
+    for row in conn.execute('PRAGMA main.table_info(events)').fetchall():
+        if row[1] not in existing:
+            conn.execute(f'ALTER TABLE {alias}.events ADD COLUMN {row[1]} {row[2]}')
+
+def attach_partitions(conn, since: datetime.date = None) -> list:
+    """
+    Attaches the SQLite partitions ending after `since` (all when None) and
+    creates the TEMP view all_events over them and the hot partition, with
+    the same columns as event_details. SQLite allows 10 attached databases by
+    default. Returns the attached paths.
+    """
+    attached = []
+    sources = ['main.events']
+    for index, (start, end, path) in enumerate(list_partitions()):
+        if path.suffix != '.db' or (since is not None and end <= since):
+            continue
+        _attach_partition(conn, path, f'part{index}')
+        sources.append(f'part{index}.events')
+        attached.append(path)
+    union = ' UNION ALL '.join(f'SELECT * FROM {source}' for source in sources)
+    conn.execute('DROP VIEW IF EXISTS temp.all_events')
+    conn.execute(f'CREATE TEMP VIEW all_events AS {_EVENT_DETAILS_SELECT.format(events=f"({union})")}')
+    return attached
+
+_EVENT_DETAILS_SELECT = '''
+    SELECT e.id, e.timestamp, e.client_ip, e.client_port, e.target_port, e.http_method,
+           p.value AS http_path, e.http_query, ua.value AS user_agent, hs.headers_json,
+           hs.fingerprint AS header_fingerprint, e.response_status, e.bytes_sent, e.duration_s,
+           e.error_message, e.country_iso_code, e.country_name, e.city_name, e.latitude, e.longitude,
+           e.asn_number, e.asn_organization, e.reported_to_abuseipdb, e.abuseipdb_report_timestamp, e.signatures
+    FROM {events} e
+    LEFT JOIN main.paths p ON p.id = e.path_id
+    LEFT JOIN main.user_agents ua ON ua.id = e.user_agent_id
+    LEFT JOIN main.header_sets hs ON hs.id = e.header_set_id
+'''
+# Only well-formed ISO timestamps are rolled; anything else stays in the hot partition.
+_ISO_DATE_GLOB = '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'
+
+def _move_to_partition(conn, start: datetime.date, end: datetime.date, period: str) -> int:
+    path = Path(config.DB_PARTITION_DIR) / f"{partition_name(start, period)}.db"
+    _attach_partition(conn, path, 'part')
+    moved = 0
+    try:
+        # Same columns as the hot table; the unique id index makes a move
+        # interrupted between the two databases' commits safe to repeat.
+        conn.execute('CREATE TABLE IF NOT EXISTS part.events AS SELECT * FROM main.events WHERE 0')
+        conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS part.idx_events_id ON events (id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS part.idx_events_client_ip_timestamp ON events (client_ip, timestamp)')
+        bounds = (start.isoformat(), end.isoformat(), config.DB_PARTITION_MOVE_BATCH)
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('''
+                    INSERT OR IGNORE INTO part.events SELECT * FROM main.events
+                    WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp, id LIMIT ?
+                ''', bounds)
+                deleted = conn.execute('''
+                    DELETE FROM main.events WHERE id IN (
+                        SELECT id FROM main.events WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp, id LIMIT ?
+                    )
+                ''', bounds).rowcount
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            moved += deleted
+            if deleted < config.DB_PARTITION_MOVE_BATCH:
+                break
     finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        conn.execute('DETACH DATABASE part')
+    if moved:
+        log.info(f"Moved {moved} events into partition {path.name}")
+    return moved
+
+def roll_partitions(today: datetime.date = None) -> int:
+    """Moves every event older than the hot partition into its partition file. Returns the number moved."""
+    period = config.DB_PARTITION_PERIOD
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    hot_start = partition_start(today, period).isoformat()
+    Path(config.DB_PARTITION_DIR).mkdir(parents=True, exist_ok=True)
+    conn = get_db_connection()
+    if not conn:
+        log.error("Cannot roll event partitions: connection failed.")
+        return 0
+    moved = 0
+    try:
+        while True:
+            row = conn.execute(
+                'SELECT MIN(timestamp) FROM events WHERE timestamp < ? AND timestamp GLOB ?', (hot_start, _ISO_DATE_GLOB)
+            ).fetchone()
+            if row[0] is None:
+                break
+            start = partition_start(datetime.date.fromisoformat(row[0][:10]), period)
+            moved += _move_to_partition(conn, start, partition_end(start, period), period)
+    except sqlite3.Error as e:
+        log.exception(f"Error rolling events into partitions: {e}")
+    finally:
+        conn.close()
+    return moved
+
+def parquet_engine_available() -> bool:
+    """Whether pandas can write Parquet here (pyarrow, from the "parquet" extra, or fastparquet)."""
+    return any(importlib.util.find_spec(name) is not None for name in ('pyarrow', 'fastparquet'))
+
+def compact_partition(path: Path) -> Path:
+    """
+    Rewrites a SQLite partition as Parquet, with lookups resolved to their
+    values (the event_details columns), and removes the SQLite file. Needs
+    pandas with pyarrow or fastparquet; raises ImportError without them.
+    """
+    import pandas as pd
+
+    conn = get_db_connection()
+    if not conn:
+        raise sqlite3.OperationalError(f"cannot open {DB_FILE}")
+    try:
+        _attach_partition(conn, path, 'part')
+        frame = pd.read_sql_query(_EVENT_DETAILS_SELECT.format(events='part.events') + ' ORDER BY e.timestamp', conn)
+        conn.execute('DETACH DATABASE part')
+    finally:
+        conn.close()
+    target = path.with_suffix('.parquet')
+    temp = path.with_suffix('.parquet.tmp')
+    frame.to_parquet(temp, index=False)
+    os.replace(temp, target)
+    for leftover in (path, Path(f"{path}-wal"), Path(f"{path}-shm")):
+        leftover.unlink(missing_ok=True)
+    log.info(f"Compacted partition {path.name} into {target.name} ({len(frame)} events)")
+    return target
+
+def maintain_partitions(today: datetime.date = None, compact: bool = True) -> dict:
+    """Rolls the hot partition, compacts old SQLite partitions (unless compact=False) and applies DB_RETENTION_DAYS."""
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    result = {'moved': roll_partitions(today), 'compacted': 0, 'deleted': 0}
+    compact_before = None
+    if compact and config.DB_PARTITION_COMPACT_AFTER_DAYS:
+        compact_before = today - datetime.timedelta(days=config.DB_PARTITION_COMPACT_AFTER_DAYS)
+    delete_before = today - datetime.timedelta(days=config.DB_RETENTION_DAYS) if config.DB_RETENTION_DAYS else None
+    if delete_before is not None:
+        result['sessions_deleted'] = _delete_sessions_before(delete_before)
+    for start, end, path in list_partitions():
+        if delete_before is not None and end <= delete_before:
+            path.unlink(missing_ok=True)
+            result['deleted'] += 1
+            log.info(f"Deleted partition {path.name} (older than {config.DB_RETENTION_DAYS} days)")
+        elif path.suffix == '.db' and compact_before is not None and end <= compact_before:
+            try:
+                compact_partition(path)
+            except ImportError as e:
+                log.warning(f"Cannot compact partition {path.name} to Parquet, keeping it as SQLite: {e}")
+                break
+            except (sqlite3.Error, OSError, ValueError) as e:
+                log.exception(f"Error compacting partition {path.name}: {e}")
+                continue
+            result['compacted'] += 1
+    return result
+
+def _delete_sessions_before(day: datetime.date) -> int:
+    conn = get_db_connection()
+    if not conn:
+        return 0
+    try:
+        with conn:
+            return conn.execute('DELETE FROM sessions WHERE ended_at < ?', (day.isoformat(),)).rowcount
+    except sqlite3.Error as e:
+        log.exception(f"Error deleting sessions older than {day}: {e}")
+        return 0
+    finally:
+        conn.close()
+
+async def run_partition_maintenance(interval: float = None):
+    interval = interval or config.DB_PARTITION_MAINTENANCE_INTERVAL_SECONDS
+    compact = bool(config.DB_PARTITION_COMPACT_AFTER_DAYS)
+    if compact and not parquet_engine_available():
+        compact = False
+        log.warning(f"Partitions older than {config.DB_PARTITION_COMPACT_AFTER_DAYS} days cannot be compacted to Parquet "
+                    f"without pyarrow and are kept as SQLite; install the \"parquet\" extra "
+                    f"(pip install 'http-tarpit[parquet]') or set DB_PARTITION_COMPACT_AFTER_DAYS=0.")
+    while True:
+        try:
+            result = await asyncio.to_thread(maintain_partitions, None, compact)
+            log.debug(f"Partition maintenance: {result}")
+        except Exception:
+            log.exception("Partition maintenance failed")
+        await asyncio.sleep(interval)
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import math
+import time
+
+from . import config
+
+log = logging.getLogger(__name__)
+
+CONNECTION_RESET_ERROR = "Connection reset by peer during write"
+SCHEDULER_STOPPED_ERROR = "Drip scheduler stopped"
+SHUTDOWN_ERROR = "Hold finalized at shutdown"
+
+
+class DripConnection:
+    """Per-connection drip state. Kept deliberately small: one of these exists for every trapped client."""
+
+    __slots__ = ('transport', 'frame', 'chunk_len', 'remaining', 'bytes_sent', 'delay_ticks',
+                 'rounds', 'future', 'error', 'done', 'strategy', 'step', 'chunked')
+
+    def __init__(self, transport, frame: bytes, chunk_len: int, total_bytes: int, delay_ticks: int, future,
+                 strategy=None, chunked: bool = False):
+        self.transport = transport
+        self.frame = frame
+        self.chunk_len = chunk_len
+        self.remaining = total_bytes
+        self.bytes_sent = 0
+        self.delay_ticks = delay_ticks
+        self.rounds = 0
+        self.future = future
+        self.error = None
+        self.done = False
+        self.strategy = strategy
+        self.step = 0
+        self.chunked = chunked
+
+
+class DripScheduler:
+    """
+    Hashed timer wheel driving every trapped connection from one loop timer.
+
+    Each slot holds the connections due at that tick; a connection with a
+    delay longer than the wheel carries a `rounds` counter. On every tick the
+    scheduler writes the pre-encoded frame to all due transports in one pass
+    and re-files them, so between ticks a connection costs one DripConnection
+    and no coroutine, task or timer-heap entry of its own. Ticks are a
+    fraction of the drip delay, which spreads connections accepted at
+    different moments across slots instead of writing to all of them at once.
+    """
+
+    def __init__(self, tick_seconds: float = None, slots: int = None, max_write_buffer: int = None):
+        self.tick_seconds = tick_seconds or config.RESPONSE_DELAY_SECONDS / config.DRIP_TICKS_PER_DELAY
+        self.slots = slots or config.DRIP_WHEEL_SLOTS
+        self.max_write_buffer = max_write_buffer or config.DRIP_MAX_WRITE_BUFFER
+        self._wheel = [[] for _ in range(self.slots)]
+        self._cursor = 0
+        self._loop = None
+        self._timer = None
+        self._next_tick_at = 0.0
+        self.stopped_error = None
+        self.active = 0
+        self.bytes_dripped = 0
+        self.writes = 0
+        self.ticks = 0
+        self.backpressure_skips = 0
+
+    def start(self, loop=None):
+        if self._timer is not None:
+            return
+        self._loop = loop or asyncio.get_running_loop()
+        self._next_tick_at = self._loop.time() + self.tick_seconds
+        self._timer = self._loop.call_at(self._next_tick_at, self._tick)
+
+    def stop(self, error: str = SCHEDULER_STOPPED_ERROR):
+        """Finishes every drip with `error`; drips added afterwards finish with it straight away."""
+        self.stopped_error = error
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for slot in self._wheel:
+            for conn in slot:
+                self._finish(conn, error)
+            slot.clear()
+
+    def delay_to_ticks(self, delay: float) -> int:
+        return max(1, math.ceil(delay / self.tick_seconds - 1e-9))
+
+    def add(self, transport, chunk: bytes, total_bytes: int, delay: float, frame: bytes = None) -> DripConnection:
+        """
+        Starts dripping `chunk` to `transport` every `delay` seconds until
+        `total_bytes` have been sent. `frame` is what actually goes on the
+        wire (e.g. the chunk wrapped in chunked transfer-encoding). The first
+        chunk is written immediately; await conn.future for completion.
+        """
+        if self._timer is None and self.stopped_error is None:
+            self.start()
+        conn = DripConnection(transport, frame or chunk, len(chunk), total_bytes,
+                              self.delay_to_ticks(delay), self._loop.create_future())
+        return self._register(conn)
+
+    def add_strategy(self, transport, strategy, total_bytes: int, chunked: bool) -> DripConnection:
+        """
+        Like add(), but every frame and the delay after it come from
+        `strategy` (see drip_strategies.ScheduledStrategy). The drip also
+        ends when the strategy runs out of frames.
+        """
+        if self._timer is None and self.stopped_error is None:
+            self.start()
+        conn = DripConnection(transport, None, 0, total_bytes, 1, self._loop.create_future(),
+                              strategy=strategy, chunked=chunked)
+        return self._register(conn)
+
+    def discard(self, conn: DripConnection, error=None):
+        """Stops dripping to a connection whose owner went away (e.g. the handler was cancelled)."""
+        if not conn.done:
+            self._finish(conn, error or conn.error)
+
+    def stats(self) -> dict:
+        return {
+            'active_connections': self.active,
+            'bytes_dripped': self.bytes_dripped,
+            'writes': self.writes,
+            'ticks': self.ticks,
+            'backpressure_skips': self.backpressure_skips,
+        }
+
+    def _register(self, conn: DripConnection) -> DripConnection:
+        self.active += 1
+        if self.stopped_error is not None:
+            self._finish(conn, self.stopped_error)
+        elif self._write(conn):
+            self._schedule(conn)
+        return conn
+
+    def _schedule(self, conn: DripConnection):
+        conn.rounds, offset = divmod(conn.delay_ticks, self.slots)
+        if offset == 0:
+            offset = self.slots
+            conn.rounds -= 1
+        self._wheel[(self._cursor + offset) % self.slots].append(conn)
+
+    def _finish(self, conn: DripConnection, error):
+        if conn.done:
+            return
+        conn.done = True
+        conn.error = error
+        conn.transport = None
+        self.active -= 1
+        if not conn.future.done():
+            conn.future.set_result(conn.bytes_sent)
+
+    def _write(self, conn: DripConnection) -> bool:
+        """Writes one frame; returns False once the connection is finished."""
+        if conn.done:
+            return False
+        transport = conn.transport
+        if transport is None or transport.is_closing():
+            self._finish(conn, CONNECTION_RESET_ERROR)
+            return False
+        if transport.get_write_buffer_size() > self.max_write_buffer:
+            # The client stopped reading; don't grow our buffer, try again next time.
+            self.backpressure_skips += 1
+            return True
+        strategy = conn.strategy
+        if strategy is None:
+            frame, sent = conn.frame, conn.chunk_len
+        else:
+            step = strategy.frame(conn)
+            if step is None:
+                self._finish(conn, None)
+                return False
+            frame, sent = step
+        try:
+            transport.write(frame)
+        except Exception as e:
+            self._finish(conn, f"Error writing chunk: {e}")
+            return False
+        conn.bytes_sent += sent
+        conn.remaining -= sent
+        conn.step += 1
+        self.bytes_dripped += sent
+        self.writes += 1
+        if conn.remaining <= 0:
+            self._finish(conn, None)
+            return False
+        if strategy is not None:
+            conn.delay_ticks = self.delay_to_ticks(strategy.next_delay(conn))
+        return True
+
+    def _tick(self):
+        self.ticks += 1
+        self._cursor = (self._cursor + 1) % self.slots
+        due = self._wheel[self._cursor]
+        if due:
+            self._wheel[self._cursor] = []
+            for conn in due:
+                if conn.done:
+                    continue
+                if conn.rounds > 0:
+                    conn.rounds -= 1
+                    self._wheel[self._cursor].append(conn)
+                elif self._write(conn):
+                    self._schedule(conn)
+        self._next_tick_at += self.tick_seconds
+        now = self._loop.time()
+        if self._next_tick_at < now - self.tick_seconds:
+            # The loop stalled for more than a tick; skip ahead instead of bursting through missed ticks.
+            self._next_tick_at = now
+        self._timer = self._loop.call_at(self._next_tick_at, self._tick)
+
+
+_scheduler = None
+
+def get_drip_scheduler() -> DripScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = DripScheduler()
+    return _scheduler
+
+def stop_drip_scheduler():
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.stop()
+        _scheduler = None
+
+async def drain_drip_scheduler(timeout: float, cut_short: asyncio.Event = None) -> int:
+    """
+    Lets trapped clients keep dripping for up to `timeout` seconds (or until
+    `cut_short` is set), then finishes the rest with SHUTDOWN_ERROR so their
+    handlers still log and store the event. Returns how many were finalized.
+    """
+    if _scheduler is None or not _scheduler.active:
+        return 0
+    log.info(f"Draining {_scheduler.active} trapped connections for up to {timeout}s")
+    deadline = time.monotonic() + timeout
+    while _scheduler.active and time.monotonic() < deadline and not (cut_short and cut_short.is_set()):
+        await asyncio.sleep(0.2)
+    finalized = _scheduler.active
+    if finalized:
+        log.info(f"Finalizing {finalized} connections still trapped after the drain")
+    _scheduler.stop(SHUTDOWN_ERROR)
+    # Let the handlers waiting on the finished drips run their cleanup.
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    return finalized
+
+def get_drip_stats() -> dict:
+    return _scheduler.stats() if _scheduler is not None else {}
@@ -0,0 +1,230 @@
+import abc
+import logging
+import re
+import time
+import zlib
+from collections import OrderedDict
+
+from . import config
+from .signatures import get_signature_engine
+
+log = logging.getLogger(__name__)
+
+
+def chunked_frame(chunk: bytes) -> bytes:
+    return b"%x\r\n%s\r\n" % (len(chunk), chunk)
+
+
+class DripStrategy:
+    """
+    Fixed-rate drip: `chunk` every `delay` seconds, MAX_RESPONSE_BYTES in total.
+
+    Strategies are shared, stateless objects; per-connection progress lives
+    in the scheduler's DripConnection (step, bytes_sent). `content_encoding`
+    is sent as a response header, and `raw_head` strategies write the status
+    line and headers themselves instead of getting a normal response head.
+    """
+
+    name = 'fixed'
+    content_encoding = None
+    raw_head = False
+
+    def __init__(self, chunk: bytes = None, delay: float = None, max_bytes: int = None):
+        self.chunk = chunk or config.RESPONSE_CHUNK
+        self.delay = delay or config.RESPONSE_DELAY_SECONDS
+        self.max_bytes = max_bytes or config.MAX_RESPONSE_BYTES
+        self._chunk_frame = chunked_frame(self.chunk)
+
+    def start(self, scheduler, transport, chunked: bool, max_bytes: int = None):
+        """Hands `transport` to the drip scheduler; returns the DripConnection to wait on."""
+        return scheduler.add(transport, self.chunk, max_bytes or self.max_bytes, self.delay,
+                             frame=self._chunk_frame if chunked else None)
+
+
+class ScheduledStrategy(DripStrategy, abc.ABC):
+    """Base for strategies that pick every frame and every delay themselves."""
+
+    def start(self, scheduler, transport, chunked: bool, max_bytes: int = None):
+        return scheduler.add_strategy(transport, self, max_bytes or self.max_bytes, chunked)
+
+    @abc.abstractmethod
+    def frame(self, conn):
+        """
+        (wire bytes, payload length) for write number conn.step, or None to
+        end the drip. Return prebuilt tuples: this runs for every write.
+        """
+
+    def next_delay(self, conn) -> float:
+        return self.delay
+
+
+class ExponentialDrip(ScheduledStrategy):
+    """Body chunks with the delay multiplied by `factor` after every write, up to `max_delay`."""
+
+    name = 'exponential'
+
+    def __init__(self, chunk: bytes = None, delay: float = None, max_bytes: int = None,
+                 factor: float = None, max_delay: float = None):
+        super().__init__(chunk, delay, max_bytes)
+        self.factor = factor or config.DRIP_EXPONENTIAL_FACTOR
+        self.max_delay = max_delay or config.DRIP_MAX_DELAY_SECONDS
+        self._frames = {True: (self._chunk_frame, len(self.chunk)), False: (self.chunk, len(self.chunk))}
+
+    def frame(self, conn):
+        return self._frames[conn.chunked]
+
+    def next_delay(self, conn) -> float:
+        return min(self.delay * self.factor ** min(conn.step, 64), self.max_delay)
+
+
+class GzipBombDrip(ScheduledStrategy):
+    """
+    Endless gzip body. The stream is a gzip header followed by the same
+    full-flushed deflate block of zeros over and over, so it stays valid
+    however far the client reads. Sent in `slice_bytes` pieces; every
+    ~1 KiB on the wire inflates to 1 MiB on the client.
+    """
+
+    name = 'gzip_bomb'
+    content_encoding = 'gzip'
+
+    def __init__(self, delay: float = None, max_bytes: int = None, slice_bytes: int = None):
+        super().__init__(delay=delay, max_bytes=max_bytes or config.DRIP_ENDLESS_MAX_BYTES)
+        slice_bytes = slice_bytes or config.DRIP_GZIP_SLICE_BYTES
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+        zeros = bytes(1 << 20)
+        first = compressor.compress(zeros) + compressor.flush(zlib.Z_FULL_FLUSH)
+        block = compressor.compress(zeros) + compressor.flush(zlib.Z_FULL_FLUSH)
+        header = first[:len(first) - len(block)]
+        slices = [block[i:i + slice_bytes] for i in range(0, len(block), slice_bytes)]
+        self._frames = {
+            False: ([(header, len(header))], [(s, len(s)) for s in slices]),
+            True: ([(chunked_frame(header), len(header))], [(chunked_frame(s), len(s)) for s in slices]),
+        }
+
+    def frame(self, conn):
+        prefix, cycle = self._frames[conn.chunked]
+        if conn.step < len(prefix):
+            return prefix[conn.step]
+        return cycle[(conn.step - len(prefix)) % len(cycle)]
+
+
+class HeaderTrickleDrip(ScheduledStrategy):
+    """
+    Never finishes the response head: a status line, then one more header
+    line per delay. Clients without a header timeout wait for the blank line
+    that never comes. Here `chunked` only says whether the client spoke
+    HTTP/1.1, for the status line.
+    """
+
+    name = 'header_trickle'
+    raw_head = True
+
+    def __init__(self, delay: float = None, max_bytes: int = None):
+        super().__init__(delay=delay, max_bytes=max_bytes or config.DRIP_ENDLESS_MAX_BYTES)
+        status_lines = {True: b"HTTP/1.1 200 OK\r\n", False: b"HTTP/1.0 200 OK\r\n"}
+        header_lines = [b"X-Trace-%02x: %08x\r\n" % (i, (i * 2654435761) & 0xffffffff) for i in range(64)]
+        self._status_lines = {key: (line, len(line)) for key, line in status_lines.items()}
+        self._header_lines = [(line, len(line)) for line in header_lines]
+
+    def frame(self, conn):
+        if conn.step == 0:
+            return self._status_lines[conn.chunked]
+        return self._header_lines[(conn.step - 1) % len(self._header_lines)]
+
+
+STRATEGY_CLASSES = {cls.name: cls for cls in (DripStrategy, ExponentialDrip, GzipBombDrip, HeaderTrickleDrip)}
+# Order in which clients that escape a strategy quickly are moved on to the next one.
+ROTATION = ('exponential', 'header_trickle', 'fixed', 'gzip_bomb')
+
+_strategies = {}
+
+def get_strategy(name: str) -> DripStrategy:
+    strategy = _strategies.get(name)
+    if strategy is None:
+        strategy = _strategies[name] = STRATEGY_CLASSES[name]()
+    return strategy
+
+
+class ClientProfile:
+    __slots__ = ('visits', 'last_strategy', 'last_held_seconds', 'last_seen')
+
+    def __init__(self):
+        self.visits = 0
+        self.last_strategy = None
+        self.last_held_seconds = 0.0
+        self.last_seen = 0.0
+
+
+class ClientProfileCache:
+    """Per-IP outcome of past holds, LRU-bounded with TTL expiry. Event loop thread only."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, ip_address: str):
+        profile = self._entries.get(ip_address)
+        if profile is None:
+            return None
+        if time.time() - profile.last_seen >= self.ttl_seconds:
+            del self._entries[ip_address]
+            return None
+        return profile
+
+    def record(self, ip_address: str, strategy_name: str, held_seconds: float):
+        profile = self.get(ip_address)
+        if profile is None:
+            profile = self._entries[ip_address] = ClientProfile()
+        self._entries.move_to_end(ip_address)
+        profile.visits += 1
+        profile.last_strategy = strategy_name
+        profile.last_held_seconds = held_seconds
+        profile.last_seen = time.time()
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+_profiles = ClientProfileCache(config.CLIENT_PROFILE_MAX_ENTRIES, config.CLIENT_PROFILE_TTL_SECONDS)
+
+_SCRIPTED_UA_RE = re.compile(config.DRIP_SCRIPTED_UA_PATTERN, re.IGNORECASE)
+
+def choose_strategy(ip_address: str, signatures: tuple, user_agent: str, accept_encoding: str) -> DripStrategy:
+    """
+    Picks a strategy for a new hold. DRIP_STRATEGY names a fixed choice;
+    "adaptive" decides from the client's profile first, then the request:
+
+    - the last strategy let the client go in under ADAPTIVE_MIN_HOLD_SECONDS:
+      the next one in ROTATION
+    - repeat visitor that accepts gzip: gzip_bomb
+    - HTTP library or empty User-Agent: header_trickle
+    - matched a scanner signature: the strategy its rule names, else exponential
+    - anything else: fixed
+    """
+    if config.DRIP_STRATEGY != 'adaptive':
+        return get_strategy(config.DRIP_STRATEGY)
+    profile = _profiles.get(ip_address)
+    if profile is not None and profile.last_strategy in ROTATION \
+            and profile.last_held_seconds < config.ADAPTIVE_MIN_HOLD_SECONDS:
+        return get_strategy(ROTATION[(ROTATION.index(profile.last_strategy) + 1) % len(ROTATION)])
+    if profile is not None and profile.visits >= config.ADAPTIVE_GZIP_MIN_VISITS and 'gzip' in accept_encoding:
+        return get_strategy('gzip_bomb')
+    if not user_agent or user_agent == 'N/A' or _SCRIPTED_UA_RE.search(user_agent):
+        return get_strategy('header_trickle')
+    if signatures:
+        return get_strategy(get_signature_engine().strategy(signatures) or 'exponential')
+    return get_strategy('fixed')
+
+def record_client_outcome(event_data: dict):
+    """Feeds a finished hold back into the client's profile."""
+    strategy_name = event_data.get('drip_strategy')
+    if strategy_name not in STRATEGY_CLASSES or event_data.get('duration_s') is None:
+        return
+    _profiles.record(event_data['client_ip'], strategy_name, event_data['duration_s'])
+
+def get_client_profile_stats() -> dict:
+    return {'size': len(_profiles), 'max_entries': _profiles.max_entries}
@@ -0,0 +1,368 @@
+import abc
+import asyncio
+import datetime
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from . import config
+from .utils.client_address import client_address, get_client_resolver
+
+log = logging.getLogger(__name__)
+
+
+class FirewallError(RuntimeError):
+    pass
+
+
+class Blocklist:
+    """
+    Blocked IPs in expiry order, so expired ones are found at the front.
+    Changes since the last take_changes() are collected and handed out as
+    one batch: IPs to add (new or seen again, with the seconds left on their
+    block) and IPs to delete (expired or evicted). Event loop thread only.
+    """
+
+    def __init__(self, ttl: float = None, max_entries: int = None):
+        self.ttl = ttl or config.FIREWALL_BLOCK_TTL_SECONDS
+        self.max_entries = max_entries or config.FIREWALL_MAX_ENTRIES
+        self._expires = OrderedDict()
+        self._pending_add = set()
+        self._pending_delete = set()
+        self.blocked = 0
+        self.refreshed = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._expires)
+
+    def __contains__(self, ip: str) -> bool:
+        return ip in self._expires
+
+    def add(self, ip: str, now: float = None) -> bool:
+        """Blocks ip for ttl seconds from now, or extends its block. Returns True when ip is new."""
+        now = time.time() if now is None else now
+        is_new = ip not in self._expires
+        if is_new:
+            self.blocked += 1
+        else:
+            self._expires.move_to_end(ip)
+            self.refreshed += 1
+        self._expires[ip] = now + self.ttl
+        self._pending_add.add(ip)
+        self._pending_delete.discard(ip)
+        while len(self._expires) > self.max_entries:
+            self._remove(self._expires.popitem(last=False)[0])
+            self.evicted += 1
+        return is_new
+
+    def remove(self, ip: str) -> bool:
+        if self._expires.pop(ip, None) is None:
+            return False
+        self._remove(ip)
+        return True
+
+    def expire(self, now: float = None) -> int:
+        now = time.time() if now is None else now
+        expired = 0
+        while self._expires:
+            ip, expires_at = next(iter(self._expires.items()))
+            if expires_at > now:
+                break
+            self._expires.popitem(last=False)
+            self._remove(ip)
+            expired += 1
+        self.expired += expired
+        return expired
+
+    def take_changes(self, full: bool = False, now: float = None) -> tuple:
+        """
+        Returns (adds, deletes) and clears them: adds as (ip, seconds left)
+        pairs, deletes as IPs. With full=True every blocked IP is an add,
+        for re-syncing a set that missed a batch.
+        """
+        now = time.time() if now is None else now
+        pending = self._expires if full else self._pending_add
+        adds = [(ip, max(1, int(self._expires[ip] - now + 0.999))) for ip in pending]
+        deletes = list(self._pending_delete)
+        self._pending_add = set()
+        self._pending_delete = set()
+        return adds, deletes
+
+    def requeue_deletes(self, deletes):
+        """Puts back deletes from a batch that could not be applied, unless the IP was blocked again since."""
+        self._pending_delete.update(ip for ip in deletes if ip not in self._expires)
+
+    def entries(self) -> list:
+        return list(self._expires)
+
+    def _remove(self, ip: str):
+        self._pending_add.discard(ip)
+        self._pending_delete.add(ip)
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._expires),
+            'pending_adds': len(self._pending_add),
+            'pending_deletes': len(self._pending_delete),
+            'blocked': self.blocked,
+            'refreshed': self.refreshed,
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
+
+
+def split_by_version(ips) -> tuple:
+    v4, v6 = [], []
+    for item in ips:
+        ip = item[0] if isinstance(item, tuple) else item
+        (v6 if ':' in ip else v4).append(item)
+    return v4, v6
+
+
+class FirewallBackend(abc.ABC):
+    """
+    Applies blocklist changes to a kernel set as one script per batch.
+
+    render() builds the script and apply() runs it through `command`;
+    subclasses only write render() (the tests replace apply() with a fake
+    that records the batches). Every batch must be safe to repeat: adding an IP
+    that is already in the set or deleting one that is gone is not an error.
+    Elements carry a kernel timeout too, so a set left behind by a process
+    that died drains by itself.
+    """
+
+    name = None
+    command = ()
+
+    @abc.abstractmethod
+    def render(self, adds: list, deletes: list) -> str:
+        """The script for one batch: adds are (ip, timeout seconds), deletes plain IPs."""
+
+    async def apply(self, adds: list, deletes: list):
+        script = self.render(adds, deletes)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *self.command, stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+            )
+        except OSError as e:
+            raise FirewallError(f"cannot run {self.command[0]}: {e}") from None
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(script.encode()),
+                                               config.FIREWALL_COMMAND_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise FirewallError(f"{' '.join(self.command)} timed out") from None
+        if process.returncode != 0:
+            raise FirewallError(f"{' '.join(self.command)} exited with {process.returncode}: "
+                                f"{stderr.decode(errors='replace').strip()[:500]}")
+
+
+class NftablesBackend(FirewallBackend):
+    """
+    One `nft -f -` transaction per batch, so a batch is applied completely
+    or not at all. Deletes are written as add-then-delete, which cannot fail
+    on a missing element, and re-adds as delete-then-add, which is how an
+    element's timeout is restarted.
+    """
+
+    name = 'nftables'
+    command = ('nft', '-f', '-')
+
+    def __init__(self, table: str = None, sets: tuple = None):
+        self.table = table or config.FIREWALL_NFT_TABLE
+        self.sets = sets or config.FIREWALL_NFT_SETS
+
+    def render(self, adds: list, deletes: list) -> str:
+        lines = [f"add table {self.table}"]
+        for set_name, addr_type in zip(self.sets, ('ipv4_addr', 'ipv6_addr')):
+            lines.append(f"add set {self.table} {set_name} {{ type {addr_type}; flags timeout; }}")
+        for set_name, set_adds, set_deletes in zip(self.sets, split_by_version(adds), split_by_version(deletes)):
+            touched = [ip for ip, _ in set_adds] + set_deletes
+            if not touched:
+                continue
+            elements = ', '.join(touched)
+            lines.append(f"add element {self.table} {set_name} {{ {elements} }}")
+            lines.append(f"delete element {self.table} {set_name} {{ {elements} }}")
+            if set_adds:
+                timed = ', '.join(f"{ip} timeout {seconds}s" for ip, seconds in set_adds)
+                lines.append(f"add element {self.table} {set_name} {{ {timed} }}")
+        return '\n'.join(lines) + '\n'
+
+
+class IpsetBackend(FirewallBackend):
+    """One `ipset -exist restore` per batch; -exist makes adds of present and deletes of missing IPs no-ops."""
+
+    name = 'ipset'
+    command = ('ipset', '-exist', 'restore')
+
+    def __init__(self, sets: tuple = None, max_entries: int = None):
+        self.sets = sets or config.FIREWALL_IPSET_SETS
+        self.max_entries = max_entries or config.FIREWALL_MAX_ENTRIES
+
+    def render(self, adds: list, deletes: list) -> str:
+        lines = []
+        for set_name, family in zip(self.sets, ('inet', 'inet6')):
+            # timeout 0: elements carry their own timeout and there is no default.
+            lines.append(f"create {set_name} hash:ip family {family} timeout 0 maxelem {self.max_entries}")
+        for set_name, set_adds, set_deletes in zip(self.sets, split_by_version(adds), split_by_version(deletes)):
+            lines.extend(f"del {set_name} {ip}" for ip in set_deletes)
+            lines.extend(f"add {set_name} {ip} timeout {seconds}" for ip, seconds in set_adds)
+        return '\n'.join(lines) + '\n'
+
+
+class NullBackend(FirewallBackend):
+    """Keeps no kernel set; the blocklist only goes to the export file."""
+
+    name = 'none'
+
+    def render(self, adds: list, deletes: list) -> str:
+        return ''
+
+    async def apply(self, adds: list, deletes: list):
+        pass
+
+
+BACKEND_CLASSES = {cls.name: cls for cls in (NftablesBackend, IpsetBackend, NullBackend)}
+
+
+def export_file_path():
+    """FIREWALL_EXPORT_FILE, with the worker index in the name in multi-worker mode; each worker exports its own IPs."""
+    worker_index = os.environ.get('TARPIT_WORKER_INDEX')
+    path = config.FIREWALL_EXPORT_FILE
+    if worker_index is None:
+        return path
+    return path.with_name(f"{path.stem}.worker{worker_index}{path.suffix}")
+
+
+def write_export_file(path, ips: list):
+    """Writes the blocklist as a flat file, one IP per line, replacing the old one atomically."""
+    generated = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(f"# http-tarpit blocklist, {len(ips)} addresses, generated {generated}\n")
+        for ip in ips:
+            f.write(ip + '\n')
+    os.replace(tmp_path, path)
+
+
+class FirewallExporter:
+    """
+    Feeds finished events into the blocklist and pushes the changes to the
+    backend once per FIREWALL_APPLY_INTERVAL_SECONDS. An IP is blocked once
+    a request from it matched a signature (one of FIREWALL_BLOCK_SIGNATURES
+    when set). Non-public addresses and trusted proxies are never blocked.
+    A batch that fails is retried as a full re-sync on the next round.
+    """
+
+    def __init__(self, backend: FirewallBackend = None, blocklist: Blocklist = None, export_path=None,
+                 block_signatures=None):
+        self.backend = backend or BACKEND_CLASSES[config.FIREWALL_BACKEND]()
+        self.blocklist = blocklist if blocklist is not None else Blocklist()
+        self.export_path = export_path if export_path is not None else export_file_path()
+        if block_signatures is None:
+            block_signatures = config.FIREWALL_BLOCK_SIGNATURES.split(',')
+        self.block_signatures = frozenset(name.strip() for name in block_signatures if name.strip())
+        self._resync = False
+        self._export_stale = False
+        self.batches = 0
+        self.batch_failures = 0
+        self.last_batch_seconds = 0.0
+
+    def should_block(self, event_data: dict) -> bool:
+        signatures = event_data.get('signatures')
+        if not signatures:
+            return False
+        if self.block_signatures and self.block_signatures.isdisjoint(signatures):
+            return False
+        client = client_address(event_data['client_ip'])
+        return client.is_public and not get_client_resolver().is_trusted(client.ip)
+
+    def record(self, event_data: dict, now: float = None):
+        if self.should_block(event_data):
+            if self.blocklist.add(event_data['client_ip'], now):
+                log.info(f"Blocking {event_data['client_ip']} at the firewall for {self.blocklist.ttl}s "
+                         f"(signatures: {','.join(event_data['signatures'])})")
+
+    async def apply_changes(self, now: float = None) -> bool:
+        """Expires old entries and applies everything that changed as one batch. Returns False if it failed."""
+        self.blocklist.expire(now)
+        adds, deletes = self.blocklist.take_changes(full=self._resync, now=now)
+        if not adds and not deletes:
+            return True
+        started = time.monotonic()
+        try:
+            await self.backend.apply(adds, deletes)
+        except FirewallError as e:
+            self.batch_failures += 1
+            self.blocklist.requeue_deletes(deletes)
+            self._resync = True
+            log.error(f"Could not apply {len(adds)} firewall adds and {len(deletes)} deletes "
+                      f"via {self.backend.name}, will re-sync: {e}")
+            return False
+        self.last_batch_seconds = time.monotonic() - started
+        self.batches += 1
+        self._resync = False
+        self._export_stale = True
+        log.debug(f"Applied {len(adds)} firewall adds and {len(deletes)} deletes via {self.backend.name} "
+                  f"in {self.last_batch_seconds:.3f}s")
+        return True
+
+    async def export(self):
+        if not self._export_stale or not self.export_path:
+            return
+        self._export_stale = False
+        try:
+            await asyncio.to_thread(write_export_file, self.export_path, self.blocklist.entries())
+        except OSError as e:
+            log.error(f"Could not write the blocklist to {self.export_path}: {e}")
+
+    async def run(self, interval: float = None):
+        interval = interval or config.FIREWALL_APPLY_INTERVAL_SECONDS
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.apply_changes()
+                await self.export()
+            except Exception:
+                log.exception("Firewall export round failed")
+
+    def stats(self) -> dict:
+        return {
+            **self.blocklist.stats(),
+            'batches': self.batches,
+            'batch_failures': self.batch_failures,
+            'last_batch_seconds': round(self.last_batch_seconds, 6),
+        }
+
+
+_exporter = None
+
+def get_firewall_exporter() -> FirewallExporter:
+    global _exporter
+    if _exporter is None:
+        _exporter = FirewallExporter()
+        log.info(f"Firewall export via {_exporter.backend.name}: block for {_exporter.blocklist.ttl}s, "
+                 f"list written to {_exporter.export_path}")
+    return _exporter
+
+def record_firewall_event(event_data: dict):
+    if config.FIREWALL_ENABLED:
+        get_firewall_exporter().record(event_data)
+
+async def run_firewall_exporter():
+    await get_firewall_exporter().run()
+
+async def stop_firewall_exporter():
+    """Applies and exports the last changes; call after the listener has drained."""
+    if _exporter is None:
+        return
+    await _exporter.apply_changes()
+    await _exporter.export()
+
+def get_firewall_stats() -> dict:
+    return _exporter.stats() if _exporter is not None else {}
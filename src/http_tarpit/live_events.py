@@ -0,0 +1,254 @@
+import asyncio
+import datetime
+import json
+import logging
+import time
+from collections import Counter, deque
+
+from . import config
+
+log = logging.getLogger(__name__)
+
+STARTED = 'started'
+FINISHED = 'finished'
+KINDS = (STARTED, FINISHED)
+OTHER_KEY = '(other)'
+UNKNOWN_KEY = 'unknown'
+
+
+class MinuteBucket:
+    __slots__ = ('minute', 'started', 'finished', 'held_seconds', 'counts')
+
+    def __init__(self, minute: int):
+        self.minute = minute
+        self.started = 0
+        self.finished = 0
+        self.held_seconds = 0.0
+        self.counts = {dimension: Counter() for dimension in RollingWindows.DIMENSIONS}
+
+
+class RollingWindows:
+    """
+    Per-minute request counts by country, ASN, path and signature for the
+    last `minutes` minutes, updated as events arrive. Totals over the whole
+    window are kept alongside, so the common query is a single Counter; a
+    minute's distinct values per dimension are capped at `max_keys`, the
+    rest counted as "(other)". Event loop thread only.
+    """
+
+    DIMENSIONS = ('country', 'asn', 'path', 'signature')
+
+    def __init__(self, minutes: int = None, max_keys: int = None):
+        self.minutes = minutes or config.LIVE_WINDOW_MINUTES
+        self.max_keys = max_keys or config.LIVE_WINDOW_MAX_KEYS
+        self._buckets = deque()
+        self._totals = {dimension: Counter() for dimension in self.DIMENSIONS}
+
+    def record_started(self, values: dict, now: float = None):
+        """values: dimension -> one value or a tuple of values (signatures)."""
+        bucket = self._bucket(time.time() if now is None else now)
+        bucket.started += 1
+        for dimension, value in values.items():
+            counts = bucket.counts[dimension]
+            for key in value if isinstance(value, tuple) else (value,):
+                if key not in counts and len(counts) >= self.max_keys:
+                    key = OTHER_KEY
+                counts[key] += 1
+                self._totals[dimension][key] += 1
+
+    def record_finished(self, held_seconds: float, now: float = None):
+        bucket = self._bucket(time.time() if now is None else now)
+        bucket.finished += 1
+        bucket.held_seconds += held_seconds
+
+    def top(self, dimension: str, minutes: int = None, limit: int = 20, now: float = None) -> list:
+        """Most frequent values of `dimension` over the last `minutes` minutes (the whole window by default)."""
+        self.expire(now)
+        if minutes is None or minutes >= self.minutes:
+            return self._totals[dimension].most_common(limit)
+        first = self._minute(now) - minutes + 1
+        counts = Counter()
+        for bucket in self._buckets:
+            if bucket.minute >= first:
+                counts.update(bucket.counts[dimension])
+        return counts.most_common(limit)
+
+    def series(self, minutes: int = None, now: float = None) -> list:
+        """Per-minute totals, oldest first; minutes without events are left out."""
+        self.expire(now)
+        first = self._minute(now) - (minutes or self.minutes) + 1
+        return [{
+            'minute': datetime.datetime.fromtimestamp(bucket.minute * 60, datetime.timezone.utc).isoformat(),
+            'started': bucket.started,
+            'finished': bucket.finished,
+            'held_seconds': round(bucket.held_seconds, 3),
+        } for bucket in self._buckets if bucket.minute >= first]
+
+    def expire(self, now: float = None):
+        oldest = self._minute(now) - self.minutes + 1
+        while self._buckets and self._buckets[0].minute < oldest:
+            bucket = self._buckets.popleft()
+            for dimension, counts in bucket.counts.items():
+                totals = self._totals[dimension]
+                for key, count in counts.items():
+                    remaining = totals[key] - count
+                    if remaining > 0:
+                        totals[key] = remaining
+                    else:
+                        del totals[key]
+
+    def _minute(self, now: float = None) -> int:
+        return int((time.time() if now is None else now) // 60)
+
+    def _bucket(self, now: float) -> MinuteBucket:
+        minute = int(now // 60)
+        if not self._buckets or self._buckets[-1].minute != minute:
+            self._buckets.append(MinuteBucket(minute))
+            self.expire(now)
+        return self._buckets[-1]
+
+
+class Subscriber:
+    """One stream client: a bounded queue of (seq, kind, data) and the transport to abort if it falls behind."""
+
+    __slots__ = ('queue', 'kinds', 'transport', 'dropped')
+
+    def __init__(self, queue_size: int, kinds=None, transport=None):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.kinds = kinds
+        self.transport = transport
+        self.dropped = False
+
+
+class EventHub:
+    """
+    Fans connection events out to stream subscribers. Each event is
+    serialized once, kept in a ring buffer of the last `ring_size` for
+    replay, and put on every subscriber's queue without waiting; a
+    subscriber whose queue is full is dropped and its connection aborted,
+    so a slow dashboard can never hold up the tarpit. Event loop thread only.
+    """
+
+    def __init__(self, ring_size: int = None, queue_size: int = None):
+        self.queue_size = queue_size or config.LIVE_EVENTS_SUBSCRIBER_QUEUE
+        self._ring = deque(maxlen=ring_size or config.LIVE_EVENTS_RING_SIZE)
+        self._subscribers = set()
+        self._seq = 0
+        self.windows = RollingWindows()
+        self.published = 0
+        self.dropped_subscribers = 0
+
+    def publish(self, kind: str, payload: dict):
+        self._seq += 1
+        message = (self._seq, kind, json.dumps(payload, default=str))
+        self._ring.append(message)
+        self.published += 1
+        for subscriber in tuple(self._subscribers):
+            if subscriber.kinds is not None and kind not in subscriber.kinds:
+                continue
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+
+    def subscribe(self, kinds=None, transport=None) -> Subscriber:
+        subscriber = Subscriber(self.queue_size, kinds, transport)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def recent(self, after_seq: int = 0, kinds=None, limit: int = None) -> list:
+        """Buffered events newer than after_seq, oldest first; the last `limit` of them when given."""
+        messages = [message for message in self._ring
+                    if message[0] > after_seq and (kinds is None or message[1] in kinds)]
+        return messages[-limit:] if limit else messages
+
+    def close(self):
+        """Ends every stream; subscribers get None as their last item."""
+        for subscriber in self._subscribers:
+            if subscriber.queue.full():
+                subscriber.queue.get_nowait()
+            subscriber.queue.put_nowait(None)
+        self._subscribers.clear()
+
+    def _drop(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+        subscriber.dropped = True
+        self.dropped_subscribers += 1
+        log.info(f"Dropping live event subscriber {_peer(subscriber.transport)}: "
+                 f"{subscriber.queue.qsize()} events behind")
+        if subscriber.transport is not None:
+            subscriber.transport.abort()
+
+    def stats(self) -> dict:
+        return {
+            'subscribers': len(self._subscribers),
+            'buffered': len(self._ring),
+            'published': self.published,
+            'dropped_subscribers': self.dropped_subscribers,
+        }
+
+
+def _peer(transport) -> str:
+    peername = transport.get_extra_info('peername') if transport is not None else None
+    return f"{peername[0]}:{peername[1]}" if peername else "(unknown)"
+
+
+def _base_payload(event_data: dict) -> dict:
+    geoip_data = event_data.get('geoip_data') or {}
+    return {
+        'timestamp': event_data.get('timestamp'),
+        'client_ip': event_data.get('client_ip'),
+        'client_port': event_data.get('client_port'),
+        'target_port': event_data.get('target_port'),
+        'http_method': event_data.get('http_method'),
+        'http_path': event_data.get('http_path'),
+        'user_agent': event_data.get('user_agent'),
+        'signatures': event_data.get('signatures'),
+        'country_iso_code': geoip_data.get('country_iso_code'),
+        'asn_number': geoip_data.get('asn_number'),
+        'asn_organization': geoip_data.get('asn_organization'),
+    }
+
+
+_hub = None
+
+def get_event_hub() -> EventHub:
+    global _hub
+    if _hub is None:
+        _hub = EventHub()
+    return _hub
+
+def publish_connection_started(event_data: dict):
+    if not config.LIVE_EVENTS_ENABLED:
+        return
+    hub = get_event_hub()
+    payload = _base_payload(event_data)
+    hub.windows.record_started({
+        'country': payload['country_iso_code'] or UNKNOWN_KEY,
+        'asn': str(payload['asn_number'] or UNKNOWN_KEY),
+        'path': payload['http_path'] or '/',
+        'signature': tuple(payload['signatures'] or ()),
+    })
+    hub.publish(STARTED, payload)
+
+def publish_connection_finished(event_data: dict):
+    if not config.LIVE_EVENTS_ENABLED:
+        return
+    hub = get_event_hub()
+    payload = _base_payload(event_data)
+    payload.update(
+        duration_s=event_data.get('duration_s'),
+        bytes_sent=event_data.get('bytes_sent'),
+        response_status=event_data.get('response_status'),
+        drip_strategy=event_data.get('drip_strategy'),
+        fingerprint=event_data.get('fingerprint'),
+        error_message=event_data.get('error_message'),
+    )
+    hub.windows.record_finished(event_data.get('duration_s') or 0.0)
+    hub.publish(FINISHED, payload)
+
+def get_live_event_stats() -> dict:
+    return _hub.stats() if _hub is not None else {}
@@ -1,25 +1,43 @@
 import logging
+import logging.handlers
+import atexit
+import copy
+import gzip
 import json
 import datetime
+import os
+import queue
+import shutil
 import sys
-import traceback 
+import time
+import traceback
 
 
-from . import config 
+from . import config
+
+# check_circular off and compact separators: log records are plain dicts and
+# strings, and this runs once per record on the listener thread.
+_json_encoder = json.JSONEncoder(ensure_ascii=False, default=str, check_circular=False, separators=(',', ':'))
 
 class JsonFormatter(logging.Formatter):
     def format(self, record):
+        extra_data = getattr(record, 'extra_data', None)
+        if isinstance(extra_data, dict) and extra_data and not record.exc_info and not record.exc_text:
+            line = self._format_extra_data(record, extra_data)
+            if line is not None:
+                return line
+
         log_record = {
             'timestamp': datetime.datetime.fromtimestamp(record.created, tz=datetime.timezone.utc).isoformat(),
             'level': record.levelname,
-            'name': record.name, 
+            'name': record.name,
             'message': record.getMessage(),
         }
-        
+
         if hasattr(record, 'extra_data') and isinstance(record.extra_data, dict):
             log_record.update(record.extra_data)
 
-        
+
         if record.exc_info:
             log_record['exception_info'] = {
                 'type': record.exc_info[0].__name__,
@@ -30,8 +48,8 @@ class JsonFormatter(logging.Formatter):
              log_record['exception_text'] = record.exc_text
 
         try:
-            return json.dumps(log_record, ensure_ascii=False, default=str)
-        except TypeError as e:
+            return _json_encoder.encode(log_record)
+        except (TypeError, ValueError) as e:
             error_log = {
                 'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
                 'level': 'ERROR', 'name': 'JsonFormatter',
@@ -40,9 +58,146 @@ class JsonFormatter(logging.Formatter):
             }
             return json.dumps(error_log)
 
-def setup_logging():
+    @staticmethod
+    def _format_extra_data(record, extra_data: dict):
+        """
+        Fast path for records carrying extra_data (every connection event):
+        the event dict is encoded as it is and only the record fields it does
+        not override are spliced in front, instead of merging both into a new
+        dict. Returns None to fall back to the generic path.
+        """
+        head = {}
+        if 'timestamp' not in extra_data:
+            head['timestamp'] = datetime.datetime.fromtimestamp(record.created, tz=datetime.timezone.utc).isoformat()
+        if 'level' not in extra_data:
+            head['level'] = record.levelname
+        if 'name' not in extra_data:
+            head['name'] = record.name
+        if 'message' not in extra_data:
+            head['message'] = record.getMessage()
+        try:
+            body = _json_encoder.encode(extra_data)
+            if not head:
+                return body
+            return _json_encoder.encode(head)[:-1] + ',' + body[1:]
+        except (TypeError, ValueError):
+            return None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread without formatting them.
+
+    prepare() only merges msg/args and snapshots extra_data (callers keep
+    mutating their event dicts after logging them); JSON encoding happens on
+    the listener thread. When the bounded queue is full the record is dropped
+    and counted instead of blocking the event loop.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        extra_data = getattr(record, 'extra_data', None)
+        if isinstance(extra_data, dict):
+            record.extra_data = dict(extra_data)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                sys.stderr.write(f"Log queue full, dropped {self.dropped} records so far\n")
+
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotates when the file exceeds max_bytes or every interval_seconds, gzipping the rotated files."""
+
+    def __init__(self, filename, max_bytes: int, backup_count: int, interval_seconds: float = None):
+        super().__init__(filename, mode='a', maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.interval_seconds = interval_seconds
+        self.rollover_at = time.time() + interval_seconds if interval_seconds else None
+        self.follow_rotation = False
+        self.namer = lambda name: name + '.gz'
+        self.rotator = _gzip_rotator
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self.interval_seconds:
+            self.rollover_at = time.time() + self.interval_seconds
+
+    def stop_rotating(self):
+        """
+        Leaves rotation to another process writing the same file, and from
+        then on reopens the file whenever that process has rotated it away.
+        """
+        self.maxBytes = 0
+        self.rollover_at = None
+        self.follow_rotation = True
+
+    def emit(self, record):
+        if self.follow_rotation:
+            self._reopen_if_rotated()
+        super().emit(record)
+
+    def _reopen_if_rotated(self):
+        if self.stream is None:
+            return
+        try:
+            current = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            current = None
+        opened = os.fstat(self.stream.fileno())
+        if current is None or (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino):
+            self.stream.close()
+            self.stream = self._open()
+
+
+_queue_handler = None
+_listener = None
+_handlers = []
+
+def log_file_path(worker_index: int = None):
+    if worker_index is None:
+        return config.LOG_FILE
+    return config.LOG_FILE.with_name(f"{config.LOG_FILE.stem}.worker{worker_index}{config.LOG_FILE.suffix}")
+
+def setup_logging(worker_index: int = None, threaded: bool = True):
+    """
+    Routes all logging through a bounded queue to a listener thread that
+    formats and writes the records. Call again with worker_index in a forked
+    worker: the parent's listener thread does not survive the fork, and each
+    worker gets its own log file so rotation never races between processes.
+
+    threaded=False writes records directly from the logging call instead;
+    the supervisor uses it because it forks workers at any time and must
+    not have a thread that could hold a lock at that moment.
+    """
+    global _queue_handler, _listener, _handlers
+    log_file = log_file_path(worker_index)
     json_formatter = JsonFormatter()
-    file_handler = logging.FileHandler(config.LOG_FILE, mode='a', encoding='utf-8')
+    file_handler = CompressingRotatingFileHandler(
+        log_file,
+        max_bytes=config.LOG_ROTATE_MAX_BYTES,
+        backup_count=config.LOG_BACKUP_COUNT,
+        interval_seconds=config.LOG_ROTATE_INTERVAL_SECONDS,
+    )
     file_handler.setFormatter(json_formatter)
     file_handler.setLevel(config.LOG_LEVEL) # Уровень для файла
 
@@ -51,18 +206,67 @@ def setup_logging():
     console_handler.setFormatter(console_formatter)
     console_handler.setLevel(config.CONSOLE_LOG_LEVEL) # Уровень для консоли
 
-    root_logger = logging.getLogger() 
+    root_logger = logging.getLogger()
     root_logger.setLevel(min(config.LOG_LEVEL, config.CONSOLE_LOG_LEVEL))
 
     if root_logger.hasHandlers():
         root_logger.handlers.clear()
+    if _listener is not None and worker_index is None:
+        stop_logging()
+    else:
+        # Forked worker: the parent's listener thread (if any) does not exist
+        # here, only close our copies of its handlers.
+        for handler in _handlers:
+            handler.close()
+        _listener = None
 
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
+    _handlers = [file_handler, console_handler]
+    if threaded:
+        log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+        _queue_handler = DroppingQueueHandler(log_queue)
+        _listener = logging.handlers.QueueListener(log_queue, *_handlers, respect_handler_level=True)
+        _listener.start()
+        root_logger.addHandler(_queue_handler)
+    else:
+        _queue_handler = None
+        for handler in _handlers:
+            root_logger.addHandler(handler)
 
     logging.getLogger('aiohttp.access').setLevel(logging.WARNING)
     logging.getLogger('aiohttp.web').setLevel(logging.WARNING)
     logging.getLogger('aiohttp.server').setLevel(logging.INFO)
 
     log = logging.getLogger(__name__)
-    log.info(f"Logging setup complete. File: {config.LOG_FILE} (Level: {logging.getLevelName(config.LOG_LEVEL)}), Console Level: {logging.getLevelName(config.CONSOLE_LOG_LEVEL)}")
\ No newline at end of file
+    log.info(f"Logging setup complete. File: {log_file} (Level: {logging.getLevelName(config.LOG_LEVEL)}), Console Level: {logging.getLevelName(config.CONSOLE_LOG_LEVEL)}")
+
+def stop_logging():
+    """Drains the queue and closes the handlers. Safe to call more than once."""
+    global _listener, _handlers
+    listener, handlers = _listener, _handlers
+    _listener, _handlers = None, []
+    if listener is not None:
+        listener.stop()
+    for handler in handlers:
+        handler.close()
+    if listener is not None and _queue_handler is not None and _queue_handler.dropped:
+        sys.stderr.write(f"Logging stopped, {_queue_handler.dropped} records were dropped on a full queue\n")
+
+atexit.register(stop_logging)
+
+def stop_log_rotation():
+    """
+    Called when a restart drain starts: the successor writes the same log
+    file and rotates it from now on, so two processes never rename it at once.
+    """
+    for handler in _handlers:
+        if isinstance(handler, CompressingRotatingFileHandler):
+            handler.stop_rotating()
+
+def get_logging_stats() -> dict:
+    if _queue_handler is None:
+        return {}
+    return {
+        'queue_depth': _queue_handler.queue.qsize(),
+        'queue_capacity': _queue_handler.queue.maxsize,
+        'dropped': _queue_handler.dropped,
+    }
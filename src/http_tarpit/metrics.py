@@ -0,0 +1,75 @@
+import asyncio
+from bisect import bisect_left
+
+# Metric primitives for the hot paths. Updates are plain attribute/list
+# increments with no locks: everything except the DB writer's flush
+# histogram is touched from the event loop thread only, and that one has a
+# single writer thread. A scrape may read a histogram mid-update and be off
+# by one observation, which is fine for capacity planning.
+
+HOLD_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 21600)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Family:
+    """Metrics of one kind sharing a name and help text, one child per label value."""
+
+    def __init__(self, name: str, help_text: str, label: str, factory):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._factory = factory
+        self.children = {}
+
+    def labels(self, value):
+        child = self.children.get(value)
+        if child is None:
+            child = self.children[value] = self._factory()
+        return child
+
+
+REQUESTS = Family('tarpit_requests_total', 'Requests that reached the tarpit, by engine.', 'engine', Counter)
+HOLD_DURATION = Family('tarpit_hold_duration_seconds', 'How long finished connections were held, by drip strategy.',
+                       'strategy', lambda: Histogram(HOLD_BUCKETS))
+SIGNATURE_MATCHES = Family('tarpit_signature_matches_total', 'Requests matching each scanner signature rule.',
+                           'signature', Counter)
+DB_FLUSH_SECONDS = Histogram(LATENCY_BUCKETS)
+LOOP_LAG_SECONDS = Histogram(LATENCY_BUCKETS)
+loop_lag_last = 0.0
+
+
+async def monitor_loop_lag(interval: float):
+    """Measures how late a sleep(interval) wakes up; that lateness is what every callback waits."""
+    global loop_lag_last
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        loop_lag_last = lag
+        LOOP_LAG_SECONDS.observe(lag)
@@ -0,0 +1,168 @@
+import asyncio
+import errno
+import logging
+import socket
+import time
+from aiohttp import web
+
+from . import config
+from . import metrics
+from .admission import get_admission_stats
+from .database import get_event_writer_stats, get_reported_ip_cache_stats
+from .drip_scheduler import get_drip_stats
+from .drip_strategies import get_client_profile_stats
+from .firewall import get_firewall_stats
+from .live_events import get_live_event_stats
+from .logger_setup import get_logging_stats
+from .raw_protocol import get_raw_engine_stats
+from .reporting.abuseipdb_reporter import get_reporter_stats
+from .sessions import get_session_stats
+from .utils.geoip_lookup import get_geoip_cache_stats
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Subsystem stats exported as tarpit_<prefix>_<key>. Keys listed in
+# _GAUGE_KEYS are point-in-time values, every other number is a counter;
+# non-numeric values (e.g. the admission shed action) are skipped.
+_STATS_SOURCES = (
+    ('drip', get_drip_stats),
+    ('admission', get_admission_stats),
+    ('raw_engine', get_raw_engine_stats),
+    ('db_writer', get_event_writer_stats),
+    ('reported_ip_cache', get_reported_ip_cache_stats),
+    ('geoip_cache', get_geoip_cache_stats),
+    ('abuseipdb', get_reporter_stats),
+    ('log_queue', get_logging_stats),
+    ('client_profiles', get_client_profile_stats),
+    ('sessions', get_session_stats),
+    ('firewall', get_firewall_stats),
+    ('live_events', get_live_event_stats),
+)
+_GAUGE_KEYS = frozenset((
+    'active', 'active_connections', 'active_holds', 'peak_holds', 'max_holds', 'tracked_ips', 'tracked_prefixes', 'tracked_asns',
+    'open_connections', 'queue_depth', 'queue_capacity', 'in_flight', 'size', 'max_entries', 'hit_ratio',
+    'last_flush_seconds', 'entries', 'pending_adds', 'pending_deletes', 'last_batch_seconds',
+    'subscribers', 'buffered',
+))
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _render_histogram(lines: list, name: str, histogram, labels: str = ''):
+    cumulative = 0
+    prefix = f'{labels},' if labels else ''
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}')
+    suffix = f'{{{labels}}}' if labels else ''
+    lines.append(f'{name}_sum{suffix} {_format_value(histogram.sum)}')
+    lines.append(f'{name}_count{suffix} {histogram.count}')
+
+def render_metrics() -> str:
+    """Prometheus text exposition of the hot-path metrics and every subsystem's stats()."""
+    lines = []
+    for family in (metrics.REQUESTS, metrics.SIGNATURE_MATCHES, metrics.HOLD_DURATION):
+        kind = 'histogram' if family is metrics.HOLD_DURATION else 'counter'
+        lines.append(f'# HELP {family.name} {family.help_text}')
+        lines.append(f'# TYPE {family.name} {kind}')
+        for value, child in sorted(family.children.items()):
+            labels = f'{family.label}="{value}"'
+            if kind == 'histogram':
+                _render_histogram(lines, family.name, child, labels)
+            else:
+                lines.append(f'{family.name}{{{labels}}} {child.value}')
+
+    lines.append('# HELP tarpit_db_flush_seconds Time spent in one SQLite writer transaction.')
+    lines.append('# TYPE tarpit_db_flush_seconds histogram')
+    _render_histogram(lines, 'tarpit_db_flush_seconds', metrics.DB_FLUSH_SECONDS)
+    lines.append('# HELP tarpit_event_loop_lag_seconds How late the event loop ran a timer.')
+    lines.append('# TYPE tarpit_event_loop_lag_seconds histogram')
+    _render_histogram(lines, 'tarpit_event_loop_lag_seconds', metrics.LOOP_LAG_SECONDS)
+    lines.append('# TYPE tarpit_event_loop_lag_last_seconds gauge')
+    lines.append(f'tarpit_event_loop_lag_last_seconds {_format_value(metrics.loop_lag_last)}')
+
+    for prefix, get_stats in _STATS_SOURCES:
+        for key, value in get_stats().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if key in _GAUGE_KEYS:
+                name, kind = f'tarpit_{prefix}_{key}', 'gauge'
+            else:
+                name, kind = f'tarpit_{prefix}_{key}_total', 'counter'
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {_format_value(value)}')
+    lines.append('')
+    return '\n'.join(lines)
+
+async def handle_metrics(request):
+    return web.Response(body=render_metrics().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+
+async def bind_side_port(host: str, port: int, what: str):
+    """
+    Listening socket for a side listener (metrics, live events), bound
+    without SO_REUSEPORT so that requests never go to two generations at
+    random. While a restart hand-off is under way the predecessor still
+    holds the port until its drain starts, so the bind is retried for
+    SIDE_PORT_BIND_TIMEOUT_SECONDS. Returns None if the port stays taken.
+    """
+    family = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][0]
+    deadline = time.monotonic() + config.SIDE_PORT_BIND_TIMEOUT_SECONDS
+    waiting = False
+    while True:
+        try:
+            return socket.create_server((host, port), family=family)
+        except OSError as e:
+            if e.errno != errno.EADDRINUSE:
+                raise
+            if time.monotonic() >= deadline:
+                log.error(f"{what} port {host}:{port} is still in use after "
+                          f"{config.SIDE_PORT_BIND_TIMEOUT_SECONDS}s, running without it")
+                return None
+            if not waiting:
+                log.info(f"{what} port {host}:{port} is in use, waiting for the previous process to release it")
+                waiting = True
+        await asyncio.sleep(0.2)
+
+
+class MetricsSite:
+    """
+    Opt-in /metrics listener on its own port, so scrapes never share the
+    tarpit's accept queue or admission budget. Also runs the event loop lag
+    monitor. Workers listen on METRICS_PORT + worker index.
+
+    Only one process serves a given metrics port: on a restart the old one
+    closes it before draining and the successor binds it after that (see
+    bind_side_port), so a scrape never lands on the old generation's counters.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._runner = None
+        self._lag_monitor = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        sock = await bind_side_port(self.host, self.port, "Metrics")
+        if sock is None:
+            return
+        await web.SockSite(self._runner, sock).start()
+        self._lag_monitor = asyncio.create_task(
+            metrics.monitor_loop_lag(config.METRICS_LOOP_LAG_INTERVAL_SECONDS), name="loop-lag-monitor")
+        log.info(f"Metrics available on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._lag_monitor is not None:
+            self._lag_monitor.cancel()
+            self._lag_monitor = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
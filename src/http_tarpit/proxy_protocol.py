@@ -0,0 +1,185 @@
+import asyncio
+import functools
+import ipaddress
+import logging
+import struct
+
+from aiohttp import web
+
+from . import config
+from .utils.client_address import get_client_resolver
+
+log = logging.getLogger(__name__)
+
+V1_PREFIX = b'PROXY '
+V1_MAX_LENGTH = 107
+V2_SIGNATURE = b'\r\n\r\n\x00\r\nQUIT\n'
+_V2_HEADER = struct.Struct('!12sBBH')
+_V2_TCP4 = struct.Struct('!4s4sHH')
+_V2_TCP6 = struct.Struct('!16s16sHH')
+
+
+class ProxyProtocolError(ValueError):
+    pass
+
+
+def parse_proxy_header(data) -> tuple:
+    """
+    Parses a PROXY protocol v1 or v2 header at the start of `data`. Returns
+    (consumed, source): consumed is 0 while more bytes are needed; source is
+    the client's (ip, port), or None for LOCAL/UNKNOWN connections (health
+    checks), which keep the real peer. Raises ProxyProtocolError.
+    """
+    if data[:1] == b'P':
+        if not V1_PREFIX.startswith(bytes(data[:len(V1_PREFIX)])):
+            raise ProxyProtocolError("Not a PROXY protocol header")
+        end = data.find(b'\r\n')
+        if end < 0:
+            if len(data) >= V1_MAX_LENGTH:
+                raise ProxyProtocolError("PROXY v1 header too long")
+            return 0, None
+        fields = bytes(data[:end]).decode('ascii', 'replace').split(' ')
+        if len(fields) >= 2 and fields[1] == 'UNKNOWN':
+            return end + 2, None
+        if len(fields) != 6 or fields[1] not in ('TCP4', 'TCP6'):
+            raise ProxyProtocolError(f"Malformed PROXY v1 header {fields[:2]}")
+        try:
+            source = ipaddress.ip_address(fields[2])
+            port = int(fields[4])
+        except ValueError as e:
+            raise ProxyProtocolError(f"Malformed PROXY v1 address: {e}") from None
+        return end + 2, (str(source), port)
+
+    if not V2_SIGNATURE.startswith(bytes(data[:len(V2_SIGNATURE)])):
+        raise ProxyProtocolError("Not a PROXY protocol header")
+    if len(data) < _V2_HEADER.size:
+        return 0, None
+    _, version_command, family, length = _V2_HEADER.unpack_from(data)
+    if version_command >> 4 != 2:
+        raise ProxyProtocolError(f"Unsupported PROXY protocol version {version_command >> 4}")
+    total = _V2_HEADER.size + length
+    if len(data) < total:
+        return 0, None
+    command = version_command & 0x0F
+    if command == 0:
+        return total, None
+    if command != 1:
+        raise ProxyProtocolError(f"Unknown PROXY v2 command {command}")
+    if family == 0x11 and length >= _V2_TCP4.size:
+        source, _, port, _ = _V2_TCP4.unpack_from(data, _V2_HEADER.size)
+        return total, (str(ipaddress.IPv4Address(source)), port)
+    if family == 0x21 and length >= _V2_TCP6.size:
+        source, _, port, _ = _V2_TCP6.unpack_from(data, _V2_HEADER.size)
+        return total, (str(ipaddress.IPv6Address(source)), port)
+    # UDP, unix sockets, unspecified: nothing usable as a client address.
+    return total, None
+
+
+class _ProxiedTransport:
+    """The connection's transport with its peername replaced by the PROXY header's source."""
+
+    __slots__ = ('_transport', '_peername')
+
+    def __init__(self, transport, peername):
+        self._transport = transport
+        self._peername = peername
+
+    def get_extra_info(self, name, default=None):
+        if name == 'peername':
+            return self._peername
+        return self._transport.get_extra_info(name, default)
+
+    def __getattr__(self, name):
+        return getattr(self._transport, name)
+
+
+class ProxyProtocolWrapper(asyncio.Protocol):
+    """
+    Reads the PROXY header of a connection from a trusted proxy, then hands
+    the transport (reporting the proxied client as its peer) to the protocol
+    made by `factory` and steps out of the way. Connections from untrusted
+    peers, without a valid header, or silent for RAW_REQUEST_TIMEOUT_SECONDS
+    are aborted.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._transport = None
+        self._buffer = bytearray()
+        self._timeout = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+        peername = transport.get_extra_info('peername')
+        if not peername or not get_client_resolver().is_trusted(peername[0]):
+            log.debug(f"Dropping connection from untrusted peer {peername} on the PROXY protocol listener")
+            transport.abort()
+            return
+        self._timeout = asyncio.get_running_loop().call_later(config.RAW_REQUEST_TIMEOUT_SECONDS, transport.abort)
+
+    def data_received(self, data):
+        self._buffer += data
+        try:
+            consumed, source = parse_proxy_header(self._buffer)
+        except ProxyProtocolError as e:
+            log.debug(f"Bad PROXY header from {self._transport.get_extra_info('peername')}: {e}")
+            self._close()
+            self._transport.abort()
+            return
+        if not consumed:
+            return
+        rest = bytes(self._buffer[consumed:])
+        self._close()
+        protocol = self._factory()
+        self._transport.set_protocol(protocol)
+        protocol.connection_made(self._transport if source is None else _ProxiedTransport(self._transport, source))
+        if rest:
+            protocol.data_received(rest)
+
+    def eof_received(self):
+        self._close()
+        return False
+
+    def connection_lost(self, exc):
+        self._close()
+
+    def _close(self):
+        if self._timeout is not None:
+            self._timeout.cancel()
+            self._timeout = None
+        self._buffer = bytearray()
+
+
+def proxy_protocol_factory(factory):
+    """`factory`, behind a PROXY protocol header when PROXY_PROTOCOL is on."""
+    return functools.partial(ProxyProtocolWrapper, factory) if config.PROXY_PROTOCOL else factory
+
+
+class ProxyProtocolSite(web.BaseSite):
+    """web.TCPSite / web.SockSite for a listener behind a PROXY protocol load balancer."""
+
+    def __init__(self, runner, host: str = None, port: int = None, reuse_port: bool = False, sock=None,
+                 backlog: int = 128):
+        super().__init__(runner, backlog=backlog)
+        self._host = host
+        self._port = port
+        self._reuse_port = reuse_port
+        self._sock = sock
+
+    @property
+    def name(self) -> str:
+        if self._sock is not None:
+            host, port = self._sock.getsockname()[:2]
+        else:
+            host, port = self._host, self._port
+        return f"http://{host}:{port} (PROXY protocol)"
+
+    async def start(self):
+        await super().start()
+        loop = asyncio.get_running_loop()
+        factory = functools.partial(ProxyProtocolWrapper, self._runner.server)
+        if self._sock is not None:
+            self._server = await loop.create_server(factory, sock=self._sock, backlog=self._backlog)
+        else:
+            self._server = await loop.create_server(factory, self._host, self._port,
+                                                    reuse_port=self._reuse_port or None, backlog=self._backlog)
@@ -0,0 +1,368 @@
+import asyncio
+import logging
+import time
+from urllib.parse import unquote, urlsplit
+
+from . import config
+from .drip_scheduler import get_drip_scheduler, CONNECTION_RESET_ERROR, SHUTDOWN_ERROR
+from .admission import (
+    admit_client, assign_hold_asn, release_hold, shed_connection, get_admission_controller, ADMIT, CLOSE, RESET,
+)
+from .request_handler import (
+    resolve_client_address, parse_target_port, new_event_log_data,
+    enrich_event, finish_event, finish_shed_event, select_drip_strategy,
+)
+from .metrics import REQUESTS
+from .proxy_protocol import proxy_protocol_factory
+
+log = logging.getLogger(__name__)
+
+_LAST_CHUNK = b"0\r\n\r\n"
+_BAD_REQUEST = (
+    b"HTTP/1.1 400 Bad Request\r\nContent-Type: text/plain\r\nContent-Length: 11\r\n"
+    b"Connection: close\r\n\r\nBad Request"
+)
+
+_stats = {
+    'accepted': 0,
+    'requests': 0,
+    'bad_requests': 0,
+    'timeouts': 0,
+    'rejected_at_accept': 0,
+}
+_connections = set()
+_enrichments = set()
+_protocol_requests = REQUESTS.labels('protocol')
+# Responses only vary by a few flags, so every head is encoded once.
+_response_heads = {}
+
+
+def response_head(chunked: bool, keep_alive: bool, content_encoding: str = None) -> bytes:
+    key = (chunked, keep_alive, content_encoding)
+    head = _response_heads.get(key)
+    if head is None:
+        lines = [
+            "HTTP/1.1 200 OK" if chunked else "HTTP/1.0 200 OK",
+            "Content-Type: text/plain",
+            "Connection: keep-alive" if keep_alive else "Connection: close",
+        ]
+        if content_encoding:
+            lines.append(f"Content-Encoding: {content_encoding}")
+        if chunked:
+            lines.append("Transfer-Encoding: chunked")
+        head = _response_heads[key] = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+    return head
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def parse_request_head(head: bytes):
+    """
+    Parses a request line and header block (without the final blank line).
+    Returns (method, target, (major, minor), headers, lowercase_headers);
+    `headers` keeps the client's spelling with the last duplicate winning,
+    `lowercase_headers` keeps the first, like a multidict .get(), except
+    that repeated X-Forwarded-For headers are joined in order.
+    """
+    lines = head.decode('latin-1').split('\r\n')
+    parts = lines[0].split(' ')
+    if len(parts) != 3 or not parts[0].isalpha() or not parts[1]:
+        raise BadRequest(f"Malformed request line: {lines[0][:100]!r}")
+    method, target, version = parts
+    major, _, minor = version[5:].partition('.')
+    if not version.startswith('HTTP/') or not major.isdigit() or not minor.isdigit():
+        raise BadRequest(f"Malformed HTTP version: {version[:20]!r}")
+    headers = {}
+    lowercase_headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if not sep or not name or name != name.strip():
+            raise BadRequest(f"Malformed header line: {line[:100]!r}")
+        value = value.strip()
+        headers[name] = value
+        lower = name.lower()
+        if lower in lowercase_headers:
+            if lower == 'x-forwarded-for':
+                lowercase_headers[lower] += ',' + value
+        else:
+            lowercase_headers[lower] = value
+    return method.upper(), target, (int(major), int(minor)), headers, lowercase_headers
+
+
+def split_request_target(target: str):
+    """Returns (decoded path, raw query string) for origin-form and absolute-form targets."""
+    target = target.partition('#')[0]
+    if target.startswith('/'):
+        path, _, query = target.partition('?')
+    else:
+        parts = urlsplit(target)
+        path, query = parts.path or '/', parts.query
+    return unquote(path), query
+
+
+class TarpitProtocol(asyncio.Protocol):
+    """
+    Minimal HTTP/1.x tarpit connection.
+
+    Buffers bytes until a complete request head arrives, parses it into the
+    same event_log_data the aiohttp handler builds, writes a pre-encoded
+    response head and hands the transport to the drip scheduler. Reading is
+    paused while the drip runs. GeoIP and AbuseIPDB enrichment run alongside
+    the drip, and the event is written once both are done.
+    """
+
+    __slots__ = ('transport', 'peername', 'buffer', 'drip', 'enrich', 'event', 'start_time',
+                 'chunked', 'keep_alive', 'body_remaining', 'timeout_handle', 'hold', 'strategy')
+
+    def __init__(self):
+        self.transport = None
+        self.peername = None
+        self.buffer = bytearray()
+        self.drip = None
+        self.enrich = None
+        self.event = None
+        self.start_time = 0.0
+        self.chunked = False
+        self.keep_alive = False
+        self.body_remaining = 0
+        self.timeout_handle = None
+        self.hold = None
+        self.strategy = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peername = transport.get_extra_info('peername')
+        if config.ADMISSION_ENABLED and len(_connections) >= get_admission_controller().max_total:
+            # Idle connections hold descriptors too; refuse before they cost anything else.
+            _stats['rejected_at_accept'] += 1
+            shed_connection(transport, RESET)
+            return
+        _connections.add(self)
+        _stats['accepted'] += 1
+        self._arm_timeout()
+
+    def connection_lost(self, exc):
+        _connections.discard(self)
+        self._cancel_timeout()
+        if self.drip is not None:
+            get_drip_scheduler().discard(self.drip, CONNECTION_RESET_ERROR)
+
+    def data_received(self, data):
+        if self.body_remaining and self.drip is None and not self.buffer:
+            skipped = min(self.body_remaining, len(data))
+            self.body_remaining -= skipped
+            data = data[skipped:]
+        if len(self.buffer) + len(data) > config.RAW_MAX_HEADER_BYTES:
+            if self.drip is not None:
+                # Pipelined data we are not reading yet; drop it rather than grow,
+                # and don't try to parse what is left of it afterwards.
+                self.keep_alive = False
+                return
+            self._reject("Request head too large")
+            return
+        self.buffer += data
+        if self.drip is None:
+            self._process()
+
+    def eof_received(self):
+        # A client that half-closes after its request still gets the full drip.
+        self.keep_alive = False
+        return self.drip is not None
+
+    def _arm_timeout(self):
+        loop = asyncio.get_running_loop()
+        self.timeout_handle = loop.call_later(config.RAW_REQUEST_TIMEOUT_SECONDS, self._on_timeout)
+
+    def _cancel_timeout(self):
+        if self.timeout_handle is not None:
+            self.timeout_handle.cancel()
+            self.timeout_handle = None
+
+    def _on_timeout(self):
+        self.timeout_handle = None
+        _stats['timeouts'] += 1
+        log.debug(f"Request head timeout from {self.peername}")
+        self.transport.close()
+
+    def _reject(self, reason: str):
+        _stats['bad_requests'] += 1
+        log.debug(f"Bad request from {self.peername}: {reason}")
+        self._cancel_timeout()
+        self.buffer.clear()
+        self.transport.write(_BAD_REQUEST)
+        self.transport.close()
+
+    def _process(self):
+        buffer = self.buffer
+        if self.body_remaining:
+            skipped = min(self.body_remaining, len(buffer))
+            del buffer[:skipped]
+            self.body_remaining -= skipped
+            if self.body_remaining:
+                return
+        while buffer.startswith(b'\r\n'):
+            del buffer[:2]
+        end = buffer.find(b'\r\n\r\n')
+        if end < 0:
+            return
+        head = bytes(buffer[:end])
+        del buffer[:end + 4]
+        try:
+            method, target, version, headers, lowercase_headers = parse_request_head(head)
+            path, query = split_request_target(target)
+            if 'transfer-encoding' in lowercase_headers:
+                self.keep_alive = False
+                self.body_remaining = 0
+            else:
+                self.keep_alive = version >= (1, 1) and lowercase_headers.get('connection', '').lower() != 'close'
+                self.body_remaining = int(lowercase_headers.get('content-length', '0'))
+                if self.body_remaining < 0:
+                    raise BadRequest("Negative Content-Length")
+        except ValueError as e:
+            self._reject(str(e))
+            return
+        self._cancel_timeout()
+        self._start_response(method, path, query, version, headers, lowercase_headers)
+
+    def _start_response(self, method, path, query, version, headers, lowercase_headers):
+        _stats['requests'] += 1
+        _protocol_requests.inc()
+        self.start_time = time.monotonic()
+        client, proxy_ip, proxy_port = resolve_client_address(
+            self.peername,
+            lowercase_headers.get('x-forwarded-for', ''),
+            lowercase_headers.get('x-real-ip', ''),
+        )
+        ip_addr = client.ip
+        hold = admit_client(client)
+        target_port = parse_target_port(lowercase_headers.get('x-tarpit-target-port', '0'))
+        event = new_event_log_data(
+            ip_addr, proxy_port, target_port, method, path, query,
+            f"{version[0]}.{version[1]}", lowercase_headers.get('user-agent', 'N/A'), headers,
+        )
+        if hold is not None and hold.action in (CLOSE, RESET):
+            log.debug(f"Shedding {ip_addr} over admission budget ({hold.action})")
+            shed_connection(self.transport, hold.action)
+            finish_shed_event(event, self.start_time, hold.action)
+            return
+        self.hold = hold
+        if hold is not None and hold.action != ADMIT:
+            self.keep_alive = False
+        self.event = event
+        self.event['response_status'] = 200
+        strategy, max_bytes = select_drip_strategy(hold, self.event, lowercase_headers.get('accept-encoding', ''))
+        self.strategy = strategy
+        if strategy.raw_head or strategy.content_encoding:
+            self.keep_alive = False
+
+        self.chunked = version >= (1, 1)
+        if not strategy.raw_head:
+            self.transport.write(response_head(self.chunked, self.keep_alive, strategy.content_encoding))
+            log.debug(f"Sent headers to {ip_addr}", extra={'extra_data': {'client_ip': ip_addr}})
+        self.transport.pause_reading()
+
+        event = self.event
+        self.enrich = asyncio.ensure_future(enrich_event(client, target_port, event))
+        _enrichments.add(self.enrich)
+        self.enrich.add_done_callback(_enrichments.discard)
+        self.enrich.add_done_callback(lambda _: assign_hold_asn(hold, event['geoip_data']))
+        self.drip = strategy.start(get_drip_scheduler(), self.transport, self.chunked, max_bytes)
+        self.drip.future.add_done_callback(self._on_drip_done)
+
+    def _on_drip_done(self, future):
+        drip, event, enrich, start_time = self.drip, self.event, self.enrich, self.start_time
+        self.drip = self.event = self.enrich = None
+        release_hold(self.hold)
+        self.hold = None
+        error_msg = drip.error
+        ip_addr = event['client_ip']
+        if error_msg:
+            event['error_message'] = error_msg
+            if error_msg == SHUTDOWN_ERROR:
+                log.info(f"Released {ip_addr} at shutdown", extra={'extra_data': {'client_ip': ip_addr}})
+            elif error_msg == CONNECTION_RESET_ERROR:
+                log.warning(error_msg, extra={'extra_data': {'client_ip': ip_addr}})
+            else:
+                log.error(f"Error writing to {ip_addr}:{event['client_port']}: {error_msg}", extra={'extra_data': {'client_ip': ip_addr}})
+
+        transport = self.transport
+        strategy, self.strategy = self.strategy, None
+        if not transport.is_closing():
+            if self.chunked and not error_msg and not strategy.raw_head:
+                transport.write(_LAST_CHUNK)
+            if self.keep_alive and not error_msg:
+                self._arm_timeout()
+                transport.resume_reading()
+                self._process()
+            else:
+                transport.close()
+
+        def finish(_=None):
+            if not enrich.cancelled() and enrich.exception() is not None:
+                log.error(f"Enrichment failed for {ip_addr}: {enrich.exception()}")
+            finish_event(event, start_time, drip.bytes_sent, error_msg)
+        if enrich.done():
+            finish()
+        else:
+            enrich.add_done_callback(finish)
+
+
+class RawTarpitSite:
+    """
+    Serves TarpitProtocol on host:port, or on an already listening `sock`.
+    Mirrors the bits of web.TCPSite that run_server uses: start() binds,
+    close() stops accepting, stop() also gives open connections
+    `shutdown_timeout` seconds and then aborts the rest.
+    """
+
+    def __init__(self, host: str, port: int, reuse_port: bool = False, shutdown_timeout: float = None, sock=None):
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port
+        self.shutdown_timeout = config.SHUTDOWN_GRACE_SECONDS if shutdown_timeout is None else shutdown_timeout
+        self.sock = sock
+        self._server = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self.sock is not None:
+            self._server = await loop.create_server(proxy_protocol_factory(TarpitProtocol), sock=self.sock,
+                                                    backlog=config.SERVER_BACKLOG)
+        else:
+            self._server = await loop.create_server(
+                proxy_protocol_factory(TarpitProtocol), self.host, self.port,
+                reuse_port=self.reuse_port or None, backlog=config.SERVER_BACKLOG,
+            )
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        deadline = time.monotonic() + self.shutdown_timeout
+        while _connections and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        if _connections:
+            log.info(f"Aborting {len(_connections)} connections still open after {self.shutdown_timeout}s")
+            for protocol in list(_connections):
+                protocol.transport.abort()
+            # connection_lost runs on the next loop iterations; let the
+            # aborted drips finish (and log their events) before returning.
+            deadline = time.monotonic() + 1.0
+            while _connections and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0)
+        if _enrichments:
+            # Finished drips whose event still waits for GeoIP/AbuseIPDB enrichment.
+            await asyncio.wait(list(_enrichments), timeout=5.0)
+        await self._server.wait_closed()
+        self._server = None
+
+
+def get_raw_engine_stats() -> dict:
+    return {**_stats, 'open_connections': len(_connections)}
@@ -1,67 +1,517 @@
 import logging
 import asyncio
-from aiohttp import ClientSession, ClientError, ClientResponseError
+import csv
+import email.utils
+import io
+import random
+import time
+from dataclasses import dataclass
+from aiohttp import ClientSession, ClientError, ClientTimeout, FormData, TCPConnector
 
 from .. import config
+from ..database import (
+    save_pending_report, delete_pending_report, load_pending_reports, release_ip_report_claim,
+    claim_ips_across_workers,
+)
 
 log = logging.getLogger(__name__)
 
-ABUSEIPDB_API_URL = 'https://api.abuseipdb.com/api/v2/report'
+ABUSEIPDB_API_URL = f"{config.ABUSEIPDB_API_BASE_URL}/report"
+ABUSEIPDB_BULK_API_URL = f"{config.ABUSEIPDB_API_BASE_URL}/bulk-report"
 
 
-async def report_ip_to_abuseipdb(ip_address: str,  target_port: int, comment_details: str):
-    """Асинхронная отправка репорта в AbuseIPDB"""
-    if not config.ABUSEIPDB_ENABLED:
-        log.debug("AbuseIPDB reporting is disabled in config.")
-        return
-    if not config.ABUSEIPDB_API_KEY:
-        log.error("AbusIPDB reporting is enablud, but API is missing!")
-        return
-    
-    headers = {
-        'Accept': 'application/json',
-        'Key': config.ABUSEIPDB_API_KEY
-    }
-    
-    params = {
-        'ip': ip_address,
-        'categories': config.ABUSEIPDB_CATEGORIES,
-        'comment': f"{config.ABUSEIPDB_COMMENT_PREFIX}{comment_details}"
-    }
-    
-    log.info(f"Attempting to report IP {ip_address} (from target port {target_port}) to AbuseIPDB. Categories: {params['categories']}")    
-    
+@dataclass(slots=True)
+class ReportJob:
+    ip_address: str
+    target_port: int
+    comment_details: str
+    report_timestamp: str = None
+    categories: str = None # None = ABUSEIPDB_CATEGORIES
+    attempts: int = 0
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pause_until(self, monotonic_deadline: float):
+        """Blocks all acquirers until the deadline, e.g. when the API answers with Retry-After."""
+        self._paused_until = max(self._paused_until, monotonic_deadline)
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _parse_retry_after(value: str):
+    if not value:
+        return None
     try:
-        async with ClientSession(headers=headers) as session:
-            async with session.post(ABUSEIPDB_API_URL, data=params) as response:
-                response_json = await response.json()
-                
-                response.raise_for_status()
-                response_json = await response.json()
-
-                abuse_data = response_json.get('data', {})
-                score = abuse_data.get('abuseConfidenceScore') 
-
-                if score is not None:
-                    log.info(f"Successfully reported IP {ip_address} (from target port {target_port}) to AbuseIPDB. New confidence score: {score}")
-                else: 
-                    log.warning(f"Reported IP {ip_address} (from target port {target_port}), but response format was unexpected or score missing: {response_json}")    
-        
-    except ClientResponseError as e:
-        response_body = None
-        try:
-            if hasattr(e, 'history') and e.history:
-                 last_response = e.history[-1][1] 
-                 if last_response: response_body = await last_response.text()
-        except Exception as read_err:
-            log.debug(f"Could not read response body from error history: {read_err}")
-            response_body = "(Failed to retrieve error response body)"
-        log.error(
-            f"Failed to report IP {ip_address} (from target port {target_port}): HTTP Error {e.status} - {e.message}. "
-            f"URL: {e.request_info.real_url}. "
-            f"Response hint: {response_body or '(No body details)'}"
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+async def _read_json_object(response):
+    """The response body as a JSON object, or None when it is not one (an HTML error page, a truncated body)."""
+    try:
+        body = await response.json(content_type=None)
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+
+def build_bulk_report_csv(jobs) -> str:
+    """CSV body for the bulk-report endpoint: IP,Categories,ReportDate,Comment."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(('IP', 'Categories', 'ReportDate', 'Comment'))
+    for job in jobs:
+        comment = f"{config.ABUSEIPDB_COMMENT_PREFIX}{job.comment_details}"[:1024]
+        writer.writerow((job.ip_address, job.categories or config.ABUSEIPDB_CATEGORIES, job.report_timestamp or '', comment))
+    return buffer.getvalue()
+
+
+class AbuseIPDBReporter:
+    """
+    Long-lived reporting service: one pooled session, a bounded queue
+    deduplicated per IP, a fixed set of workers, a token bucket sized to the
+    daily quota, and exponential-backoff retries.
+
+    Every accepted job is also written to the abuseipdb_backlog table and only
+    removed once it is finished, so reports still pending at shutdown (or
+    dropped because the queue was full) are picked up again later.
+
+    In bulk mode a batcher collects queued jobs and flushes them on count or
+    age as one bulk-report CSV; batches below bulk_min_batch, or flushed while
+    the bulk quota is spent, are handed to the workers as single reports.
+
+    On stop() only the reports the bucket has tokens for right now are sent;
+    at the free plan's rate the next token can be minutes away, so the rest
+    stay in the backlog for the next start instead of holding up shutdown.
+    """
+
+    def __init__(self, api_key: str, api_url: str = None, workers: int = None, queue_size: int = None,
+                 daily_quota: int = None, burst: int = None, max_retries: int = None,
+                 retry_base_delay: float = None, persist: bool = True, bulk_enabled: bool = None,
+                 bulk_api_url: str = None, bulk_daily_quota: int = None, bulk_min_batch: int = None,
+                 bulk_max_batch: int = None, bulk_max_age: float = None):
+        self.api_key = api_key
+        self.api_url = api_url or ABUSEIPDB_API_URL
+        self.workers = workers or config.ABUSEIPDB_WORKERS
+        self.max_retries = config.ABUSEIPDB_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_base_delay = retry_base_delay if retry_base_delay is not None else config.ABUSEIPDB_RETRY_BASE_DELAY_SECONDS
+        self.persist = persist
+        self.bucket = TokenBucket(
+            rate=(daily_quota or config.ABUSEIPDB_DAILY_QUOTA) / 86400.0,
+            capacity=burst or config.ABUSEIPDB_BURST,
         )
-    except ClientError as e:
-        log.error(f"Failed to report IP {ip_address} (from target port {target_port}): Client/Network Error - {e}")
-    except Exception as e:
-        log.exception(f"An unexpected error occurred while reporting IP {ip_address} (from target port {target_port})")
\ No newline at end of file
+        self.bulk_enabled = config.ABUSEIPDB_BULK_ENABLED if bulk_enabled is None else bulk_enabled
+        self.bulk_api_url = bulk_api_url or ABUSEIPDB_BULK_API_URL
+        self.bulk_bucket = TokenBucket(rate=(bulk_daily_quota or config.ABUSEIPDB_BULK_DAILY_QUOTA) / 86400.0, capacity=1)
+        self.bulk_min_batch = bulk_min_batch or config.ABUSEIPDB_BULK_MIN_BATCH
+        self.bulk_max_batch = bulk_max_batch or config.ABUSEIPDB_BULK_MAX_BATCH
+        self.bulk_max_age = bulk_max_age or config.ABUSEIPDB_BULK_MAX_AGE_SECONDS
+        self._queue = asyncio.Queue(maxsize=queue_size or config.ABUSEIPDB_QUEUE_SIZE)
+        # Workers send single reports; in bulk mode they only get what the batcher hands them.
+        self._single_queue = asyncio.Queue() if self.bulk_enabled else self._queue
+        self._pending = set()
+        self._session = None
+        self._tasks = []
+        self._backlog_overflowed = False
+        self._flush_requested = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self.stats_counters = {
+            'submitted': 0, 'duplicates': 0, 'overflowed': 0, 'sent': 0, 'failed': 0, 'retried': 0,
+            'rate_limited': 0, 'bulk_batches': 0, 'claimed_elsewhere': 0, 'left_in_backlog': 0,
+        }
+
+    async def start(self):
+        if self._session is not None:
+            return
+        self._stopping.clear()
+        self._session = ClientSession(
+            connector=TCPConnector(limit=self.workers, ttl_dns_cache=300),
+            headers={'Accept': 'application/json', 'Key': self.api_key},
+            timeout=ClientTimeout(total=config.ABUSEIPDB_REQUEST_TIMEOUT_SECONDS),
+        )
+        self._tasks = [asyncio.create_task(self._worker(), name=f"abuseipdb-worker-{i}") for i in range(self.workers)]
+        if self.bulk_enabled:
+            self._tasks.append(asyncio.create_task(self._bulk_batcher(), name="abuseipdb-bulk-batcher"))
+        if self.persist:
+            self._tasks.append(asyncio.create_task(self._backlog_refiller(), name="abuseipdb-backlog-refiller"))
+            await self._load_backlog()
+        log.info(f"AbuseIPDB reporter started: {self.workers} workers, {self.bucket.rate * 86400:.0f} reports/day, burst {self.bucket.capacity}, bulk={'on' if self.bulk_enabled else 'off'}")
+
+    async def stop(self, timeout: float = None):
+        """
+        Sends what the token buckets allow now and leaves the rest in the
+        backlog. `timeout` (ABUSEIPDB_REQUEST_TIMEOUT_SECONDS by default) only
+        bounds the requests already in flight; nobody waits for a token.
+        """
+        if self._session is None:
+            return
+        timeout = config.ABUSEIPDB_REQUEST_TIMEOUT_SECONDS if timeout is None else timeout
+        self._stopping.set()
+        try:
+            await asyncio.wait_for(self._drain_queues(), timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"AbuseIPDB reporter stopping with {self._queue.qsize()} reports still queued (kept in backlog).")
+        if self.stats_counters['left_in_backlog']:
+            log.info(f"{self.stats_counters['left_in_backlog']} AbuseIPDB reports were out of quota at shutdown, "
+                     f"kept in backlog.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._session.close()
+        self._session = None
+        log.info(f"AbuseIPDB reporter stopped. Stats: {self.stats()}")
+
+    async def _drain_queues(self):
+        if self.bulk_enabled:
+            self._flush_requested.set()
+        await self._queue.join()
+        await self._single_queue.join()
+
+    def submit(self, ip_address: str, target_port: int, comment_details: str, report_timestamp: str = None,
+               persist: bool = True, categories: str = None) -> bool:
+        if ip_address in self._pending:
+            self.stats_counters['duplicates'] += 1
+            return False
+        if self.persist and persist:
+            save_pending_report(ip_address, target_port, comment_details, report_timestamp, categories)
+        try:
+            self._queue.put_nowait(ReportJob(ip_address, target_port, comment_details, report_timestamp, categories))
+        except asyncio.QueueFull:
+            self.stats_counters['overflowed'] += 1
+            self._backlog_overflowed = True
+            log.warning(f"AbuseIPDB report queue full, report for {ip_address} deferred to backlog.")
+            return False
+        self._pending.add(ip_address)
+        self.stats_counters['submitted'] += 1
+        return True
+
+    def stats(self) -> dict:
+        return {'queue_depth': self._queue.qsize(), 'in_flight': len(self._pending), **self.stats_counters}
+
+    async def _load_backlog(self):
+        free = self._queue.maxsize - self._queue.qsize()
+        if free <= 0:
+            return
+        rows = await load_pending_reports(free + len(self._pending))
+        loaded = 0
+        for row in rows:
+            if row['ip'] in self._pending:
+                continue
+            if not self.submit(row['ip'], row['target_port'], row['comment'], row['report_timestamp'], persist=False,
+                               categories=row['categories']):
+                break
+            loaded += 1
+        if loaded:
+            log.info(f"Loaded {loaded} pending AbuseIPDB reports from backlog.")
+
+    async def _backlog_refiller(self):
+        while True:
+            await asyncio.sleep(60)
+            if self._backlog_overflowed and self._queue.qsize() < self._queue.maxsize // 2:
+                self._backlog_overflowed = False
+                await self._load_backlog()
+
+    async def _acquire_token(self, bucket: TokenBucket) -> bool:
+        """Waits for a token from bucket; once stopping, only takes one that is already there."""
+        if self._stopping.is_set():
+            return bucket.try_acquire()
+        acquire_task = asyncio.ensure_future(bucket.acquire())
+        stopping_task = asyncio.ensure_future(self._stopping.wait())
+        try:
+            await asyncio.wait((acquire_task, stopping_task), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stopping_task.cancel()
+            if not acquire_task.done():
+                acquire_task.cancel()
+        if acquire_task.done() and not acquire_task.cancelled():
+            return True
+        return bucket.try_acquire()
+
+    async def _wait_to_retry(self, delay: float) -> bool:
+        """Sleeps for the retry delay and takes a token. False once stopping: the job then stays in the backlog."""
+        try:
+            await asyncio.wait_for(self._stopping.wait(), delay)
+            return False
+        except asyncio.TimeoutError:
+            pass
+        return await self._acquire_token(self.bucket)
+
+    def _leave_in_backlog(self, job: ReportJob):
+        # The backlog row and the report claim are kept; the next start sends it.
+        self.stats_counters['left_in_backlog'] += 1
+        log.debug(f"Leaving the AbuseIPDB report for {job.ip_address} in the backlog, no quota left before shutdown.")
+
+    async def _worker(self):
+        while True:
+            job = await self._single_queue.get()
+            try:
+                if await self._claim_across_workers([job]):
+                    if await self._acquire_token(self.bucket):
+                        await self._send(job)
+                    else:
+                        self._leave_in_backlog(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception(f"An unexpected error occurred while reporting IP {job.ip_address} (from target port {job.target_port})")
+            finally:
+                self._pending.discard(job.ip_address)
+                self._single_queue.task_done()
+
+    async def _bulk_batcher(self):
+        batch = []
+        batch_started = 0.0
+        while True:
+            timeout = None
+            if batch:
+                timeout = max(0.0, batch_started + self.bulk_max_age - time.monotonic())
+            get_task = asyncio.ensure_future(self._queue.get())
+            flush_task = asyncio.ensure_future(self._flush_requested.wait())
+            try:
+                await asyncio.wait((get_task, flush_task), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                flush_task.cancel()
+                if not get_task.done():
+                    get_task.cancel()
+            if get_task.done() and not get_task.cancelled():
+                if not batch:
+                    batch_started = time.monotonic()
+                batch.append(get_task.result())
+                while len(batch) < self.bulk_max_batch and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+            flush_now = self._flush_requested.is_set()
+            if batch and (flush_now or len(batch) >= self.bulk_max_batch or time.monotonic() - batch_started >= self.bulk_max_age):
+                current, batch = batch, []
+                try:
+                    await self._flush_batch(current)
+                finally:
+                    for _ in current:
+                        self._queue.task_done()
+            if flush_now and self._queue.empty():
+                self._flush_requested.clear()
+
+    async def _claim_across_workers(self, jobs) -> list:
+        """In multi-worker mode drops jobs whose IP another worker process has already claimed."""
+        if config.SERVER_WORKERS <= 1:
+            return jobs
+        won = await claim_ips_across_workers([(job.ip_address, job.report_timestamp) for job in jobs])
+        claimed = []
+        for job in jobs:
+            if job.ip_address in won:
+                claimed.append(job)
+                continue
+            log.debug(f"IP {job.ip_address} already claimed for reporting by another worker, skipping.")
+            self.stats_counters['claimed_elsewhere'] += 1
+            self._pending.discard(job.ip_address)
+            if self.persist:
+                delete_pending_report(job.ip_address)
+        return claimed
+
+    async def _flush_batch(self, batch):
+        batch = await self._claim_across_workers(batch)
+        if not batch:
+            return
+        if len(batch) < self.bulk_min_batch or not self.bulk_bucket.try_acquire():
+            log.debug(f"Sending batch of {len(batch)} AbuseIPDB reports as single reports.")
+            for job in batch:
+                self._single_queue.put_nowait(job)
+            return
+        try:
+            sent = await self._send_bulk(batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception(f"An unexpected error occurred while bulk reporting {len(batch)} IPs")
+            sent = False
+        if not sent:
+            for job in batch:
+                self._single_queue.put_nowait(job)
+
+    async def _send_bulk(self, batch) -> bool:
+        form = FormData()
+        form.add_field('csv', build_bulk_report_csv(batch), filename='report.csv', content_type='text/csv')
+        log.info(f"Attempting to bulk report {len(batch)} IPs to AbuseIPDB.")
+        try:
+            async with self._session.post(self.bulk_api_url, data=form) as response:
+                if response.status == 429:
+                    self.stats_counters['rate_limited'] += 1
+                    retry_delay = _parse_retry_after(response.headers.get('Retry-After')) or 3600.0
+                    self.bulk_bucket.pause_until(time.monotonic() + retry_delay)
+                    log.warning(f"AbuseIPDB bulk-report rate limit hit, falling back to single reports for {retry_delay:.0f}s")
+                    return False
+                if response.status >= 400:
+                    body = await response.text()
+                    log.error(f"AbuseIPDB bulk report failed: HTTP Error {response.status}. Response hint: {body[:500]}")
+                    return False
+                response_json = await _read_json_object(response)
+        except (ClientError, asyncio.TimeoutError) as e:
+            log.warning(f"Client/Network Error during AbuseIPDB bulk report: {e!r}")
+            return False
+
+        if response_json is None:
+            # The CSV went through; sending the rows again as single reports could report them twice.
+            log.error(f"AbuseIPDB bulk report of {len(batch)} IPs returned HTTP {response.status} with an unreadable body, "
+                      f"marking the batch failed.")
+            for job in batch:
+                self._pending.discard(job.ip_address)
+                self._finish(job, sent=False)
+            return True
+
+        data = response_json.get('data') or {}
+        invalid_ips = {}
+        for invalid in data.get('invalidReports') or []:
+            ip_address = invalid.get('input')
+            row_number = invalid.get('rowNumber')
+            if not ip_address and isinstance(row_number, int) and 1 <= row_number <= len(batch):
+                ip_address = batch[row_number - 1].ip_address
+            if ip_address:
+                invalid_ips[ip_address] = invalid.get('error')
+        self.stats_counters['bulk_batches'] += 1
+        for job in batch:
+            self._pending.discard(job.ip_address)
+            if job.ip_address in invalid_ips:
+                log.warning(f"AbuseIPDB rejected bulk report row for {job.ip_address}: {invalid_ips[job.ip_address]}")
+                self._finish(job, sent=False)
+            else:
+                self._finish(job, sent=True)
+        log.info(f"Bulk reported {len(batch)} IPs to AbuseIPDB: saved={data.get('savedReports')}, invalid={len(invalid_ips)}")
+        return True
+
+    def _finish(self, job: ReportJob, sent: bool):
+        self.stats_counters['sent' if sent else 'failed'] += 1
+        if self.persist:
+            delete_pending_report(job.ip_address)
+        if not sent:
+            release_ip_report_claim(job.ip_address, job.report_timestamp)
+
+    def _backoff_delay(self, attempt: int) -> float:
+        delay = self.retry_base_delay * (2 ** attempt)
+        return delay + random.uniform(0, delay / 2)
+
+    async def _send(self, job: ReportJob):
+        params = {
+            'ip': job.ip_address,
+            'categories': job.categories or config.ABUSEIPDB_CATEGORIES,
+            'comment': f"{config.ABUSEIPDB_COMMENT_PREFIX}{job.comment_details}"
+        }
+        log.info(f"Attempting to report IP {job.ip_address} (from target port {job.target_port}) to AbuseIPDB. Categories: {params['categories']}")
+
+        while True:
+            retry_delay = None
+            try:
+                async with self._session.post(self.api_url, data=params) as response:
+                    if response.status == 429:
+                        self.stats_counters['rate_limited'] += 1
+                        retry_delay = _parse_retry_after(response.headers.get('Retry-After')) or self._backoff_delay(job.attempts)
+                        self.bucket.pause_until(time.monotonic() + retry_delay)
+                        log.warning(f"AbuseIPDB rate limit hit while reporting {job.ip_address}, pausing reports for {retry_delay:.0f}s")
+                    elif response.status >= 500:
+                        retry_delay = self._backoff_delay(job.attempts)
+                        log.warning(f"AbuseIPDB server error {response.status} reporting {job.ip_address}, retrying in {retry_delay:.1f}s")
+                    elif response.status >= 400:
+                        body = await response.text()
+                        log.error(f"Failed to report IP {job.ip_address} (from target port {job.target_port}): HTTP Error {response.status}. Response hint: {body[:500]}")
+                        self._finish(job, sent=False)
+                        return
+                    else:
+                        response_json = await _read_json_object(response)
+                        if response_json is None:
+                            log.error(f"Reporting IP {job.ip_address} (from target port {job.target_port}) returned "
+                                      f"HTTP {response.status} with an unreadable body, giving up on this report.")
+                            self._finish(job, sent=False)
+                            return
+                        score = (response_json.get('data') or {}).get('abuseConfidenceScore')
+                        if score is not None:
+                            log.info(f"Successfully reported IP {job.ip_address} (from target port {job.target_port}) to AbuseIPDB. New confidence score: {score}")
+                        else:
+                            log.warning(f"Reported IP {job.ip_address} (from target port {job.target_port}), but response format was unexpected or score missing: {response_json}")
+                        self._finish(job, sent=True)
+                        return
+            except (ClientError, asyncio.TimeoutError) as e:
+                retry_delay = self._backoff_delay(job.attempts)
+                log.warning(f"Client/Network Error reporting IP {job.ip_address}: {e!r}, retrying in {retry_delay:.1f}s")
+
+            job.attempts += 1
+            if job.attempts > self.max_retries:
+                log.error(f"Giving up reporting IP {job.ip_address} (from target port {job.target_port}) after {job.attempts} attempts.")
+                self._finish(job, sent=False)
+                return
+            self.stats_counters['retried'] += 1
+            if not await self._wait_to_retry(retry_delay):
+                self._leave_in_backlog(job)
+                return
+
+
+_reporter = None
+
+async def start_reporter():
+    global _reporter
+    if not config.ABUSEIPDB_ENABLED:
+        log.debug("AbuseIPDB reporting is disabled in config.")
+        return None
+    if _reporter is None:
+        _reporter = AbuseIPDBReporter(config.ABUSEIPDB_API_KEY)
+        await _reporter.start()
+    return _reporter
+
+async def stop_reporter():
+    global _reporter
+    if _reporter is not None:
+        await _reporter.stop()
+        _reporter = None
+
+def get_reporter_stats() -> dict:
+    return _reporter.stats() if _reporter is not None else {}
+
+def report_ip_to_abuseipdb(ip_address: str, target_port: int, comment_details: str, report_timestamp: str = None,
+                           categories: str = None) -> bool:
+    """
+    Queues a report on the running reporter service. Returns False if it
+    will not be sent: the reporter is not running, or the queue is full and
+    there is no backlog to defer it to.
+    """
+    if _reporter is None:
+        log.debug(f"AbuseIPDB reporter is not running, report for {ip_address} not queued.")
+        return False
+    queued = _reporter.submit(ip_address, target_port, comment_details, report_timestamp, categories=categories)
+    return queued or _reporter.persist
@@ -1,82 +1,96 @@
-import asyncio
 import logging
 import time
 import datetime
-from aiohttp import web
+from aiohttp import web, HttpVersion11
 from aiohttp.client_exceptions import ClientConnectionResetError 
 
 from . import config
 
 from .reporting.abuseipdb_reporter import report_ip_to_abuseipdb
 
-from .utils.geoip_lookup import get_geoip_data
+from .utils.geoip_lookup import lookup_geoip_data
+from .utils.client_address import get_client_resolver
 
-from .database import log_event_to_db, check_ip_reported_recently
+from .database import enqueue_event, claim_ip_for_report, release_ip_report_claim
+from .drip_scheduler import get_drip_scheduler, CONNECTION_RESET_ERROR, SHUTDOWN_ERROR
+from .admission import admit_client, assign_hold_asn, release_hold, shed_connection, ADMIT, CLOSE, RESET
+from .drip_strategies import choose_strategy, get_strategy, record_client_outcome
+from .metrics import REQUESTS, HOLD_DURATION, SIGNATURE_MATCHES
+from .signatures import classify_request, get_signature_engine
+from .sessions import request_fingerprint, record_session_event
+from .firewall import record_firewall_event
+from .live_events import publish_connection_started, publish_connection_finished
 
 log = logging.getLogger(__name__) 
 
 def _clean_headers(headers):
     return {k: v for k, v in headers.items()}
 
-async def _handle_abuseipdb_report(ip_addr: str, target_port: int, event_log_data: dict):
-    if config.ABUSEIPDB_ENABLED and \
-       ip_addr != "127.0.0.1" and \
-       not ip_addr.startswith("192.168.") and \
-       not ip_addr.startswith("10.") and \
-       not (ip_addr.startswith("172.") and 16 <= int(ip_addr.split('.')[1]) <= 31):
-        is_reported = await asyncio.to_thread(check_ip_reported_recently, ip_addr)
-        if not is_reported:
+async def _handle_abuseipdb_report(client, target_port: int, event_log_data: dict):
+    ip_addr = client.ip
+    if config.ABUSEIPDB_ENABLED and client.is_public:
+        report_timestamp = claim_ip_for_report(ip_addr)
+        if report_timestamp:
+            signatures = event_log_data['signatures']
             report_comment = (
                 f"TargetPort:{target_port}, Path:{event_log_data['http_path']}, "
                 f"Method:{event_log_data['http_method']}, UA:{event_log_data['user_agent'][:100]}"
             )
-            log.debug(f"Scheduling AbuseIPDB report task for {ip_addr} on port {target_port}")
-            asyncio.create_task(report_ip_to_abuseipdb(ip_addr, target_port, report_comment)) 
-            event_log_data['reported_to_abuseipdb'] = 1
-            event_log_data['abuseipdb_report_timestamp'] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            if signatures:
+                report_comment += f", Signatures:{','.join(signatures)}"
+            log.debug(f"Queueing AbuseIPDB report for {ip_addr} on port {target_port}")
+            if report_ip_to_abuseipdb(ip_addr, target_port, report_comment, report_timestamp,
+                                      categories=get_signature_engine().categories(signatures)):
+                event_log_data['reported_to_abuseipdb'] = 1
+                event_log_data['abuseipdb_report_timestamp'] = report_timestamp
+            else:
+                # Nothing will send it; let a later request report this IP.
+                release_ip_report_claim(ip_addr, report_timestamp)
         else:
-            log.debug(f"IP {ip_addr} was reported recently (checked DB), skipping new report.")
+            log.debug(f"IP {ip_addr} was reported recently (checked cache), skipping new report.")
     else:
         log.debug(f"AbuseIPDB report for {ip_addr} skipped (private/local IP or config).")
         event_log_data['reported_to_abuseipdb'] = 0
         event_log_data['abuseipdb_report_timestamp'] = None
         
-async def handle_request(request):
-    start_time = time.monotonic()
-    request_timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat() 
-    peername = request.transport.get_extra_info('peername')
-    proxy_ip = "Unknown_Proxy"
+def resolve_client_address(peername, forwarded_for: str, real_ip: str):
+    """
+    Returns (client, proxy_ip, proxy_port) for a connection and its proxy
+    headers, client being a ClientAddress; the headers only count when the
+    peer is a trusted proxy (see utils.client_address).
+    """
+    proxy_ip = None
     proxy_port = 0
     if peername:
         proxy_ip = peername[0]
         proxy_port = peername[1]
-    
-    real_ip_from_xfwd = request.headers.get('X-Forwarded-For', '').split(',')[0].strip()
-    real_ip_from_xreal = request.headers.get('X-Real-IP', '').strip()
-    
-    actual_client_ip = real_ip_from_xfwd or real_ip_from_xreal or proxy_ip
-    
-    log.debug(f"Proxy IP: {proxy_ip}:{proxy_port}, Client IP: {actual_client_ip}")    
-    ip_addr = actual_client_ip
-    target_port_str = request.headers.get('X-Tarpit-Target-Port', '0') 
-    target_port = 0
-    
+    client = get_client_resolver().resolve(proxy_ip, forwarded_for, real_ip)
+    log.debug(f"Proxy IP: {proxy_ip}:{proxy_port}, Client IP: {client.ip}")
+    return client, proxy_ip, proxy_port
+
+def parse_target_port(target_port_str: str) -> int:
     try:
-        target_port = int(target_port_str)
+        return int(target_port_str)
     except ValueError:
         log.warning(f"Could not parse X-Tarpit-Target-Port header: {target_port_str}")
-        
-    event_log_data = {
-        'timestamp': request_timestamp,
+        return 0
+
+def new_event_log_data(ip_addr: str, client_port: int, target_port: int, method: str, path: str,
+                       query: str, http_version: str, user_agent: str, headers: dict) -> dict:
+    signatures = classify_request(path, query, headers)
+    for name in signatures:
+        SIGNATURE_MATCHES.labels(name).inc()
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
         'client_ip': ip_addr,
-        'client_port': proxy_port,
+        'client_port': client_port,
         'target_port': target_port,
-        'http_method': request.method,
-        'http_path': request.path,
-        'http_query': str(request.query_string),
-        'http_version': f"{request.version.major}.{request.version.minor}",
-        'user_agent': request.headers.get('User-Agent', 'N/A'),
-        'headers': _clean_headers(request.headers),
+        'http_method': method,
+        'http_path': path,
+        'http_query': query,
+        'http_version': http_version,
+        'user_agent': user_agent,
+        'headers': headers,
         'request_body_preview': None,
         'response_status': None,
         'bytes_sent': 0,
@@ -84,11 +98,17 @@ async def handle_request(request):
         'error_message': None,
         'geoip_data': None,
         'reported_to_abuseipdb': 0, 
-        'abuseipdb_report_timestamp': None
+        'abuseipdb_report_timestamp': None,
+        'drip_strategy': None,
+        'fingerprint': None,
+        'signatures': signatures,
     }
 
-    if ip_addr != "Unknown Proxy" and not ip_addr.startswith("127."):
-        geoip_info = await asyncio.to_thread(get_geoip_data, ip_addr) 
+async def enrich_event(client, target_port: int, event_log_data: dict):
+    """GeoIP lookup and AbuseIPDB report for a freshly received request."""
+    ip_addr = client.ip
+    if client.is_public:
+        geoip_info = await lookup_geoip_data(ip_addr)
         if geoip_info:
             event_log_data['geoip_data'] = geoip_info
             log.debug(f"GeoIP data for {ip_addr}: {geoip_info}")
@@ -96,42 +116,141 @@ async def handle_request(request):
             log.debug(f"No GeoIP data found for {ip_addr}")
 
     log.info(f"Connection received on target port {target_port} (logging to JSON)", extra={'extra_data': event_log_data})
+    publish_connection_started(event_log_data)
     
-    await _handle_abuseipdb_report(ip_addr, target_port, event_log_data)
+    await _handle_abuseipdb_report(client, target_port, event_log_data)
+
+def select_drip_strategy(hold, event_log_data: dict, accept_encoding: str, raw_head: bool = True):
+    """
+    Returns (strategy, max_bytes) for a hold and records the choice in the
+    event. Clients shed to a short drip always get the fixed drip. With
+    raw_head=False (the aiohttp engine, which always sends its own response
+    head) strategies that write the head themselves are replaced by fixed.
+    """
+    if hold is not None and hold.action != ADMIT:
+        event_log_data['drip_strategy'] = hold.action
+        return get_strategy('fixed'), hold.max_bytes
+    strategy = choose_strategy(event_log_data['client_ip'], event_log_data['signatures'],
+                               event_log_data['user_agent'], accept_encoding)
+    if strategy.raw_head and not raw_head:
+        strategy = get_strategy('fixed')
+    event_log_data['drip_strategy'] = strategy.name
+    return strategy, None
+
+def finish_event(event_log_data: dict, start_time: float, bytes_sent_total: int, error_msg):
+    """Fills in the final fields of an event, logs it and hands it to the DB writer."""
+    ip_addr = event_log_data['client_ip']
+    end_time = time.monotonic()
+    duration = end_time - start_time
+    event_log_data['duration_s'] = round(duration, 3)
+    event_log_data['bytes_sent'] = bytes_sent_total 
+    HOLD_DURATION.labels(event_log_data['drip_strategy'] or 'none').observe(duration)
+    if event_log_data['response_status'] is None:
+         event_log_data['response_status'] = 500 
+    event_log_data['fingerprint'] = request_fingerprint(event_log_data['headers'], event_log_data['user_agent'])
+    final_log_level = logging.WARNING if error_msg else logging.INFO
+    log.log(final_log_level, f"Connection finished for {ip_addr}:{event_log_data['client_port']} on target port {event_log_data['target_port']} (JSON log)", extra={'extra_data': event_log_data})
+
+    try:
+        enqueue_event(event_log_data)
+    except Exception as db_err:
+        log.exception(f"Failed to log event to database for IP {ip_addr}: {db_err}")
+    record_client_outcome(event_log_data)
+    record_session_event(event_log_data)
+    record_firewall_event(event_log_data)
+    publish_connection_finished(event_log_data)
+
+def finish_shed_event(event_log_data: dict, start_time: float, action: str):
+    """Records a connection that admission control closed or reset before any response."""
+    event_log_data['drip_strategy'] = action
+    event_log_data['response_status'] = 503
+    event_log_data['error_message'] = f"Shed by admission control ({action})"
+    # Logged at INFO: under a flood every shed connection ends up here.
+    finish_event(event_log_data, start_time, 0, None)
+
 
+class ShedResponse(web.StreamResponse):
+    """
+    Returned for a connection that was already closed or reset by admission
+    control. prepare() fails the way a write to a gone client does, which
+    aiohttp takes as a premature disconnect: nothing is written and the
+    connection is not served any further.
+    """
+
+    async def prepare(self, request):
+        raise ClientConnectionResetError("Connection was shed by admission control")
+
+
+_aiohttp_requests = REQUESTS.labels('aiohttp')
+
+async def handle_request(request):
+    start_time = time.monotonic()
+    _aiohttp_requests.inc()
+    client, proxy_ip, proxy_port = resolve_client_address(
+        request.transport.get_extra_info('peername'),
+        ','.join(request.headers.getall('X-Forwarded-For', ())),
+        request.headers.get('X-Real-IP', ''),
+    )
+    ip_addr = client.ip
+    target_port = parse_target_port(request.headers.get('X-Tarpit-Target-Port', '0'))
+
+    event_log_data = new_event_log_data(
+        ip_addr, proxy_port, target_port, request.method, request.path,
+        str(request.query_string), f"{request.version.major}.{request.version.minor}",
+        request.headers.get('User-Agent', 'N/A'), _clean_headers(request.headers),
+    )
+
+    hold = admit_client(client)
+    if hold is not None and hold.action in (CLOSE, RESET):
+        log.debug(f"Shedding {ip_addr} over admission budget ({hold.action})")
+        shed_connection(request.transport, hold.action)
+        finish_shed_event(event_log_data, start_time, hold.action)
+        return ShedResponse(status=503)
 
     response_status = 200
     bytes_sent_total = 0
     error_msg = None
 
     try:
+        await enrich_event(client, target_port, event_log_data)
+        assign_hold_asn(hold, event_log_data['geoip_data'])
+
+        # Raw-head strategies (header_trickle) only run on the protocol engine.
+        strategy, max_bytes = select_drip_strategy(hold, event_log_data, request.headers.get('Accept-Encoding', ''),
+                                                   raw_head=False)
+        event_log_data['response_status'] = response_status
         response = web.StreamResponse(
             status=response_status,
             reason='OK',
             headers={'Content-Type': 'text/plain', 'Connection': 'keep-alive'}
         )
-        event_log_data['response_status'] = response_status
+        if strategy.content_encoding:
+            response.headers['Content-Encoding'] = strategy.content_encoding
+        if request.version >= HttpVersion11:
+            response.enable_chunked_encoding()
         await response.prepare(request)
+        chunked = response.chunked
         log.debug(f"Sent headers to {ip_addr}", extra={'extra_data': {'client_ip': ip_addr}})
 
-        while bytes_sent_total < config.MAX_RESPONSE_BYTES:
-            try:
-                await response.write(config.RESPONSE_CHUNK)
-                await response.drain()
-                bytes_sent_total += len(config.RESPONSE_CHUNK)
-                log.debug(f"Sent chunk (total: {bytes_sent_total})", extra={'extra_data': {'client_ip': ip_addr}})
-                await asyncio.sleep(config.RESPONSE_DELAY_SECONDS)
-            except ConnectionResetError:
-                error_msg = "Connection reset by peer during write"
-                event_log_data['error_message'] = error_msg
+        # The drip itself runs on the shared timer wheel, which writes raw
+        # frames to the transport; this coroutine just waits for it to end.
+        scheduler = get_drip_scheduler()
+        drip = strategy.start(scheduler, request.transport, chunked, max_bytes)
+        try:
+            await drip.future
+        finally:
+            scheduler.discard(drip)
+            bytes_sent_total = drip.bytes_sent
+        if drip.error:
+            error_msg = drip.error
+            event_log_data['error_message'] = error_msg
+            if error_msg == SHUTDOWN_ERROR:
+                log.info(f"Released {ip_addr} at shutdown", extra={'extra_data': {'client_ip': ip_addr}})
+            elif error_msg == CONNECTION_RESET_ERROR:
                 log.warning(error_msg, extra={'extra_data': {'client_ip': ip_addr}})
-                break 
-            except Exception as e_write:
-                error_msg = f"Error writing to {ip_addr}:{port}: {e_write}"
-                event_log_data['error_message'] = error_msg
-                log.error(error_msg, exc_info=True, extra={'extra_data': {'client_ip': ip_addr}})
-                break 
-        if error_msg is None or error_msg == "Connection reset by peer during write":
+            else:
+                log.error(f"Error writing to {ip_addr}:{proxy_port}: {error_msg}", extra={'extra_data': {'client_ip': ip_addr}})
+        if error_msg is None or error_msg == CONNECTION_RESET_ERROR:
             try:
                 await response.write_eof()
             except ClientConnectionResetError:
@@ -152,26 +271,8 @@ async def handle_request(request):
          event_log_data['response_status'] = 500
          event_log_data['error_message'] = error_msg
          log.error(f"Error during request preparation for {ip_addr}: {e_prepare}", exc_info=True, extra={'extra_data': event_log_data})
-         end_time = time.monotonic()
-         duration = end_time - start_time
-         event_log_data['duration_s'] = round(duration, 3)
-         try:
-             await asyncio.to_thread(log_event_to_db, event_log_data.copy())
-         except Exception as db_err:
-             log.exception(f"Failed to log event to database after prepare error for IP {ip_addr}: {db_err}")
          return web.Response(status=500, text="Internal Server Error")
 
     finally:
-        end_time = time.monotonic()
-        duration = end_time - start_time
-        event_log_data['duration_s'] = round(duration, 3)
-        event_log_data['bytes_sent'] = bytes_sent_total 
-        if event_log_data['response_status'] is None:
-             event_log_data['response_status'] = 500 
-        final_log_level = logging.WARNING if error_msg else logging.INFO
-        log.log(final_log_level, f"Connection finished for {ip_addr}:{proxy_port} on target port {target_port} (JSON log)", extra={'extra_data': event_log_data})
-
-        try:
-            await asyncio.to_thread(log_event_to_db, event_log_data.copy())
-        except Exception as db_err:
-            log.exception(f"Failed to log event to database for IP {ip_addr}: {db_err}")
\ No newline at end of file
+        release_hold(hold)
+        finish_event(event_log_data, start_time, bytes_sent_total, error_msg)
@@ -0,0 +1,185 @@
+import asyncio
+import datetime
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+
+from . import config
+from .database import enqueue_session
+
+log = logging.getLogger(__name__)
+
+# Added or rewritten by the reverse proxy, so they say nothing about the client.
+_PROXY_HEADERS = frozenset(('x-forwarded-for', 'x-real-ip', 'x-tarpit-target-port', 'x-forwarded-proto',
+                            'x-forwarded-host', 'x-forwarded-port', 'forwarded', 'host', 'connection'))
+# Values that differ between HTTP stacks even when the User-Agent is spoofed.
+_VALUE_HEADERS = ('accept', 'accept-encoding', 'accept-language')
+
+
+def request_fingerprint(headers: dict, user_agent: str) -> str:
+    """
+    Identifies the client software rather than the address: the order of
+    the header names it sent, its User-Agent and its Accept* values, hashed
+    to 16 hex digits. The same scanner keeps its fingerprint across IPs.
+    """
+    names = []
+    values = {}
+    for name, value in headers.items():
+        lower = name.lower()
+        if lower in _PROXY_HEADERS:
+            continue
+        names.append(lower)
+        if lower in _VALUE_HEADERS:
+            values.setdefault(lower, value)
+    material = '\n'.join((','.join(names), user_agent or '', *(values.get(name, '') for name in _VALUE_HEADERS)))
+    return hashlib.blake2b(material.encode('utf-8', 'surrogateescape'), digest_size=8).hexdigest()
+
+
+class Session:
+    """Rolling stats of one (IP, fingerprint) pair; paths are kept as hashes, capped at SESSION_MAX_TRACKED_PATHS."""
+
+    __slots__ = ('ip', 'fingerprint', 'user_agent', 'started_at', 'last_seen', 'requests', 'path_hashes',
+                 'held_seconds', 'bytes_sent', 'target_ports', 'country_iso_code', 'asn_number', 'reported')
+
+    def __init__(self, ip, fingerprint, user_agent, now):
+        self.ip = ip
+        self.fingerprint = fingerprint
+        self.user_agent = user_agent
+        self.started_at = now
+        self.last_seen = now
+        self.requests = 0
+        self.path_hashes = set()
+        self.held_seconds = 0.0
+        self.bytes_sent = 0
+        self.target_ports = set()
+        self.country_iso_code = None
+        self.asn_number = None
+        self.reported = 0
+
+    def to_row(self) -> dict:
+        return {
+            'client_ip': self.ip,
+            'fingerprint': self.fingerprint,
+            'user_agent': self.user_agent,
+            'started_at': datetime.datetime.fromtimestamp(self.started_at, datetime.timezone.utc).isoformat(),
+            'ended_at': datetime.datetime.fromtimestamp(self.last_seen, datetime.timezone.utc).isoformat(),
+            'requests': self.requests,
+            'distinct_paths': len(self.path_hashes),
+            'target_ports': len(self.target_ports),
+            'held_seconds': round(self.held_seconds, 3),
+            'bytes_sent': self.bytes_sent,
+            'country_iso_code': self.country_iso_code,
+            'asn_number': self.asn_number,
+            'reported_to_abuseipdb': self.reported,
+        }
+
+
+class SessionTracker:
+    """
+    Open sessions in activity order, so idle ones are found at the front.
+    A session ends after SESSION_IDLE_TIMEOUT_SECONDS without a finished
+    request, or early when SESSION_MAX_ACTIVE is exceeded, and is handed to
+    the DB writer as one row. Event loop thread only.
+    """
+
+    def __init__(self, idle_timeout: float = None, max_active: int = None, max_tracked_paths: int = None):
+        self.idle_timeout = idle_timeout or config.SESSION_IDLE_TIMEOUT_SECONDS
+        self.max_active = max_active or config.SESSION_MAX_ACTIVE
+        self.max_tracked_paths = max_tracked_paths or config.SESSION_MAX_TRACKED_PATHS
+        self._sessions = OrderedDict()
+        self.flushed = 0
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def record(self, event_data: dict, now: float = None):
+        now = now or time.time()
+        held_seconds = event_data.get('duration_s') or 0.0
+        # Events are recorded when the hold ends; the request arrived held_seconds earlier.
+        started_at = now - held_seconds
+        fingerprint = event_data.get('fingerprint') or request_fingerprint(
+            event_data.get('headers') or {}, event_data.get('user_agent'))
+        key = (event_data['client_ip'], fingerprint)
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = Session(key[0], fingerprint, event_data.get('user_agent'), started_at)
+        else:
+            self._sessions.move_to_end(key)
+            if started_at < session.started_at:
+                # A concurrent request that arrived first but was held longer.
+                session.started_at = started_at
+        session.last_seen = now
+        session.requests += 1
+        if len(session.path_hashes) < self.max_tracked_paths:
+            session.path_hashes.add(hash(event_data.get('http_path')))
+        session.held_seconds += held_seconds
+        session.bytes_sent += event_data.get('bytes_sent') or 0
+        if event_data.get('target_port'):
+            session.target_ports.add(event_data['target_port'])
+        geoip_data = event_data.get('geoip_data')
+        if geoip_data:
+            session.country_iso_code = geoip_data.get('country_iso_code', session.country_iso_code)
+            session.asn_number = geoip_data.get('asn_number', session.asn_number)
+        if event_data.get('reported_to_abuseipdb'):
+            session.reported = 1
+        while len(self._sessions) > self.max_active:
+            self._flush(self._sessions.popitem(last=False)[1])
+            self.evicted_capacity += 1
+
+    def expire(self, now: float = None) -> int:
+        """Flushes every session idle for longer than idle_timeout. Returns how many ended."""
+        deadline = (now or time.time()) - self.idle_timeout
+        expired = 0
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_seen > deadline:
+                break
+            self._sessions.popitem(last=False)
+            self._flush(session)
+            expired += 1
+        self.evicted_idle += expired
+        return expired
+
+    def flush_all(self):
+        while self._sessions:
+            self._flush(self._sessions.popitem(last=False)[1])
+
+    def stats(self) -> dict:
+        return {
+            'active': len(self._sessions),
+            'flushed': self.flushed,
+            'evicted_idle': self.evicted_idle,
+            'evicted_capacity': self.evicted_capacity,
+        }
+
+    def _flush(self, session: Session):
+        enqueue_session(session.to_row())
+        self.flushed += 1
+
+
+_tracker = SessionTracker()
+
+def record_session_event(event_data: dict):
+    if config.SESSIONS_ENABLED:
+        _tracker.record(event_data)
+
+async def run_session_sweeper(interval: float = None):
+    interval = interval or config.SESSION_SWEEP_INTERVAL_SECONDS
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            _tracker.expire()
+        except Exception:
+            log.exception("Session sweep failed")
+
+def flush_sessions():
+    """Ends every open session; call before the DB writer is stopped."""
+    if len(_tracker):
+        log.info(f"Flushing {len(_tracker)} open sessions")
+    _tracker.flush_all()
+
+def get_session_stats() -> dict:
+    return _tracker.stats()
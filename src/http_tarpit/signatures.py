@@ -0,0 +1,117 @@
+import json
+import logging
+import re
+from pathlib import Path
+
+from . import config
+
+log = logging.getLogger(__name__)
+
+TARGETS = ('path', 'query', 'headers')
+
+
+class SignatureRule:
+    __slots__ = ('name', 'pattern', 'targets', 'categories', 'strategy')
+
+    def __init__(self, name: str, pattern: str, targets, categories=(), strategy: str = None):
+        self.name = name
+        self.pattern = pattern
+        self.targets = tuple(targets)
+        self.categories = tuple(int(category) for category in categories)
+        self.strategy = strategy
+
+
+def load_rules(path: Path) -> list:
+    """
+    Reads {"rules": [{"name", "pattern", "targets", "categories", "strategy"}, ...]}.
+    Patterns are case-insensitive Python regexes; they are also spliced into
+    one prefilter alternation per target, so they may not use named groups or
+    backreferences.
+    """
+    with open(path, encoding='utf-8') as f:
+        document = json.load(f)
+    rules = []
+    names = set()
+    for entry in document.get('rules', []):
+        rule = SignatureRule(entry['name'], entry['pattern'], entry.get('targets', ('path',)),
+                             entry.get('categories', ()), entry.get('strategy'))
+        if rule.name in names:
+            raise ValueError(f"Duplicate signature rule name {rule.name!r} in {path}")
+        unknown = set(rule.targets) - set(TARGETS)
+        if unknown:
+            raise ValueError(f"Signature rule {rule.name!r} has unknown targets {sorted(unknown)}")
+        compiled = re.compile(rule.pattern, re.IGNORECASE)
+        if compiled.groupindex or re.search(r'\\[1-9]', rule.pattern):
+            raise ValueError(f"Signature rule {rule.name!r} uses named groups or backreferences")
+        names.add(rule.name)
+        rules.append(rule)
+    return rules
+
+
+class SignatureEngine:
+    """
+    Classifies a request against all rules. Per target, one alternation of
+    every rule's pattern is tried first, so a request that matches nothing
+    costs a single scan; only when it matches is each of the target's rules
+    searched on its own, so rules matching overlapping text are all
+    reported. Returns rule names in file order.
+    """
+
+    def __init__(self, rules: list):
+        self.rules = rules
+        self._targets = []
+        for target in TARGETS:
+            target_rules = [rule for rule in rules if target in rule.targets]
+            if target_rules:
+                prefilter = re.compile('|'.join(f'(?:{rule.pattern})' for rule in target_rules), re.IGNORECASE)
+                checks = tuple((rule.name, re.compile(rule.pattern, re.IGNORECASE)) for rule in target_rules)
+                self._targets.append((target, prefilter, checks))
+        self._order = {rule.name: index for index, rule in enumerate(rules)}
+        self._by_name = {rule.name: rule for rule in rules}
+
+    def classify(self, path: str, query: str, headers: dict) -> tuple:
+        found = None
+        for target, prefilter, checks in self._targets:
+            if target == 'path':
+                subject = path
+            elif target == 'query':
+                subject = query
+            else:
+                subject = '\n'.join(headers.values())
+            if not subject or prefilter.search(subject) is None:
+                continue
+            for name, regex in checks:
+                if regex.search(subject) is not None:
+                    if found is None:
+                        found = set()
+                    found.add(name)
+        if found is None:
+            return ()
+        return tuple(sorted(found, key=self._order.__getitem__))
+
+    def categories(self, names) -> str:
+        """AbuseIPDB categories for the matched rules, or ABUSEIPDB_CATEGORIES when none carry any."""
+        categories = sorted({category for name in names for category in self._by_name[name].categories})
+        return ','.join(map(str, categories)) if categories else config.ABUSEIPDB_CATEGORIES
+
+    def strategy(self, names):
+        """Drip strategy of the first matched rule that names one."""
+        for name in names:
+            strategy = self._by_name[name].strategy
+            if strategy:
+                return strategy
+        return None
+
+
+_engine = None
+
+def get_signature_engine() -> SignatureEngine:
+    global _engine
+    if _engine is None:
+        rules = load_rules(config.SIGNATURE_RULES_FILE)
+        _engine = SignatureEngine(rules)
+        log.info(f"Loaded {len(rules)} signature rules from {config.SIGNATURE_RULES_FILE}")
+    return _engine
+
+def classify_request(path: str, query: str, headers: dict) -> tuple:
+    return get_signature_engine().classify(path, query, headers)
@@ -1,43 +1,379 @@
 import asyncio
 import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
 from aiohttp import web
 
 from .request_handler import handle_request
+from .reporting.abuseipdb_reporter import start_reporter, stop_reporter
+from .utils.geoip_lookup import watch_geoip_databases
+from .drip_scheduler import stop_drip_scheduler, drain_drip_scheduler
+from .raw_protocol import RawTarpitSite
+from .proxy_protocol import ProxyProtocolSite
+from .utils.client_address import get_client_resolver
+from .logger_setup import setup_logging, stop_logging, stop_log_rotation
+from .database import start_event_writer, stop_event_writer, warm_reported_ip_cache, run_partition_maintenance
+from .metrics_server import MetricsSite
+from .admin_server import AdminSite
+from .sessions import run_session_sweeper, flush_sessions
+from .firewall import get_firewall_exporter, run_firewall_exporter, stop_firewall_exporter
+from .signatures import get_signature_engine
+from .drip_strategies import STRATEGY_CLASSES
 from . import config
 
 log = logging.getLogger(__name__) 
 
-async def run_server():
+LISTEN_FD_ENV = 'TARPIT_LISTEN_FD'
+SD_LISTEN_FDS_START = 3
+
+def inherited_listen_socket():
+    """
+    The listening socket handed to this process, if any: fd 3 under systemd
+    socket activation (LISTEN_FDS/LISTEN_PID), or TARPIT_LISTEN_FD from a
+    predecessor that restarted into this process. The variables are removed
+    so that forked workers and successors don't pick them up again.
+    """
+    fd = None
+    if os.environ.get('LISTEN_PID') == str(os.getpid()) and int(os.environ.get('LISTEN_FDS', '0')) >= 1:
+        fd = SD_LISTEN_FDS_START
+    elif os.environ.get(LISTEN_FD_ENV):
+        fd = int(os.environ[LISTEN_FD_ENV])
+    for name in ('LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES', LISTEN_FD_ENV):
+        os.environ.pop(name, None)
+    if fd is None:
+        return None
+    sock = socket.socket(fileno=fd)
+    sock.setblocking(False)
+    log.info(f"Using inherited listening socket fd {fd} ({sock.getsockname()})")
+    return sock
+
+def spawn_successor(sock=None) -> int:
+    """
+    Starts a fresh copy of the application (re-reading code and config) that
+    accepts on `sock`, or binds on its own when None (SO_REUSEPORT workers).
+    Returns its pid.
+    """
+    env = dict(os.environ)
+    env.pop('TARPIT_WORKER_INDEX', None)
+    pass_fds = ()
+    if sock is not None:
+        env[LISTEN_FD_ENV] = str(sock.fileno())
+        pass_fds = (sock.fileno(),)
+    process = subprocess.Popen([sys.executable, *sys.argv], env=env, pass_fds=pass_fds, start_new_session=True)
+    log.info(f"Started successor process {process.pid}" + (f" on listening fd {sock.fileno()}" if sock else ""))
+    return process.pid
+
+def notify_systemd(state: str):
+    """sd_notify(3) without libsystemd; a no-op unless started by systemd with Type=notify."""
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as notify_socket:
+            notify_socket.sendto(state.encode(), address)
+    except OSError as e:
+        log.warning(f"Could not notify systemd ({state!r}): {e}")
+
+async def run_server(reuse_port: bool = False, sock=None):
     """
     Настраивает и запускает aiohttp сервер тарпита.
+    With TARPIT_ENGINE="protocol" connections are served by the raw
+    asyncio.Protocol engine instead of the aiohttp application. `sock` is
+    an already listening socket to serve on instead of binding HOST:PORT.
+
+    SIGTERM/SIGINT stop accepting and give trapped clients
+    SHUTDOWN_GRACE_SECONDS; SIGUSR1 does the same with RESTART_DRAIN_SECONDS.
+    SIGHUP (single process only) first starts a successor on the same
+    listening socket, so nothing is refused while this process drains.
+    Holds still open after the drain are finished and their events written;
+    a second stop signal cuts the drain short.
     """
-    app = web.Application()
-    app.router.add_route('*', '/{tail:.*}', handle_request)
+    runner = None
+    if config.TARPIT_ENGINE == "protocol":
+        # Holds are drained by drain_drip_scheduler; what is left for stop() are idle connections.
+        site = RawTarpitSite(config.HOST, config.PORT, reuse_port=reuse_port, shutdown_timeout=0, sock=sock)
+    else:
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', handle_request)
+
+        runner = web.AppRunner(app, shutdown_timeout=config.SHUTDOWN_GRACE_SECONDS)
+        await runner.setup()
+        if config.PROXY_PROTOCOL:
+            site = ProxyProtocolSite(runner, config.HOST, config.PORT, reuse_port=reuse_port, sock=sock,
+                                     backlog=config.SERVER_BACKLOG)
+        elif sock is not None:
+            site = web.SockSite(runner, sock, backlog=config.SERVER_BACKLOG)
+        else:
+            site = web.TCPSite(runner, config.HOST, config.PORT, reuse_port=reuse_port,
+                               backlog=config.SERVER_BACKLOG)
+
+    worker_index = int(os.environ.get('TARPIT_WORKER_INDEX', '0'))
+    is_worker = 'TARPIT_WORKER_INDEX' in os.environ
+    stop_event = asyncio.Event()
+    cut_drain_short = asyncio.Event()
+    shutdown = {'drain_seconds': config.SHUTDOWN_GRACE_SECONDS, 'hand_off': False, 'restart': False}
+
+    def request_stop(drain_seconds: float, hand_off: bool = False, restart: bool = False):
+        if stop_event.is_set():
+            cut_drain_short.set()
+            return
+        shutdown['drain_seconds'] = drain_seconds
+        shutdown['hand_off'] = hand_off
+        shutdown['restart'] = restart or hand_off
+        stop_event.set()
 
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, config.HOST, config.PORT)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, request_stop, config.SHUTDOWN_GRACE_SECONDS)
+    loop.add_signal_handler(signal.SIGUSR1, request_stop, config.RESTART_DRAIN_SECONDS, False, True)
+    if not is_worker:
+        loop.add_signal_handler(signal.SIGHUP, request_stop, config.RESTART_DRAIN_SECONDS, True)
 
     log.info(f"Attempting to start HTTP Tarpit server on http://{config.HOST}:{config.PORT}")
-    log.info(f"Tarpit settings: Delay={config.RESPONSE_DELAY_SECONDS}s, Chunk={config.RESPONSE_CHUNK!r}, MaxBytes={config.MAX_RESPONSE_BYTES}")
+    log.info(f"Tarpit settings: Engine={config.TARPIT_ENGINE}, Delay={config.RESPONSE_DELAY_SECONDS}s, Chunk={config.RESPONSE_CHUNK!r}, MaxBytes={config.MAX_RESPONSE_BYTES}")
+    if config.TARPIT_ENGINE != "protocol" and getattr(STRATEGY_CLASSES.get(config.DRIP_STRATEGY), 'raw_head', False):
+        log.warning(f"DRIP_STRATEGY={config.DRIP_STRATEGY} writes its own response head, which needs "
+                    f"TARPIT_ENGINE=protocol; the aiohttp engine uses the fixed drip instead")
 
+    metrics_site = None
+    if config.METRICS_ENABLED:
+        metrics_site = MetricsSite(config.METRICS_HOST, config.METRICS_PORT + worker_index)
+    admin_site = None
+    if config.LIVE_EVENTS_ENABLED:
+        admin_site = AdminSite(config.LIVE_EVENTS_HOST, config.LIVE_EVENTS_PORT + worker_index)
+
+    geoip_watcher = asyncio.create_task(watch_geoip_databases(), name="geoip-watcher")
+    session_sweeper = asyncio.create_task(run_session_sweeper(), name="session-sweeper")
+    firewall_exporter = None
+    if config.FIREWALL_ENABLED:
+        firewall_exporter = asyncio.create_task(run_firewall_exporter(), name="firewall-exporter")
+    partition_maintenance = None
+    if config.DB_PARTITIONING_ENABLED and worker_index == 0:
+        # One process moves events between files; the other workers only write the hot partition.
+        partition_maintenance = asyncio.create_task(run_partition_maintenance(), name="partition-maintenance")
+    site_started = False
     try:
+        get_signature_engine()
+        get_client_resolver()
+        if config.FIREWALL_ENABLED:
+            get_firewall_exporter()
+        warm_reported_ip_cache()
+        start_event_writer()
+        await start_reporter()
         await site.start()
+        site_started = True
+        if metrics_site is not None:
+            await metrics_site.start()
+        if admin_site is not None:
+            await admin_site.start()
         log.info("Server started successfully. Waiting for connections...")
+        if not is_worker:
+            notify_systemd(f"READY=1\nMAINPID={os.getpid()}")
         while True:
-            await asyncio.sleep(3600) # Просыпаемся раз в час для проверки
+            await stop_event.wait()
+            log.info("Stop signal received.")
+            if not shutdown['hand_off']:
+                break
+            try:
+                spawn_successor(sock or site._server.sockets[0])
+                break
+            except OSError as e:
+                log.error(f"Could not start a successor, keeping this process running: {e}")
+                stop_event.clear()
     except Exception as e:
         log.exception("Failed to start or run the server")
-        await runner.cleanup()
         raise 
     finally:
         log.info("Shutting down server resources...")
-        if 'site' in locals() and site._server is not None: 
-            log.info("Stopping TCPSite...")
-            await site.stop()
-            log.info("TCPSite stopped.")
-        if 'runner' in locals():
+        geoip_watcher.cancel()
+        session_sweeper.cancel()
+        if firewall_exporter is not None:
+            firewall_exporter.cancel()
+        if partition_maintenance is not None:
+            partition_maintenance.cancel()
+        if shutdown['restart']:
+            # The successor writes the same log file and rotates it from now on.
+            stop_log_rotation()
+            # The successor is waiting for these ports; its counters and streams take over from here.
+            if metrics_site is not None:
+                await metrics_site.stop()
+                metrics_site = None
+            if admin_site is not None:
+                await admin_site.stop()
+                admin_site = None
+        if site_started:
+            log.info("Stopping listener...")
+            if isinstance(site, RawTarpitSite):
+                site.close()
+            else:
+                await site.stop()
+            await drain_drip_scheduler(shutdown['drain_seconds'], cut_drain_short)
+            if isinstance(site, RawTarpitSite):
+                await site.stop()
+            log.info("Listener stopped.")
+        if runner is not None:
             log.info("Cleaning up AppRunner...")
             await runner.cleanup()
             log.info("AppRunner cleaned up.")
-        log.info("Server resources shut down.")
\ No newline at end of file
+        if metrics_site is not None:
+            await metrics_site.stop()
+        if admin_site is not None:
+            await admin_site.stop()
+        stop_drip_scheduler()
+        log.info("Stopping AbuseIPDB reporter...")
+        await stop_reporter()
+        await stop_firewall_exporter()
+        flush_sessions()
+        log.info("Flushing SQLite event writer...")
+        await asyncio.to_thread(stop_event_writer)
+        log.info("Server resources shut down.")
+
+
+def _run_worker(index: int, sock=None):
+    os.environ['TARPIT_WORKER_INDEX'] = str(index)
+    setup_logging(worker_index=index)
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+    # Restarts go through the supervisor; a HUP sent to the whole group must not kill workers.
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    code = 0
+    try:
+        asyncio.run(run_server(reuse_port=sock is None, sock=sock))
+    except Exception:
+        log.exception(f"Worker {index} (pid {os.getpid()}) crashed")
+        code = 1
+    finally:
+        stop_logging()
+        logging.shutdown()
+    os._exit(code)
+
+
+def run_supervisor(workers: int = None):
+    """
+    Forks `workers` processes that all bind HOST:PORT with SO_REUSEPORT, so
+    the kernel spreads incoming connections between them (or that all
+    accept on the inherited socket under socket activation). Workers that
+    die unexpectedly are restarted (with a growing delay if they keep
+    crashing). SIGTERM/SIGINT are forwarded to the workers, which stop
+    accepting, let their connections finish for SHUTDOWN_GRACE_SECONDS and
+    flush their DB/report queues; stragglers are killed after that.
+
+    SIGHUP restarts without refusing connections: a successor supervisor is
+    started first, then the workers get SIGUSR1 and drain for
+    RESTART_DRAIN_SECONDS while the successor's workers take new clients.
+
+    Each worker runs its own SQLite writer thread against the shared WAL
+    database, and report dedup across workers goes through reported_ips
+    (see database.claim_ips_across_workers).
+
+    The supervisor itself starts no threads (main.py sets up its logging
+    with threaded=False), so no fork, including the restart of a crashed
+    worker, can copy a lock that another thread holds. Workers set up their
+    logging thread, DB writer and everything else after the fork.
+    """
+    workers = workers or config.SERVER_WORKERS
+    sock = inherited_listen_socket()
+    children = {}
+    started_at = {}
+    restart_delays = {}
+    stopping = False
+    restarting = False
+
+    def spawn(index: int):
+        others = [thread.name for thread in threading.enumerate() if thread is not threading.current_thread()]
+        if others:
+            log.warning(f"Forking worker {index} while other threads are running: {', '.join(others)}")
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(index, sock)
+        children[pid] = index
+        started_at[index] = time.monotonic()
+        log.info(f"Started worker {index} with pid {pid}")
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    def request_restart(signum, frame):
+        nonlocal stopping, restarting
+        stopping = restarting = True
+
+    def forward_stop(signum, frame):
+        # A stop signal during a restart drain: the workers then finalize their holds at once.
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGHUP, request_restart)
+
+    listening = f"inherited socket {sock.getsockname()}" if sock else f"{config.HOST}:{config.PORT} with SO_REUSEPORT"
+    log.info(f"Supervisor (pid {os.getpid()}) starting {workers} workers on {listening}")
+    for index in range(workers):
+        spawn(index)
+    notify_systemd(f"READY=1\nMAINPID={os.getpid()}")
+
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.5)
+            continue
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        delay = config.WORKER_RESTART_DELAY_SECONDS
+        if time.monotonic() - started_at[index] < 10:
+            delay = min(restart_delays.get(index, delay / 2) * 2, 30.0)
+        restart_delays[index] = delay
+        log.error(f"Worker {index} (pid {pid}) exited with code {code}, restarting in {delay:.1f}s")
+        # Short sleeps, so a stop signal does not wait out the backoff.
+        restart_at = time.monotonic() + delay
+        while not stopping and time.monotonic() < restart_at:
+            time.sleep(max(0.0, min(0.5, restart_at - time.monotonic())))
+        if not stopping:
+            spawn(index)
+
+    stop_signal, drain_seconds = signal.SIGTERM, config.SHUTDOWN_GRACE_SECONDS
+    if restarting:
+        spawn_successor(sock)
+        stop_log_rotation()
+        stop_signal, drain_seconds = signal.SIGUSR1, config.RESTART_DRAIN_SECONDS
+        signal.signal(signal.SIGTERM, forward_stop)
+    log.info(f"Supervisor stopping {len(children)} workers...")
+    for pid in list(children):
+        try:
+            os.kill(pid, stop_signal)
+        except ProcessLookupError:
+            children.pop(pid, None)
+    deadline = time.monotonic() + drain_seconds + 15
+    while children and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.2)
+            continue
+        children.pop(pid, None)
+    for pid in children:
+        log.warning(f"Worker pid {pid} did not stop in time, killing it")
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+    log.info("Supervisor stopped.")
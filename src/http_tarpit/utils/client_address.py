@@ -0,0 +1,133 @@
+import ipaddress
+import logging
+from functools import lru_cache
+
+from .. import config
+from .ip_filters import is_non_public_address
+
+log = logging.getLogger(__name__)
+
+UNKNOWN_CLIENT = "Unknown_Proxy"
+
+
+class CidrSet:
+    """
+    Networks compiled for membership tests: per IP version, one set of
+    network numbers for each distinct prefix length. A lookup is a shift and
+    a set probe per distinct length, however many networks there are.
+    """
+
+    __slots__ = ('_tables', 'networks')
+
+    def __init__(self, networks):
+        self.networks = tuple(ipaddress.ip_network(net.strip(), strict=False) if isinstance(net, str) else net
+                              for net in networks if not isinstance(net, str) or net.strip())
+        tables = {4: {}, 6: {}}
+        for net in self.networks:
+            shift = net.max_prefixlen - net.prefixlen
+            tables[net.version].setdefault(shift, set()).add(int(net.network_address) >> shift)
+        self._tables = {version: tuple(sorted(by_shift.items())) for version, by_shift in tables.items()}
+
+    def __contains__(self, addr) -> bool:
+        value = int(addr)
+        for shift, prefixes in self._tables[addr.version]:
+            if value >> shift in prefixes:
+                return True
+        return False
+
+    def __len__(self):
+        return len(self.networks)
+
+
+class ClientAddress:
+    """A parsed client address; `ip` is the canonical text used for logs, the DB and every cache key."""
+
+    __slots__ = ('ip', 'addr', 'is_public')
+
+    def __init__(self, addr, ip: str = None):
+        self.addr = addr
+        self.ip = str(addr) if addr is not None else (ip or UNKNOWN_CLIENT)
+        self.is_public = addr is not None and not is_non_public_address(addr)
+
+    def __str__(self):
+        return self.ip
+
+    def __repr__(self):
+        return f"ClientAddress({self.ip!r})"
+
+
+UNKNOWN_ADDRESS = ClientAddress(None)
+
+
+@lru_cache(maxsize=65536)
+def client_address(text: str) -> ClientAddress:
+    """
+    Parses an address as found in a peername or a proxy header: surrounding
+    blanks, "[v6]:port" and "v4:port" forms are accepted and IPv4-mapped
+    IPv6 addresses are unwrapped. Unparsable text gives an address with
+    addr None.
+    """
+    text = text.strip()
+    if text.startswith('['):
+        text = text[1:].partition(']')[0]
+    elif text.count(':') == 1:
+        text = text.partition(':')[0]
+    try:
+        addr = ipaddress.ip_address(text)
+    except ValueError:
+        return ClientAddress(None, text or None)
+    if addr.version == 6 and addr.ipv4_mapped is not None:
+        addr = addr.ipv4_mapped
+    return ClientAddress(addr)
+
+
+class ClientAddressResolver:
+    """
+    Decides who the client is. Proxy headers are only believed when the
+    connection comes from a trusted proxy; X-Forwarded-For is then walked
+    right to left, skipping trusted hops, and the first untrusted address
+    is the client (entries to its left were written by the client itself).
+    """
+
+    def __init__(self, trusted_proxies):
+        self.trusted = CidrSet(trusted_proxies)
+        self._is_trusted = lru_cache(maxsize=4096)(self._check_trusted)
+
+    def _check_trusted(self, address: ClientAddress) -> bool:
+        return address.addr is not None and address.addr in self.trusted
+
+    def is_trusted(self, peer_ip: str) -> bool:
+        return self._is_trusted(client_address(peer_ip))
+
+    def resolve(self, peer_ip: str, forwarded_for: str = '', real_ip: str = '') -> ClientAddress:
+        if not peer_ip:
+            return UNKNOWN_ADDRESS
+        peer = client_address(peer_ip)
+        if not self._is_trusted(peer):
+            return peer
+        if forwarded_for:
+            hop = peer
+            for entry in reversed(forwarded_for.split(',')):
+                candidate = client_address(entry)
+                if candidate.addr is None:
+                    # Not an address; the hop that passed it on is the best we know.
+                    break
+                hop = candidate
+                if not self._is_trusted(candidate):
+                    break
+            return hop
+        if real_ip:
+            candidate = client_address(real_ip)
+            if candidate.addr is not None:
+                return candidate
+        return peer
+
+
+_resolver = None
+
+def get_client_resolver() -> ClientAddressResolver:
+    global _resolver
+    if _resolver is None:
+        _resolver = ClientAddressResolver(config.TRUSTED_PROXY_CIDRS.split(','))
+        log.info(f"Trusting proxy headers from {len(_resolver.trusted)} networks: {config.TRUSTED_PROXY_CIDRS}")
+    return _resolver
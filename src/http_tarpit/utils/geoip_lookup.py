@@ -1,65 +1,194 @@
 import logging
+import asyncio
+import threading
+import time
+from collections import OrderedDict
 import geoip2.database
 from geoip2.errors import AddressNotFoundError
+from maxminddb import MODE_MMAP
 
 from .. import config 
+from .ip_filters import is_non_public_ip
 
 log = logging.getLogger(__name__)
 
-_city_reader = None
-_asn_reader = None
+# (city_reader, asn_reader), swapped as one tuple so a lookup never mixes
+# readers from two different database generations.
+_readers = (None, None)
+_reader_signatures = (None, None)
 
-def _initialize_geoip_readers():
-    global _city_reader, _asn_reader
+def _file_signature(path):
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
 
-    if config.GEOIP_CITY_ENABLED:
-        try:
-            _city_reader = geoip2.database.Reader(str(config.GEOLITE2_CITY_DB_PATH))
-            log.info(f"GeoLite2 City DB loaded from: {config.GEOLITE2_CITY_DB_PATH}")
-        except FileNotFoundError:
-            log.error(f"GeoLite2 City DB file not found at: {config.GEOLITE2_CITY_DB_PATH}")
-            _city_reader = None
-        except Exception as e:
-            log.error(f"Failed to load GeoLite2 City DB from {config.GEOLITE2_CITY_DB_PATH}: {e}")
-            _city_reader = None
+def _open_reader(path, label: str):
+    # MODE_MMAP: pages are shared through the page cache between worker
+    # processes instead of each process holding a private copy of the file.
+    try:
+        reader = geoip2.database.Reader(str(path), mode=MODE_MMAP)
+        log.info(f"GeoLite2 {label} DB loaded (mmap) from: {path}")
+        return reader
+    except FileNotFoundError:
+        log.error(f"GeoLite2 {label} DB file not found at: {path}")
+    except Exception as e:
+        log.error(f"Failed to load GeoLite2 {label} DB from {path}: {e}")
+    return None
+
+def open_geoip_readers():
+    """Opens fresh (city_reader, asn_reader); either is None when its file is missing or unreadable."""
+    city_reader = asn_reader = None
+    if config.GEOLITE2_CITY_DB_PATH.exists():
+        city_reader = _open_reader(config.GEOLITE2_CITY_DB_PATH, "City")
     else:
         log.warning(f"GeoLite2 City DB not found or disabled by config. Path checked: {config.GEOLITE2_CITY_DB_PATH}")
-
-    if config.GEOIP_ASN_ENABLED:
-        try:
-            _asn_reader = geoip2.database.Reader(str(config.GEOLITE2_ASN_DB_PATH))
-            log.info(f"GeoLite2 ASN DB loaded from: {config.GEOLITE2_ASN_DB_PATH}")
-        except FileNotFoundError:
-            log.error(f"GeoLite2 ASN DB file not found at: {config.GEOLITE2_ASN_DB_PATH}")
-            _asn_reader = None
-        except Exception as e:
-            log.error(f"Failed to load GeoLite2 ASN DB from {config.GEOLITE2_ASN_DB_PATH}: {e}")
-            _asn_reader = None
+    if config.GEOLITE2_ASN_DB_PATH.exists():
+        asn_reader = _open_reader(config.GEOLITE2_ASN_DB_PATH, "ASN")
     else:
         log.warning(f"GeoLite2 ASN DB not found or disabled by config. Path checked: {config.GEOLITE2_ASN_DB_PATH}")
+    return city_reader, asn_reader
+
+def _current_signatures():
+    return _file_signature(config.GEOLITE2_CITY_DB_PATH), _file_signature(config.GEOLITE2_ASN_DB_PATH)
+
+def _initialize_geoip_readers():
+    global _readers, _reader_signatures
+    _reader_signatures = _current_signatures()
+    _readers = open_geoip_readers()
 
 _initialize_geoip_readers() 
 
+def reload_geoip_readers_if_changed() -> bool:
+    """
+    Swaps in new readers when a .mmdb file was replaced. Lookups already
+    running keep the old readers until they return; those are released when
+    the last reference goes away, so nothing is closed under a lookup.
+    """
+    global _readers, _reader_signatures
+    signatures = _current_signatures()
+    if signatures == _reader_signatures:
+        return False
+    log.info("GeoLite2 database files changed on disk, reloading readers.")
+    new_readers = open_geoip_readers()
+    old_readers = _readers
+    merged = tuple(new if new is not None or sig is None else old
+                   for new, old, sig in zip(new_readers, old_readers, signatures))
+    _readers = merged
+    _reader_signatures = signatures
+    _geoip_cache.clear()
+    return True
+
+async def watch_geoip_databases(interval: float = None):
+    interval = interval or config.GEOIP_RELOAD_CHECK_SECONDS
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(reload_geoip_readers_if_changed)
+        except Exception:
+            log.exception("GeoIP reload check failed")
+
+class GeoIPCache:
+    """Bounded LRU of parsed lookup results with TTL expiry. Cached dicts are shared, treat them as read-only."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, ip_address: str):
+        with self._lock:
+            entry = self._entries.get(ip_address)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[ip_address]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(ip_address)
+            self.hits += 1
+            return entry[1]
+
+    def peek(self, ip_address: str):
+        """Like get(), but leaves hit/miss counters and LRU order alone."""
+        with self._lock:
+            entry = self._entries.get(ip_address)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            return entry[1]
+
+    def put(self, ip_address: str, geoip_data: dict):
+        with self._lock:
+            self._entries[ip_address] = (time.monotonic() + self.ttl_seconds, geoip_data)
+            self._entries.move_to_end(ip_address)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_geoip_cache = GeoIPCache(config.GEOIP_CACHE_MAX_ENTRIES, config.GEOIP_CACHE_TTL_SECONDS)
+
+def get_geoip_cache_stats() -> dict:
+    return _geoip_cache.stats()
+
+def cached_geoip_data(ip_address: str):
+    """Cache-only lookup for hot paths that cannot wait for the reader; None when not cached."""
+    return _geoip_cache.peek(ip_address)
+
+async def lookup_geoip_data(ip_address: str) -> dict:
+    """Cache hits are answered inline on the event loop; only misses pay for the thread hop."""
+    if is_non_public_ip(ip_address):
+        return {}
+    cached = _geoip_cache.get(ip_address)
+    if cached is not None:
+        return cached
+    return await asyncio.to_thread(_lookup_and_cache, ip_address)
+
 def get_geoip_data(ip_address: str) -> dict:
-    if not ip_address or \
-       ip_address == "127.0.0.1" or \
-       ip_address.startswith("192.168.") or \
-       ip_address.startswith("10.") or \
-       ip_address.startswith("172.16.") or \
-       ip_address.startswith("172.17.") or \
-       ip_address.startswith("172.18.") or \
-       ip_address.startswith("172.19.") or \
-       ip_address.startswith("172.2") or \
-       ip_address.startswith("172.30.") or \
-       ip_address.startswith("172.31."):
+    if is_non_public_ip(ip_address):
         log.debug(f"Skipping GeoIP lookup for private/local IP: {ip_address}")
         return {} 
-    
+    cached = _geoip_cache.get(ip_address)
+    if cached is not None:
+        return cached
+    return _lookup_and_cache(ip_address)
+
+def lookup_geoip_batch(ip_addresses, readers=None) -> dict:
+    """ip -> GeoIP data for many public addresses, bypassing the cache; for offline enrichment."""
+    readers = readers or _readers
+    return {ip: _lookup(ip, readers) for ip in ip_addresses if not is_non_public_ip(ip)}
+
+def _lookup_and_cache(ip_address: str) -> dict:
+    geoip_data = _lookup(ip_address)
+    _geoip_cache.put(ip_address, geoip_data)
+    return geoip_data
+
+def _lookup(ip_address: str, readers=None) -> dict:
     geoip_data = {}
+    city_reader, asn_reader = readers or _readers
     
-    if _city_reader:
+    if city_reader:
         try:
-            city_response = _city_reader.city(ip_address)
+            city_response = city_reader.city(ip_address)
             if city_response.country and city_response.country.iso_code:
                 geoip_data['country_iso_code'] = city_response.country.iso_code
             if city_response.country and city_response.country.name:
@@ -75,9 +204,9 @@ def get_geoip_data(ip_address: str) -> dict:
         except Exception as e:
             log.error(f"Error looking up GeoIP City for {ip_address}: {e}")
         
-    if _asn_reader:
+    if asn_reader:
         try:
-            asn_response = _asn_reader.asn(ip_address)
+            asn_response = asn_reader.asn(ip_address)
             if asn_response.autonomous_system_number:
                 geoip_data['asn_number'] = asn_response.autonomous_system_number
             if asn_response.autonomous_system_organization:
@@ -0,0 +1,32 @@
+import ipaddress
+from functools import lru_cache
+
+# Ranges that are never worth a GeoIP lookup or an AbuseIPDB report:
+# private, loopback, link-local, CGNAT, documentation, multicast and reserved.
+_NON_PUBLIC_NETWORKS_V4 = tuple(ipaddress.IPv4Network(net) for net in (
+    "0.0.0.0/8", "10.0.0.0/8", "100.64.0.0/10", "127.0.0.0/8", "169.254.0.0/16",
+    "172.16.0.0/12", "192.0.0.0/24", "192.0.2.0/24", "192.168.0.0/16", "198.18.0.0/15",
+    "198.51.100.0/24", "203.0.113.0/24", "224.0.0.0/4", "240.0.0.0/4",
+))
+_NON_PUBLIC_NETWORKS_V6 = tuple(ipaddress.IPv6Network(net) for net in (
+    "::/128", "::1/128", "64:ff9b:1::/48", "100::/64", "2001:db8::/32",
+    "fc00::/7", "fe80::/10", "ff00::/8",
+))
+
+
+def is_non_public_address(addr) -> bool:
+    if addr.version == 6:
+        if addr.ipv4_mapped is not None:
+            return is_non_public_address(addr.ipv4_mapped)
+        return any(addr in net for net in _NON_PUBLIC_NETWORKS_V6)
+    return any(addr in net for net in _NON_PUBLIC_NETWORKS_V4)
+
+
+@lru_cache(maxsize=65536)
+def is_non_public_ip(ip_address: str) -> bool:
+    """True for private/reserved addresses and for anything that does not parse as an IP."""
+    try:
+        addr = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return True
+    return is_non_public_address(addr)
@@ -0,0 +1,29 @@
+import datetime
+
+import pytest
+
+from http_tarpit import config, database
+from http_tarpit.request_handler import new_event_log_data
+
+
+@pytest.fixture
+def events_db(tmp_path, monkeypatch):
+    """A fresh events database (and partition directory) under tmp_path."""
+    monkeypatch.setattr(database, 'DB_FILE', tmp_path / 'events.db')
+    monkeypatch.setattr(config, 'DB_PARTITION_DIR', tmp_path / 'partitions')
+    database._clear_lookup_caches()
+    database.init_db()
+    yield tmp_path / 'events.db'
+    database._clear_lookup_caches()
+
+
+@pytest.fixture
+def log_event(events_db):
+    """Writes a finished GET /.env event at noon on `day` into events_db."""
+    def log(day: datetime.date, ip: str = '8.8.8.8'):
+        event = new_event_log_data(ip, 40000, 80, 'GET', '/.env', '', '1.1', 'test-agent', {'User-Agent': 'test-agent'})
+        event['timestamp'] = f"{day.isoformat()}T12:00:00+00:00"
+        event['response_status'] = 200
+        event['duration_s'] = 1.5
+        database.log_event_to_db(event)
+    return log
@@ -0,0 +1,260 @@
+import asyncio
+import csv
+import io
+import json
+import sqlite3
+import time
+
+from aiohttp import web
+
+from http_tarpit.reporting import abuseipdb_reporter
+from http_tarpit.reporting.abuseipdb_reporter import AbuseIPDBReporter, ReportJob, TokenBucket, build_bulk_report_csv
+
+REPORT_OK = json.dumps({'data': {'ipAddress': '8.8.8.8', 'abuseConfidenceScore': 100}})
+
+
+class StubAPI:
+    """A local AbuseIPDB stand-in: answers /report from a script of (status, body, headers), /bulk-report with bulk_body."""
+
+    def __init__(self, report_responses=(), bulk_body=None):
+        self.report_responses = list(report_responses)
+        self.bulk_body = bulk_body
+        self.reports = []
+        self.bulk_csvs = []
+        self.url = None
+        self._runner = None
+
+    async def handle_report(self, request):
+        self.reports.append(dict(await request.post()))
+        status, body, headers = self.report_responses.pop(0) if self.report_responses else (200, REPORT_OK, {})
+        return web.Response(status=status, text=body, headers=headers)
+
+    async def handle_bulk_report(self, request):
+        form = await request.post()
+        self.bulk_csvs.append(form['csv'].file.read().decode())
+        return web.Response(text=json.dumps(self.bulk_body))
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post('/report', self.handle_report)
+        app.router.add_post('/bulk-report', self.handle_bulk_report)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._runner.cleanup()
+
+
+def backlog_ips(db_file) -> list:
+    with sqlite3.connect(db_file) as conn:
+        return sorted(row[0] for row in conn.execute("SELECT ip FROM abuseipdb_backlog"))
+
+
+def make_reporter(api, **kwargs):
+    options = dict(workers=1, daily_quota=86400 * 100, burst=10, max_retries=3, retry_base_delay=0.01,
+                   bulk_enabled=False)
+    options.update(kwargs)
+    return AbuseIPDBReporter('test-key', api_url=f"{api.url}/report", bulk_api_url=f"{api.url}/bulk-report", **options)
+
+
+async def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+
+def test_token_bucket_refills_at_rate(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(abuseipdb_reporter.time, 'monotonic', lambda: now[0])
+    bucket = TokenBucket(rate=0.5, capacity=2)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+    now[0] += 1.0
+    assert not bucket.try_acquire()
+    now[0] += 1.0
+    assert bucket.try_acquire()
+    now[0] += 100.0
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+    bucket.pause_until(now[0] + 60)
+    now[0] += 59
+    assert not bucket.try_acquire()
+    now[0] += 1
+    assert bucket.try_acquire()
+
+
+def test_report_is_sent_and_backlog_cleared(events_db):
+    async def scenario():
+        async with StubAPI() as api:
+            reporter = make_reporter(api)
+            await reporter.start()
+            assert reporter.submit('8.8.8.8', 80, 'GET /.env', categories='21')
+            assert not reporter.submit('8.8.8.8', 80, 'GET /.env') # still pending
+            await reporter.stop()
+            return api, reporter
+
+    api, reporter = asyncio.run(scenario())
+    assert [report['ip'] for report in api.reports] == ['8.8.8.8']
+    assert api.reports[0]['categories'] == '21'
+    assert api.reports[0]['comment'].endswith('GET /.env')
+    assert reporter.stats()['sent'] == 1
+    assert reporter.stats()['duplicates'] == 1
+    assert backlog_ips(events_db) == []
+
+
+def test_server_errors_and_rate_limits_are_retried(events_db):
+    responses = [(503, 'busy', {}), (429, '{}', {'Retry-After': '0.05'}), (200, REPORT_OK, {})]
+
+    async def scenario():
+        async with StubAPI(responses) as api:
+            reporter = make_reporter(api)
+            await reporter.start()
+            reporter.submit('8.8.8.8', 80, 'GET /')
+            await wait_for(lambda: reporter.stats()['sent'] == 1)
+            await reporter.stop()
+            return api, reporter
+
+    api, reporter = asyncio.run(scenario())
+    assert len(api.reports) == 3
+    assert reporter.stats()['retried'] == 2
+    assert reporter.stats()['rate_limited'] == 1
+    assert backlog_ips(events_db) == []
+
+
+def test_gives_up_after_max_retries(events_db):
+    async def scenario():
+        async with StubAPI([(500, 'down', {})] * 10) as api:
+            reporter = make_reporter(api, max_retries=2)
+            await reporter.start()
+            reporter.submit('8.8.8.8', 80, 'GET /')
+            await wait_for(lambda: reporter.stats()['failed'] == 1)
+            await reporter.stop()
+            return api, reporter
+
+    api, reporter = asyncio.run(scenario())
+    assert len(api.reports) == 3
+    assert reporter.stats()['sent'] == 0
+    assert backlog_ips(events_db) == []
+
+
+def test_client_errors_are_not_retried(events_db):
+    async def scenario():
+        async with StubAPI([(422, '{"errors": []}', {})]) as api:
+            reporter = make_reporter(api)
+            await reporter.start()
+            reporter.submit('8.8.8.8', 80, 'GET /')
+            await reporter.stop()
+            return api, reporter
+
+    api, reporter = asyncio.run(scenario())
+    assert len(api.reports) == 1
+    assert reporter.stats()['failed'] == 1
+    assert backlog_ips(events_db) == []
+
+
+def test_unreadable_response_body_ends_the_attempt(events_db):
+    async def scenario():
+        async with StubAPI([(200, '<html>gateway</html>', {})]) as api:
+            reporter = make_reporter(api)
+            await reporter.start()
+            reporter.submit('8.8.8.8', 80, 'GET /')
+            await reporter.stop()
+            return api, reporter
+
+    api, reporter = asyncio.run(scenario())
+    assert len(api.reports) == 1
+    assert reporter.stats()['failed'] == 1
+    assert backlog_ips(events_db) == []
+
+
+def test_stop_leaves_reports_without_quota_in_backlog(events_db):
+    ips = ['8.8.8.8', '1.1.1.1', '9.9.9.9']
+
+    async def scenario():
+        async with StubAPI() as api:
+            # One report a day and a burst of one: the second token is a day away.
+            reporter = make_reporter(api, daily_quota=1, burst=1)
+            await reporter.start()
+            for ip in ips:
+                reporter.submit(ip, 80, 'GET /')
+            await wait_for(lambda: len(api.reports) == 1)
+            started = time.monotonic()
+            await reporter.stop()
+            stop_seconds = time.monotonic() - started
+            first_run = (len(api.reports), reporter.stats(), backlog_ips(events_db))
+
+            successor = make_reporter(api)
+            await successor.start()
+            await successor.stop()
+            return stop_seconds, first_run, api, successor
+
+    stop_seconds, (sent_before, stats, backlog), api, successor = asyncio.run(scenario())
+    assert stop_seconds < 2
+    assert sent_before == 1
+    assert stats['sent'] == 1 and stats['left_in_backlog'] == 2
+    assert backlog == sorted(ip for ip in ips if ip != api.reports[0]['ip'])
+    # The next start picks the backlog up and sends the rest.
+    assert sorted(report['ip'] for report in api.reports) == sorted(ips)
+    assert successor.stats()['sent'] == 2
+    assert backlog_ips(events_db) == []
+
+
+def test_bulk_report_csv():
+    jobs = [
+        ReportJob('8.8.8.8', 80, 'GET /a, "quoted"', '2026-01-01T00:00:00+00:00'),
+        ReportJob('1.1.1.1', 443, 'x' * 2000, None, categories='21'),
+    ]
+    rows = list(csv.reader(io.StringIO(build_bulk_report_csv(jobs))))
+    assert rows[0] == ['IP', 'Categories', 'ReportDate', 'Comment']
+    assert rows[1][:3] == ['8.8.8.8', abuseipdb_reporter.config.ABUSEIPDB_CATEGORIES, '2026-01-01T00:00:00+00:00']
+    assert rows[1][3].endswith('GET /a, "quoted"')
+    assert rows[2][:3] == ['1.1.1.1', '21', '']
+    assert len(rows[2][3]) == 1024
+
+
+def test_bulk_batch_is_sent_as_one_csv(events_db):
+    bulk_body = {'data': {'savedReports': 2, 'invalidReports': [
+        {'error': 'Duplicate IP', 'input': '9.9.9.9', 'rowNumber': 3},
+    ]}}
+    ips = ['8.8.8.8', '1.1.1.1', '9.9.9.9']
+
+    async def scenario():
+        async with StubAPI(bulk_body=bulk_body) as api:
+            reporter = make_reporter(api, bulk_enabled=True, bulk_min_batch=3, bulk_max_batch=100, bulk_max_age=0.05)
+            await reporter.start()
+            for ip in ips:
+                reporter.submit(ip, 80, f'GET /{ip}')
+            await wait_for(lambda: reporter.stats()['bulk_batches'] == 1)
+            await reporter.stop()
+            return api, reporter
+
+    api, reporter = asyncio.run(scenario())
+    assert api.reports == []
+    assert len(api.bulk_csvs) == 1
+    rows = list(csv.reader(io.StringIO(api.bulk_csvs[0])))
+    assert [row[0] for row in rows[1:]] == ips
+    assert reporter.stats()['sent'] == 2
+    assert reporter.stats()['failed'] == 1
+    assert backlog_ips(events_db) == []
+
+
+def test_small_bulk_batch_falls_back_to_single_reports(events_db):
+    async def scenario():
+        async with StubAPI() as api:
+            reporter = make_reporter(api, bulk_enabled=True, bulk_min_batch=50, bulk_max_age=0.05)
+            await reporter.start()
+            reporter.submit('8.8.8.8', 80, 'GET /')
+            await wait_for(lambda: reporter.stats()['sent'] == 1)
+            await reporter.stop()
+            return api
+
+    api = asyncio.run(scenario())
+    assert api.bulk_csvs == []
+    assert [report['ip'] for report in api.reports] == ['8.8.8.8']
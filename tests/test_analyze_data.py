@@ -0,0 +1,35 @@
+import datetime
+
+from http_tarpit import database
+from scripts import analyze_data
+
+TODAY = datetime.date(2026, 3, 30)
+OLD_DAY = datetime.date(2026, 1, 7)
+
+
+def ip_counts(cache) -> dict:
+    return dict(cache.execute("SELECT key, events FROM counts WHERE dimension = 'ip'"))
+
+
+def test_roll_during_a_run_is_counted_once(log_event, tmp_path, monkeypatch):
+    log_event(OLD_DAY, '8.8.8.8')
+    log_event(TODAY, '1.1.1.1')
+    list_partitions = database.list_partitions
+
+    def roll_then_list():
+        # The roll lands after the hot table was read, before the partitions are.
+        database.roll_partitions(TODAY)
+        return list_partitions()
+
+    monkeypatch.setattr(database, 'list_partitions', roll_then_list)
+    cache = analyze_data.open_cache(tmp_path / 'cache.db')
+    assert analyze_data.update_cache(cache) == 2
+    assert ip_counts(cache) == {'8.8.8.8': 1, '1.1.1.1': 1}
+
+    monkeypatch.setattr(database, 'list_partitions', list_partitions)
+    log_event(OLD_DAY, '9.9.9.9')
+    database.roll_partitions(TODAY)
+    assert analyze_data.update_cache(cache) == 1
+    assert ip_counts(cache) == {'8.8.8.8': 1, '1.1.1.1': 1, '9.9.9.9': 1}
+    assert analyze_data.build_report(cache, 10)['hold_seconds']['events'] == 3
+    cache.close()
@@ -0,0 +1,21 @@
+from http_tarpit import config
+from http_tarpit.utils.client_address import ClientAddressResolver
+
+
+def default_resolver() -> ClientAddressResolver:
+    return ClientAddressResolver(config.TRUSTED_PROXY_CIDRS.split(','))
+
+
+def test_only_loopback_proxies_are_trusted_by_default():
+    resolver = default_resolver()
+    assert resolver.resolve('127.0.0.1', forwarded_for='8.8.8.8').ip == '8.8.8.8'
+    assert resolver.resolve('::1', real_ip='8.8.8.8').ip == '8.8.8.8'
+    # A private peer is taken at its own address, whatever it claims.
+    assert resolver.resolve('10.0.0.5', forwarded_for='8.8.8.8').ip == '10.0.0.5'
+    assert resolver.resolve('192.168.1.2', real_ip='8.8.8.8').ip == '192.168.1.2'
+
+
+def test_forwarded_for_stops_at_first_untrusted_hop():
+    resolver = ClientAddressResolver(['127.0.0.0/8', '10.0.0.5/32'])
+    assert resolver.resolve('127.0.0.1', forwarded_for='1.1.1.1, 8.8.8.8, 10.0.0.5').ip == '8.8.8.8'
+    assert resolver.resolve('127.0.0.1', forwarded_for='8.8.8.8, not-an-ip').ip == '127.0.0.1'
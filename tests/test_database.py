@@ -0,0 +1,270 @@
+import asyncio
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from http_tarpit import config, database
+from http_tarpit.request_handler import new_event_log_data
+
+TODAY = datetime.date(2026, 3, 30)
+OLD_DAY = datetime.date(2026, 1, 7)
+
+
+def partition_files():
+    return sorted(path.name for _, _, path in database.list_partitions())
+
+
+def test_old_partitions_are_compacted_to_parquet(log_event):
+    pytest.importorskip('pyarrow')
+    log_event(OLD_DAY)
+    log_event(TODAY)
+
+    result = database.maintain_partitions(TODAY)
+    assert result['moved'] == 1 and result['compacted'] == 1
+    assert partition_files() == ['events-2026-W02.parquet']
+
+    import pandas as pd
+    frame = pd.read_parquet(config.DB_PARTITION_DIR / 'events-2026-W02.parquet')
+    assert frame['http_path'].tolist() == ['/.env']
+    assert frame['user_agent'].tolist() == ['test-agent']
+
+
+def test_compaction_can_be_turned_off(log_event, monkeypatch):
+    monkeypatch.setattr(config, 'DB_PARTITION_COMPACT_AFTER_DAYS', 0)
+    log_event(OLD_DAY)
+    result = database.maintain_partitions(TODAY)
+    assert result['moved'] == 1 and result['compacted'] == 0
+    assert partition_files() == ['events-2026-W02.db']
+
+
+def test_missing_parquet_engine_warns_once_and_keeps_sqlite(log_event, monkeypatch, caplog):
+    monkeypatch.setattr(database, 'parquet_engine_available', lambda: False)
+    log_event(datetime.date.today() - datetime.timedelta(days=100))
+
+    async def run_maintenance_rounds():
+        task = asyncio.create_task(database.run_partition_maintenance(interval=0.05))
+        await asyncio.sleep(0.3)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    with caplog.at_level(logging.WARNING, logger=database.log.name):
+        asyncio.run(run_maintenance_rounds())
+    warnings = [record for record in caplog.records if 'cannot be compacted' in record.getMessage()]
+    assert len(warnings) == 1
+    assert [name.endswith('.db') for name in partition_files()] == [True]
+
+
+def count_events(db_file) -> int:
+    with sqlite3.connect(db_file) as conn:
+        return conn.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+
+
+def writer_event(ip: str = '8.8.8.8') -> dict:
+    event = new_event_log_data(ip, 40000, 80, 'GET', '/.env', '', '1.1', 'test-agent', {'User-Agent': 'test-agent'})
+    event['duration_s'] = 1.5
+    return event
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def test_writer_flushes_full_batches_in_one_transaction(events_db):
+    writer = database.EventWriter(batch_size=3, flush_interval=60)
+    writer.start()
+    try:
+        for index in range(3):
+            writer.submit(database.INSERT_EVENT_SQL, writer_event(f'8.8.8.{index}'))
+        # A full batch goes out without waiting for the flush interval.
+        wait_until(lambda: writer.stats()['written'] == 3)
+        assert writer.stats()['flushes'] == 1
+        assert count_events(events_db) == 3
+    finally:
+        writer.stop()
+
+
+def test_writer_survives_a_failing_statement(events_db):
+    async def scenario(writer):
+        writer.submit('INSERT INTO no_such_table (id) VALUES (?)', (1,))
+        # call() flushes what was queued before it, so the bad row fails on its own.
+        assert await writer.call(lambda conn: 'ran') == 'ran'
+        writer.submit(database.INSERT_EVENT_SQL, writer_event())
+        with pytest.raises(sqlite3.OperationalError):
+            await writer.call(lambda conn: conn.execute('SELECT * FROM no_such_table').fetchall())
+        # Rows queued before a call are visible to it.
+        return await writer.call(lambda conn: conn.execute('SELECT COUNT(*) FROM events').fetchone()[0])
+
+    writer = database.EventWriter(batch_size=100, flush_interval=60)
+    writer.start()
+    try:
+        assert asyncio.run(scenario(writer)) == 1
+        assert writer._thread.is_alive()
+        assert writer.stats()['failed'] == 1 and writer.stats()['written'] == 1
+    finally:
+        writer.stop()
+
+
+def test_writer_stop_drains_the_queue(events_db):
+    writer = database.EventWriter(batch_size=50, flush_interval=60)
+    writer.start()
+    for index in range(120):
+        writer.submit(database.INSERT_EVENT_SQL, writer_event(f'8.8.{index // 256}.{index % 256}'))
+    writer.stop()
+    assert count_events(events_db) == 120
+    assert writer.stats()['written'] == 120 and writer.stats()['queue_depth'] == 0
+
+
+def test_writer_drops_rows_when_the_queue_is_full(events_db):
+    writer = database.EventWriter(queue_size=2)
+    assert [writer.submit(database.INSERT_EVENT_SQL, writer_event()) for _ in range(3)] == [True, True, False]
+    assert writer.stats()['dropped'] == 1
+
+
+def test_only_one_worker_wins_a_contended_report_claim(events_db):
+    workers = 8
+    barrier = threading.Barrier(workers)
+    base = time.time()
+    results = [None] * workers
+
+    def worker(index):
+        # One connection per "worker process", each with its own claim timestamp.
+        conn = sqlite3.connect(events_db, timeout=10)
+        try:
+            claim = datetime.datetime.fromtimestamp(base + index * 0.01, datetime.timezone.utc).isoformat()
+            barrier.wait()
+            results[index] = database._claim_ips(conn, [('8.8.8.8', claim)])
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(1 for won in results if won == {'8.8.8.8'}) == 1
+    assert sum(1 for won in results if won == set()) == workers - 1
+
+
+def test_expired_cross_worker_claim_can_be_taken_again(events_db, monkeypatch):
+    stale = datetime.datetime.fromtimestamp(time.time() - 7200, datetime.timezone.utc).isoformat()
+    fresh = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    monkeypatch.setattr(database._reported_ip_cache, 'ttl_seconds', 3600)
+    with sqlite3.connect(events_db) as conn:
+        assert database._claim_ips(conn, [('8.8.8.8', stale)]) == {'8.8.8.8'}
+        # Retrying the same claim (e.g. after a restart) still wins it.
+        assert database._claim_ips(conn, [('8.8.8.8', stale)]) == {'8.8.8.8'}
+        assert database._claim_ips(conn, [('8.8.8.8', fresh)]) == {'8.8.8.8'}
+        assert database._claim_ips(conn, [('8.8.8.8', stale)]) == set()
+
+
+def test_concurrent_claims_in_one_process_have_one_winner(events_db, monkeypatch):
+    monkeypatch.setattr(database, '_reported_ip_cache', database.ReportedIPCache(ttl_seconds=3600, max_entries=100))
+
+    async def claim():
+        await asyncio.sleep(0)
+        return database.claim_ip_for_report('8.8.8.8')
+
+    async def scenario():
+        return await asyncio.gather(*(claim() for _ in range(20)))
+
+    claims = asyncio.run(scenario())
+    assert len([claim for claim in claims if claim is not None]) == 1
+    with sqlite3.connect(events_db) as conn:
+        assert conn.execute('SELECT ip FROM reported_ips').fetchall() == [('8.8.8.8',)]
+
+
+def test_reported_ip_cache_expires_after_ttl():
+    cache = database.ReportedIPCache(ttl_seconds=60, max_entries=2)
+    now = 1_000_000.0
+    assert cache.claim('8.8.8.8', now)
+    assert not cache.claim('8.8.8.8', now + 59)
+    assert cache.claim('8.8.8.8', now + 60)
+    assert cache.last_report_ts('8.8.8.8', now + 61) == now + 60
+
+    cache.mark('1.1.1.1', now + 61)
+    cache.mark('9.9.9.9', now + 62)
+    assert len(cache) == 2 and cache.last_report_ts('8.8.8.8', now + 62) is None
+    assert cache.stats()['evictions'] == 1
+
+
+# The events table as the baseline release created it, before user_version was tracked.
+BASELINE_EVENTS_TABLE = '''
+    CREATE TABLE events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        client_ip TEXT NOT NULL,
+        client_port INTEGER,
+        target_port INTEGER,
+        http_method TEXT,
+        http_path TEXT,
+        http_query TEXT,
+        user_agent TEXT,
+        headers_json TEXT,
+        response_status INTEGER,
+        bytes_sent INTEGER,
+        duration_s REAL,
+        error_message TEXT,
+        country_iso_code TEXT,
+        country_name TEXT,
+        city_name TEXT,
+        latitude REAL,
+        longitude REAL,
+        asn_number INTEGER,
+        asn_organization TEXT,
+        reported_to_abuseipdb INTEGER DEFAULT 0,
+        abuseipdb_report_timestamp TEXT
+    )
+'''
+BASELINE_COLUMNS = (
+    'timestamp', 'client_ip', 'client_port', 'target_port', 'http_method', 'http_path', 'http_query', 'user_agent',
+    'headers_json', 'response_status', 'bytes_sent', 'duration_s', 'error_message', 'country_iso_code',
+    'country_name', 'city_name', 'latitude', 'longitude', 'asn_number', 'asn_organization',
+    'reported_to_abuseipdb', 'abuseipdb_report_timestamp',
+)
+BASELINE_ROWS = [
+    ('2026-01-05T10:00:00+00:00', '8.8.8.8', 40000, 80, 'GET', '/.env', '', 'curl/8.0',
+     '{"User-Agent": "curl/8.0"}', 200, 48, 30.5, None, 'US', 'United States', None, 37.7, -122.4,
+     15169, 'GOOGLE', 1, '2026-01-05T10:00:01+00:00'),
+    ('2026-01-05T10:05:00+00:00', '8.8.8.8', 40001, 80, 'GET', '/.env', 'x=1', 'curl/8.0',
+     '{"User-Agent": "curl/8.0"}', 200, 96, 60.0, None, 'US', 'United States', None, 37.7, -122.4,
+     15169, 'GOOGLE', 0, None),
+    ('2026-01-06T08:00:00+00:00', '1.1.1.1', 50000, 443, 'POST', '/wp-login.php', '', 'Mozilla/5.0',
+     '{"Host": "tarpit", "User-Agent": "Mozilla/5.0"}', None, 0, 2.0, 'Connection reset by peer during write',
+     None, None, None, None, None, None, None, 0, None),
+]
+
+
+def test_migrates_a_baseline_database(tmp_path, monkeypatch):
+    db_file = tmp_path / 'baseline.db'
+    with sqlite3.connect(db_file) as conn:
+        conn.execute(BASELINE_EVENTS_TABLE)
+        conn.executemany(f"INSERT INTO events ({', '.join(BASELINE_COLUMNS)}) "
+                         f"VALUES ({', '.join('?' * len(BASELINE_COLUMNS))})", BASELINE_ROWS)
+    monkeypatch.setattr(database, 'DB_FILE', db_file)
+    database._clear_lookup_caches()
+    database.init_db()
+
+    with sqlite3.connect(db_file) as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == database.SCHEMA_VERSION == 4
+        assert conn.execute('SELECT value FROM user_agents ORDER BY value').fetchall() == [('Mozilla/5.0',), ('curl/8.0',)]
+        assert conn.execute('SELECT value FROM paths ORDER BY value').fetchall() == [('/.env',), ('/wp-login.php',)]
+        assert conn.execute('SELECT COUNT(*) FROM header_sets').fetchone()[0] == 2
+        details = conn.execute(f"SELECT {', '.join(BASELINE_COLUMNS)} FROM event_details ORDER BY id").fetchall()
+        assert details == BASELINE_ROWS
+        assert conn.execute('SELECT signatures FROM event_details').fetchall() == [(None,)] * 3
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert {'reported_ips', 'abuseipdb_backlog', 'sessions'} <= tables
+    # New events continue after the migrated ids.
+    event = new_event_log_data('9.9.9.9', 40000, 80, 'GET', '/.env', '', '1.1', 'curl/8.0', {'User-Agent': 'curl/8.0'})
+    database.log_event_to_db(event)
+    with sqlite3.connect(db_file) as conn:
+        assert conn.execute("SELECT id, http_path FROM event_details WHERE client_ip = '9.9.9.9'").fetchone() == (4, '/.env')
+        assert conn.execute('SELECT COUNT(*) FROM paths').fetchone()[0] == 2
+    database._clear_lookup_caches()
@@ -0,0 +1,163 @@
+import asyncio
+
+from http_tarpit import drip_scheduler
+from http_tarpit.drip_scheduler import CONNECTION_RESET_ERROR, SHUTDOWN_ERROR, DripScheduler
+from http_tarpit.drip_strategies import DripStrategy, ExponentialDrip
+
+TICK = 0.01
+
+
+class FakeTransport:
+    """Records (loop time, bytes) per write; `closing`, `buffered` and `fail_with` simulate a client going away."""
+
+    def __init__(self):
+        self.writes = []
+        self.closing = False
+        self.buffered = 0
+        self.fail_with = None
+
+    def write(self, data):
+        if self.fail_with is not None:
+            raise self.fail_with
+        self.writes.append((asyncio.get_running_loop().time(), data))
+
+    def is_closing(self):
+        return self.closing
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+    @property
+    def data(self) -> list:
+        return [data for _, data in self.writes]
+
+
+def run_with_scheduler(scenario):
+    async def main():
+        scheduler = DripScheduler(tick_seconds=TICK, slots=4, max_write_buffer=1024)
+        try:
+            return await scenario(scheduler)
+        finally:
+            scheduler.stop()
+    return asyncio.run(main())
+
+
+def test_frames_are_written_on_time():
+    transport = FakeTransport()
+
+    async def scenario(scheduler):
+        started = asyncio.get_running_loop().time()
+        conn = scheduler.add(transport, b'x', total_bytes=4, delay=0.05)
+        assert len(transport.writes) == 1 # the first chunk goes out at once
+        assert await asyncio.wait_for(conn.future, 2) == 4
+        return started, conn
+
+    started, conn = run_with_scheduler(scenario)
+    times = [at - started for at, _ in transport.writes]
+    assert transport.data == [b'x'] * 4
+    # Three waits of five ticks each, longer than the four-slot wheel.
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    assert all(0.035 <= gap < 0.3 for gap in gaps), gaps
+    assert conn.error is None and conn.done
+
+
+def test_chunked_and_raw_framing():
+    strategy = DripStrategy(chunk=b'ab', delay=TICK, max_bytes=4)
+    chunked, raw = FakeTransport(), FakeTransport()
+
+    async def scenario(scheduler):
+        conns = [strategy.start(scheduler, chunked, chunked=True), strategy.start(scheduler, raw, chunked=False)]
+        return await asyncio.wait_for(asyncio.gather(*(conn.future for conn in conns)), 2)
+
+    assert run_with_scheduler(scenario) == [4, 4]
+    assert chunked.data == [b'2\r\nab\r\n'] * 2
+    assert raw.data == [b'ab'] * 2
+
+
+def test_max_bytes_cuts_the_drip_off():
+    transport = FakeTransport()
+    strategy = ExponentialDrip(chunk=b'abc', delay=TICK, factor=1.0, max_bytes=7)
+
+    async def scenario(scheduler):
+        conn = strategy.start(scheduler, transport, chunked=False)
+        sent = await asyncio.wait_for(conn.future, 2)
+        await asyncio.sleep(TICK * 5)
+        return sent, scheduler.stats()
+
+    sent, stats = run_with_scheduler(scenario)
+    assert sent == 9
+    assert transport.data == [b'abc'] * 3
+    assert stats['active_connections'] == 0 and stats['bytes_dripped'] == 9
+
+
+def test_closed_or_failing_transport_ends_the_drip():
+    closed, failing = FakeTransport(), FakeTransport()
+
+    async def scenario(scheduler):
+        closed_conn = scheduler.add(closed, b'x', total_bytes=100, delay=TICK)
+        failing_conn = scheduler.add(failing, b'x', total_bytes=100, delay=TICK)
+        await asyncio.sleep(TICK * 3)
+        closed.closing = True
+        failing.fail_with = ConnectionResetError("peer went away")
+        await asyncio.wait_for(asyncio.gather(closed_conn.future, failing_conn.future), 2)
+        return closed_conn, failing_conn, scheduler.active
+
+    closed_conn, failing_conn, active = run_with_scheduler(scenario)
+    assert closed_conn.error == CONNECTION_RESET_ERROR
+    assert closed_conn.bytes_sent == len(closed.writes) > 1
+    assert failing_conn.error == "Error writing chunk: peer went away"
+    assert active == 0
+
+
+def test_full_write_buffer_skips_a_frame():
+    transport = FakeTransport()
+    transport.buffered = 4096
+
+    async def scenario(scheduler):
+        conn = scheduler.add(transport, b'x', total_bytes=3, delay=TICK)
+        await asyncio.sleep(TICK * 5)
+        skipped = scheduler.stats()['backpressure_skips']
+        transport.buffered = 0
+        await asyncio.wait_for(conn.future, 2)
+        return skipped
+
+    assert run_with_scheduler(scenario) >= 4
+    assert transport.data == [b'x'] * 3
+
+
+def test_drain_finishes_holds_with_shutdown_error(monkeypatch):
+    transport = FakeTransport()
+
+    async def scenario(scheduler):
+        monkeypatch.setattr(drip_scheduler, '_scheduler', scheduler)
+        conn = scheduler.add(transport, b'x', total_bytes=10_000, delay=TICK)
+        finalized = await drip_scheduler.drain_drip_scheduler(timeout=0.05)
+        late = scheduler.add(FakeTransport(), b'x', total_bytes=10, delay=TICK)
+        return finalized, conn, late
+
+    finalized, conn, late = run_with_scheduler(scenario)
+    assert finalized == 1
+    assert conn.done and conn.error == SHUTDOWN_ERROR
+    assert conn.future.result() == conn.bytes_sent
+    # Drips added after the stop finish at once with the same error.
+    assert late.done and late.error == SHUTDOWN_ERROR and late.bytes_sent == 0
+
+
+def test_discard_stops_a_drip_and_ignores_finished_ones():
+    live, finished = FakeTransport(), FakeTransport()
+
+    async def scenario(scheduler):
+        live_conn = scheduler.add(live, b'x', total_bytes=100, delay=TICK)
+        finished_conn = scheduler.add(finished, b'x', total_bytes=1, delay=TICK)
+        assert finished_conn.done and scheduler.active == 1
+        scheduler.discard(finished_conn, "handler cancelled")
+        assert scheduler.active == 1 and finished_conn.error is None
+        scheduler.discard(live_conn, "handler cancelled")
+        writes = len(live.writes)
+        await asyncio.sleep(TICK * 5)
+        return live_conn, writes, scheduler.active
+
+    live_conn, writes, active = run_with_scheduler(scenario)
+    assert live_conn.error == "handler cancelled" and live_conn.future.result() == 1
+    assert len(live.writes) == writes == 1
+    assert active == 0
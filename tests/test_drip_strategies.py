@@ -0,0 +1,62 @@
+import zlib
+
+import pytest
+
+from http_tarpit import config
+from http_tarpit.request_handler import new_event_log_data, select_drip_strategy
+from http_tarpit.drip_strategies import (
+    STRATEGY_CLASSES, ExponentialDrip, GzipBombDrip, HeaderTrickleDrip, ScheduledStrategy,
+)
+
+
+class FakeConn:
+    def __init__(self, step=0, chunked=True):
+        self.step = step
+        self.chunked = chunked
+
+
+def test_scheduled_strategy_requires_frame():
+    with pytest.raises(TypeError):
+        ScheduledStrategy()
+
+    class Incomplete(ScheduledStrategy):
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_every_registered_strategy_can_be_built():
+    for name, cls in STRATEGY_CLASSES.items():
+        assert cls().name == name
+
+
+def test_exponential_delay_is_capped():
+    strategy = ExponentialDrip(chunk=b'x', delay=1.0, factor=2.0, max_delay=10.0)
+    assert [strategy.next_delay(FakeConn(step)) for step in range(6)] == [1.0, 2.0, 4.0, 8.0, 10.0, 10.0]
+    assert strategy.frame(FakeConn(chunked=True)) == (b'1\r\nx\r\n', 1)
+    assert strategy.frame(FakeConn(chunked=False)) == (b'x', 1)
+
+
+def test_gzip_bomb_stream_stays_valid():
+    strategy = GzipBombDrip(slice_bytes=64)
+    wire = b''.join(strategy.frame(FakeConn(step, chunked=False))[0] for step in range(200))
+    inflated = zlib.decompressobj(31).decompress(wire)
+    assert len(inflated) > 1 << 20
+    assert inflated.count(0) == len(inflated)
+
+
+def test_header_trickle_never_ends_the_head():
+    strategy = HeaderTrickleDrip()
+    wire = b''.join(strategy.frame(FakeConn(step))[0] for step in range(50) if strategy.frame(FakeConn(step)))
+    assert wire.startswith(b'HTTP/1.')
+    assert b'\r\n\r\n' not in wire
+
+
+def test_aiohttp_engine_replaces_raw_head_strategies(monkeypatch):
+    monkeypatch.setattr(config, 'DRIP_STRATEGY', 'header_trickle')
+    event = new_event_log_data('8.8.8.8', 40000, 80, 'GET', '/', '', '1.1', 'curl/8.0', {})
+    strategy, _ = select_drip_strategy(None, event, '', raw_head=False)
+    assert strategy.name == 'fixed' and event['drip_strategy'] == 'fixed'
+    strategy, _ = select_drip_strategy(None, event, '')
+    assert strategy.raw_head and event['drip_strategy'] == 'header_trickle'
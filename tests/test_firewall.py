@@ -0,0 +1,190 @@
+import asyncio
+
+import pytest
+
+from http_tarpit import config
+from http_tarpit.firewall import (
+    Blocklist, FirewallBackend, FirewallError, FirewallExporter, IpsetBackend, NftablesBackend,
+)
+
+NOW = 1_000_000.0
+
+
+class FakeBackend(FirewallBackend):
+    """Records every batch instead of running a command; fails while `failing` is set."""
+
+    name = 'fake'
+
+    def __init__(self):
+        self.batches = []
+        self.failing = False
+
+    def render(self, adds, deletes):
+        return ''
+
+    async def apply(self, adds, deletes):
+        if self.failing:
+            raise FirewallError("set is gone")
+        self.batches.append((sorted(adds), sorted(deletes)))
+
+
+def signature_event(ip, signatures=('wp_scan',)):
+    return {'client_ip': ip, 'signatures': list(signatures)}
+
+
+def make_exporter(tmp_path, ttl=60, max_entries=100, block_signatures=()):
+    return FirewallExporter(backend=FakeBackend(), blocklist=Blocklist(ttl, max_entries),
+                            export_path=tmp_path / 'blocklist.txt', block_signatures=block_signatures)
+
+
+def test_backend_requires_render():
+    with pytest.raises(TypeError):
+        FirewallBackend()
+
+    class Incomplete(FirewallBackend):
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_blocklist_deduplicates_within_a_batch():
+    blocklist = Blocklist(ttl=60, max_entries=100)
+    assert blocklist.add('8.8.8.8', NOW) is True
+    assert blocklist.add('8.8.8.8', NOW + 5) is False
+    assert blocklist.add('1.1.1.1', NOW + 5) is True
+
+    adds, deletes = blocklist.take_changes(now=NOW + 5)
+    assert sorted(adds) == [('1.1.1.1', 60), ('8.8.8.8', 60)]
+    assert deletes == []
+    assert blocklist.stats()['blocked'] == 2
+    assert blocklist.stats()['refreshed'] == 1
+    assert blocklist.take_changes(now=NOW + 5) == ([], [])
+
+
+def test_blocklist_expires_in_order_and_reblocks():
+    blocklist = Blocklist(ttl=60, max_entries=100)
+    blocklist.add('8.8.8.8', NOW)
+    blocklist.add('1.1.1.1', NOW + 30)
+    blocklist.take_changes(now=NOW + 30)
+
+    assert blocklist.expire(NOW + 59) == 0
+    assert blocklist.expire(NOW + 60) == 1
+    assert blocklist.entries() == ['1.1.1.1']
+    assert blocklist.take_changes(now=NOW + 60) == ([], ['8.8.8.8'])
+
+    # Expired, then blocked again before the delete went out: only the add is left.
+    blocklist.expire(NOW + 90)
+    blocklist.add('1.1.1.1', NOW + 91)
+    assert blocklist.take_changes(now=NOW + 91) == ([('1.1.1.1', 60)], [])
+
+
+def test_blocklist_evicts_oldest_past_max_entries():
+    blocklist = Blocklist(ttl=60, max_entries=2)
+    for offset, ip in enumerate(('8.8.8.8', '1.1.1.1', '9.9.9.9')):
+        blocklist.add(ip, NOW + offset)
+    adds, deletes = blocklist.take_changes(now=NOW + 2)
+    assert sorted(ip for ip, _ in adds) == ['1.1.1.1', '9.9.9.9']
+    assert deletes == ['8.8.8.8']
+    assert blocklist.stats()['evicted'] == 1
+
+
+def test_exporter_sends_one_batch_per_round(tmp_path):
+    exporter = make_exporter(tmp_path)
+    for ip in ('8.8.8.8', '8.8.8.8', '1.1.1.1', '2001:4860:4860::8888'):
+        exporter.record(signature_event(ip), NOW)
+    exporter.record(signature_event('10.0.0.1'), NOW) # never blocked: not public
+    exporter.record({'client_ip': '9.9.9.9', 'signatures': []}, NOW)
+
+    assert asyncio.run(exporter.apply_changes(NOW + 1)) is True
+    assert asyncio.run(exporter.apply_changes(NOW + 2)) is True
+    assert exporter.backend.batches == [
+        ([('1.1.1.1', 59), ('2001:4860:4860::8888', 59), ('8.8.8.8', 59)], []),
+    ]
+
+    asyncio.run(exporter.apply_changes(NOW + 60))
+    assert exporter.backend.batches[-1] == ([], ['1.1.1.1', '2001:4860:4860::8888', '8.8.8.8'])
+    assert exporter.stats()['batches'] == 2
+
+
+def test_exporter_filters_on_block_signatures(tmp_path):
+    exporter = make_exporter(tmp_path, block_signatures=['sqlmap'])
+    exporter.record(signature_event('8.8.8.8', ('wp_scan',)), NOW)
+    exporter.record(signature_event('1.1.1.1', ('wp_scan', 'sqlmap')), NOW)
+    assert exporter.blocklist.entries() == ['1.1.1.1']
+
+
+def test_exporter_resyncs_after_a_failed_batch(tmp_path):
+    exporter = make_exporter(tmp_path)
+    exporter.record(signature_event('8.8.8.8'), NOW)
+    asyncio.run(exporter.apply_changes(NOW))
+
+    exporter.backend.failing = True
+    exporter.record(signature_event('1.1.1.1'), NOW + 10)
+    assert asyncio.run(exporter.apply_changes(NOW + 61)) is False
+    assert exporter.stats()['batch_failures'] == 1
+
+    exporter.backend.failing = False
+    assert asyncio.run(exporter.apply_changes(NOW + 62)) is True
+    # Full re-sync of what is still blocked, plus the delete that failed.
+    assert exporter.backend.batches[-1] == ([('1.1.1.1', 8)], ['8.8.8.8'])
+
+
+def test_exporter_writes_export_file(tmp_path):
+    exporter = make_exporter(tmp_path)
+    exporter.record(signature_event('8.8.8.8'), NOW)
+    exporter.record(signature_event('1.1.1.1'), NOW)
+
+    async def round_trip():
+        await exporter.apply_changes(NOW)
+        await exporter.export()
+
+    asyncio.run(round_trip())
+    lines = (tmp_path / 'blocklist.txt').read_text().splitlines()
+    assert lines[0].startswith('# http-tarpit blocklist, 2 addresses')
+    assert lines[1:] == ['8.8.8.8', '1.1.1.1']
+
+
+def test_nftables_render():
+    backend = NftablesBackend(table='inet tarpit', sets=('block4', 'block6'))
+    script = backend.render([('8.8.8.8', 60), ('2001:db8::1', 30)], ['1.1.1.1'])
+    assert script.splitlines() == [
+        "add table inet tarpit",
+        "add set inet tarpit block4 { type ipv4_addr; flags timeout; }",
+        "add set inet tarpit block6 { type ipv6_addr; flags timeout; }",
+        "add element inet tarpit block4 { 8.8.8.8, 1.1.1.1 }",
+        "delete element inet tarpit block4 { 8.8.8.8, 1.1.1.1 }",
+        "add element inet tarpit block4 { 8.8.8.8 timeout 60s }",
+        "add element inet tarpit block6 { 2001:db8::1 }",
+        "delete element inet tarpit block6 { 2001:db8::1 }",
+        "add element inet tarpit block6 { 2001:db8::1 timeout 30s }",
+    ]
+
+
+def test_nftables_render_deletes_only():
+    backend = NftablesBackend(table='inet tarpit', sets=('block4', 'block6'))
+    lines = backend.render([], ['1.1.1.1']).splitlines()
+    assert lines[3:] == [
+        "add element inet tarpit block4 { 1.1.1.1 }",
+        "delete element inet tarpit block4 { 1.1.1.1 }",
+    ]
+
+
+def test_ipset_render():
+    backend = IpsetBackend(sets=('tarpit4', 'tarpit6'), max_entries=500)
+    script = backend.render([('8.8.8.8', 60), ('2001:db8::1', 30)], ['1.1.1.1'])
+    assert script.splitlines() == [
+        "create tarpit4 hash:ip family inet timeout 0 maxelem 500",
+        "create tarpit6 hash:ip family inet6 timeout 0 maxelem 500",
+        "del tarpit4 1.1.1.1",
+        "add tarpit4 8.8.8.8 timeout 60",
+        "add tarpit6 2001:db8::1 timeout 30",
+    ]
+
+
+def test_apply_reports_missing_command(monkeypatch):
+    backend = NftablesBackend(table='inet tarpit', sets=('block4', 'block6'))
+    monkeypatch.setattr(backend, 'command', ('/nonexistent/nft', '-f', '-'))
+    monkeypatch.setattr(config, 'FIREWALL_COMMAND_TIMEOUT_SECONDS', 5)
+    with pytest.raises(FirewallError, match='cannot run /nonexistent/nft'):
+        asyncio.run(backend.apply([('8.8.8.8', 60)], []))
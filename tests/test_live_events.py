@@ -0,0 +1,135 @@
+import asyncio
+import json
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from http_tarpit import config, live_events
+from http_tarpit.admin_server import create_admin_app
+from http_tarpit.live_events import FINISHED, OTHER_KEY, STARTED, EventHub, RollingWindows
+
+MINUTE = 60.0
+NOW = 1_000_000 * MINUTE
+
+
+class FakeTransport:
+    def __init__(self):
+        self.aborted = False
+
+    def get_extra_info(self, name, default=None):
+        return ('127.0.0.1', 50000) if name == 'peername' else default
+
+    def abort(self):
+        self.aborted = True
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    hub = EventHub(ring_size=100, queue_size=10)
+    monkeypatch.setattr(live_events, '_hub', hub)
+    monkeypatch.setattr(config, 'LIVE_EVENTS_TOKEN', '')
+    return hub
+
+
+async def serve_admin_app():
+    runner = web.AppRunner(create_admin_app())
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}", runner
+
+
+def test_window_caps_distinct_keys_per_minute():
+    windows = RollingWindows(minutes=5, max_keys=2)
+    for country in ('US', 'DE', 'US', 'FR', 'CN'):
+        windows.record_started({'country': country}, now=NOW)
+    assert windows.top('country', now=NOW) == [('US', 2), (OTHER_KEY, 2), ('DE', 1)]
+    # A new minute starts with room for new keys again.
+    windows.record_started({'country': 'FR'}, now=NOW + MINUTE)
+    assert dict(windows.top('country', minutes=1, now=NOW + MINUTE)) == {'FR': 1}
+
+
+def test_window_expiry_keeps_totals_consistent():
+    windows = RollingWindows(minutes=3, max_keys=10)
+    for minute in range(6):
+        for _ in range(minute + 1):
+            windows.record_started({'path': f'/{minute % 2}', 'signature': ('env_file',)}, now=NOW + minute * MINUTE)
+        windows.record_finished(1.5, now=NOW + minute * MINUTE)
+    now = NOW + 5 * MINUTE
+    # Minutes 3, 4 and 5 remain: 4 + 5 + 6 requests.
+    assert dict(windows.top('path', now=now)) == {'/1': 10, '/0': 5}
+    assert dict(windows.top('signature', now=now)) == {'env_file': 15}
+    assert [row['started'] for row in windows.series(now=now)] == [4, 5, 6]
+    assert dict(windows.top('path', now=NOW + 20 * MINUTE)) == {}
+    assert windows._totals == {dimension: {} for dimension in RollingWindows.DIMENSIONS}
+
+
+def test_slow_subscriber_is_dropped_when_its_queue_is_full():
+    hub = EventHub(ring_size=100, queue_size=2)
+    transport = FakeTransport()
+    slow = hub.subscribe(transport=transport)
+    fast = hub.subscribe()
+    for index in range(3):
+        hub.publish(STARTED, {'index': index})
+        fast.queue.get_nowait()
+    assert slow.dropped and transport.aborted
+    assert not fast.dropped
+    assert hub.stats() == {'subscribers': 1, 'buffered': 3, 'published': 3, 'dropped_subscribers': 1}
+
+
+def test_sse_replays_after_last_event_id(hub):
+    for index in range(4):
+        hub.publish(STARTED if index % 2 == 0 else FINISHED, {'index': index})
+
+    async def scenario():
+        base_url, runner = await serve_admin_app()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f'{base_url}/events', headers={'Last-Event-ID': '2'}) as response:
+                    assert response.headers['Content-Type'] == 'text/event-stream'
+                    assert await response.content.readuntil(b'\n\n') == b'retry: 3000\n\n'
+                    frames = [await response.content.readuntil(b'\n\n') for _ in range(2)]
+                    # Live events follow the replayed ones on the same stream.
+                    hub.publish(STARTED, {'index': 4})
+                    frames.append(await response.content.readuntil(b'\n\n'))
+                    return [frame.decode() for frame in frames]
+        finally:
+            hub.close()
+            await runner.cleanup()
+
+    frames = asyncio.run(scenario())
+    parsed = [dict(line.split(': ', 1) for line in frame.strip().split('\n')) for frame in frames]
+    assert [frame['id'] for frame in parsed] == ['3', '4', '5']
+    assert [frame['event'] for frame in parsed] == [STARTED, FINISHED, STARTED]
+    assert [json.loads(frame['data'])['index'] for frame in parsed] == [2, 3, 4]
+
+
+def test_recent_and_token_auth(hub, monkeypatch):
+    for index in range(3):
+        hub.publish(STARTED, {'index': index})
+    monkeypatch.setattr(config, 'LIVE_EVENTS_TOKEN', 'secret')
+
+    async def scenario():
+        base_url, runner = await serve_admin_app()
+        try:
+            async with aiohttp.ClientSession() as session:
+                statuses = []
+                for url, headers in ((f'{base_url}/events/recent', {}),
+                                     (f'{base_url}/events/recent', {'Authorization': 'Bearer wrong'}),
+                                     (f'{base_url}/events?token=wrong', {})):
+                    async with session.get(url, headers=headers) as response:
+                        statuses.append(response.status)
+                async with session.get(f'{base_url}/events/recent?last_event_id=1',
+                                       headers={'Authorization': 'Bearer secret'}) as response:
+                    recent = await response.json()
+                async with session.get(f'{base_url}/events/recent?token=secret&limit=1') as response:
+                    last = await response.json()
+                return statuses, recent, last
+        finally:
+            await runner.cleanup()
+
+    statuses, recent, last = asyncio.run(scenario())
+    assert statuses == [401, 401, 401]
+    assert [event['id'] for event in recent] == [2, 3]
+    assert [event['data']['index'] for event in last] == [2]
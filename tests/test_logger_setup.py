@@ -0,0 +1,55 @@
+import json
+import logging
+
+from http_tarpit.logger_setup import CompressingRotatingFileHandler, JsonFormatter
+
+
+def make_record(extra_data=None, msg="Connection finished for %s", args=('8.8.8.8',)):
+    record = logging.LogRecord('http_tarpit.request_handler', logging.INFO, __file__, 1, msg, args, None)
+    if extra_data is not None:
+        record.extra_data = extra_data
+    return record
+
+
+def test_event_records_keep_their_own_fields_over_the_record_fields():
+    event = {'timestamp': '2026-01-01T00:00:00+00:00', 'client_ip': '8.8.8.8', 'path': '/.env', 'bytes_sent': 12}
+    line = JsonFormatter().format(make_record(event))
+    assert json.loads(line) == {**event, 'level': 'INFO', 'name': 'http_tarpit.request_handler',
+                                'message': 'Connection finished for 8.8.8.8'}
+
+
+def test_records_without_extra_data_use_the_record_fields():
+    parsed = json.loads(JsonFormatter().format(make_record()))
+    assert parsed['message'] == 'Connection finished for 8.8.8.8'
+    assert parsed['level'] == 'INFO'
+    assert 'timestamp' in parsed
+
+
+def test_unserializable_extra_data_falls_back_to_the_generic_path():
+    class Opaque:
+        def __str__(self):
+            return 'opaque'
+    # default=str makes the object itself encodable; a non-string key is not.
+    parsed = json.loads(JsonFormatter().format(make_record({'client_ip': '8.8.8.8', 'extra': Opaque()})))
+    assert parsed['extra'] == 'opaque'
+    parsed = json.loads(JsonFormatter().format(make_record({('a', 'b'): 1})))
+    assert parsed['name'] == 'JsonFormatter'
+
+
+def test_stopped_rotation_leaves_the_file_to_the_successor(tmp_path):
+    path = tmp_path / 'tarpit.log'
+    old = CompressingRotatingFileHandler(path, max_bytes=64, backup_count=2)
+    old.setFormatter(logging.Formatter('%(message)s'))
+    old.stop_rotating()
+    for _ in range(10):
+        old.emit(make_record(msg='x' * 20, args=None))
+    assert not (tmp_path / 'tarpit.log.1.gz').exists()
+
+    # The successor rotates the file away; the old process follows it to the new one.
+    new = CompressingRotatingFileHandler(path, max_bytes=64, backup_count=2)
+    new.doRollover()
+    old.emit(make_record(msg='after rotation', args=None))
+    new.close()
+    old.close()
+    assert (tmp_path / 'tarpit.log.1.gz').exists()
+    assert path.read_text(encoding='utf-8') == 'after rotation\n'
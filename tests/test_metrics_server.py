@@ -0,0 +1,114 @@
+import asyncio
+import math
+import re
+import socket
+
+from http_tarpit import config, metrics, metrics_server
+from http_tarpit.metrics import HOLD_BUCKETS, Counter, Family, Histogram
+from http_tarpit.metrics_server import bind_side_port, render_metrics
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def test_bind_side_port_waits_for_the_predecessor():
+    port = free_port()
+    predecessor = socket.create_server(('127.0.0.1', port))
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.3, predecessor.close)
+        return await bind_side_port('127.0.0.1', port, "Metrics")
+
+    sock = asyncio.run(scenario())
+    try:
+        assert sock.getsockname() == ('127.0.0.1', port)
+    finally:
+        sock.close()
+
+
+def test_bind_side_port_gives_up_on_a_taken_port(monkeypatch):
+    monkeypatch.setattr(config, 'SIDE_PORT_BIND_TIMEOUT_SECONDS', 0.3)
+    with socket.create_server(('127.0.0.1', 0)) as taken:
+        port = taken.getsockname()[1]
+        assert asyncio.run(bind_side_port('127.0.0.1', port, "Metrics")) is None
+
+
+def parse_exposition(text: str):
+    """
+    A strict reader of the Prometheus text format: every sample must follow
+    the TYPE of its family, names and labels must be well formed and values
+    must be numbers. Returns ({family: type}, [(name, labels, value)]).
+    """
+    assert text.endswith('\n')
+    types, samples = {}, []
+    current = None
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            assert len(line.split(' ', 3)) == 4, line
+            continue
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            assert name not in types, f"{name} declared twice"
+            assert kind in ('counter', 'gauge', 'histogram'), line
+            types[name] = current = kind, name
+            continue
+        match = SAMPLE.match(line)
+        assert match, f"malformed sample: {line!r}"
+        name, labels, value = match.groups()
+        assert current is not None, f"{name} has no TYPE"
+        kind, family = current
+        allowed = {family} if kind != 'histogram' else {f'{family}_bucket', f'{family}_sum', f'{family}_count'}
+        assert name in allowed, f"{name} outside its family {family}"
+        if kind == 'counter':
+            assert name.endswith('_total'), name
+        pairs = LABEL.findall(labels or '')
+        assert ','.join(f'{key}="{val}"' for key, val in pairs) == (labels or ''), line
+        samples.append((name, dict(pairs), float(value)))
+    return {name: kind for name, (kind, _) in types.items()}, samples
+
+
+def test_render_metrics_is_valid_exposition(monkeypatch):
+    requests = Family('tarpit_requests_total', 'Requests that reached the tarpit, by engine.', 'engine', Counter)
+    requests.labels('aiohttp').inc(3)
+    hold = Family('tarpit_hold_duration_seconds', 'How long finished connections were held.', 'strategy',
+                  lambda: Histogram(HOLD_BUCKETS))
+    for seconds in (0.5, 12, 12, 900, 50000):
+        hold.labels('fixed').observe(seconds)
+    monkeypatch.setattr(metrics, 'REQUESTS', requests)
+    monkeypatch.setattr(metrics, 'HOLD_DURATION', hold)
+    monkeypatch.setattr(metrics, 'SIGNATURE_MATCHES', Family('tarpit_signature_matches_total', 'Matches.', 'signature', Counter))
+    monkeypatch.setattr(metrics, 'DB_FLUSH_SECONDS', Histogram(metrics.LATENCY_BUCKETS))
+    fake_stats = {'active_holds': 7, 'shed': 2, 'hit_ratio': 0.25, 'action': 'short', 'enabled': True}
+    monkeypatch.setattr(metrics_server, '_STATS_SOURCES', metrics_server._STATS_SOURCES + (('test', lambda: fake_stats),))
+
+    types, samples = parse_exposition(render_metrics())
+    values = {(name, tuple(sorted(labels.items()))): value for name, labels, value in samples}
+
+    assert types['tarpit_requests_total'] == 'counter'
+    assert values[('tarpit_requests_total', (('engine', 'aiohttp'),))] == 3
+
+    assert types['tarpit_hold_duration_seconds'] == 'histogram'
+    buckets = [(labels['le'], value) for name, labels, value in samples
+               if name == 'tarpit_hold_duration_seconds_bucket' and labels['strategy'] == 'fixed']
+    assert [le for le, _ in buckets] == [str(bound) for bound in HOLD_BUCKETS] + ['+Inf']
+    counts = [value for _, value in buckets]
+    assert counts == sorted(counts)
+    assert dict(buckets)['1'] == 1 and dict(buckets)['15'] == 3 and dict(buckets)['21600'] == 4
+    assert counts[-1] == values[('tarpit_hold_duration_seconds_count', (('strategy', 'fixed'),))] == 5
+    assert math.isclose(values[('tarpit_hold_duration_seconds_sum', (('strategy', 'fixed'),))], 50924.5)
+
+    flush_bounds = [labels['le'] for name, labels, _ in samples if name == 'tarpit_db_flush_seconds_bucket']
+    assert flush_bounds == [str(bound) for bound in metrics.LATENCY_BUCKETS] + ['+Inf']
+    assert types['tarpit_event_loop_lag_last_seconds'] == 'gauge'
+
+    assert types['tarpit_test_active_holds'] == 'gauge' and values[('tarpit_test_active_holds', ())] == 7
+    assert types['tarpit_test_hit_ratio'] == 'gauge' and values[('tarpit_test_hit_ratio', ())] == 0.25
+    assert types['tarpit_test_shed_total'] == 'counter' and values[('tarpit_test_shed_total', ())] == 2
+    assert not [name for name in types if name.startswith(('tarpit_test_action', 'tarpit_test_enabled'))]
@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+
+from http_tarpit import config, raw_protocol
+from http_tarpit.drip_scheduler import DripScheduler
+from http_tarpit.drip_strategies import DripStrategy
+from http_tarpit.raw_protocol import BadRequest, TarpitProtocol, parse_request_head
+
+
+class FakeTransport:
+    def __init__(self):
+        self.written = bytearray()
+        self.closed = False
+        self.paused = False
+        self.pause_calls = 0
+
+    def get_extra_info(self, name, default=None):
+        return ('203.0.113.7', 40000) if name == 'peername' else default
+
+    def write(self, data):
+        self.written += data
+
+    def close(self):
+        self.closed = True
+
+    abort = close
+
+    def is_closing(self):
+        return self.closed
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def pause_reading(self):
+        self.paused = True
+        self.pause_calls += 1
+
+    def resume_reading(self):
+        self.paused = False
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    """Admission off, a fast fixed drip of two bytes, no enrichment; collects the finished events."""
+    finished = []
+    scheduler = DripScheduler(tick_seconds=0.01, slots=8)
+
+    async def no_enrichment(client, target_port, event):
+        return None
+
+    def fixed_drip(hold, event, accept_encoding):
+        event['drip_strategy'] = 'fixed'
+        return DripStrategy(chunk=b'x', delay=0.01, max_bytes=2), None
+
+    monkeypatch.setattr(config, 'ADMISSION_ENABLED', False)
+    monkeypatch.setattr(raw_protocol, 'get_drip_scheduler', lambda: scheduler)
+    monkeypatch.setattr(raw_protocol, 'enrich_event', no_enrichment)
+    monkeypatch.setattr(raw_protocol, 'select_drip_strategy', fixed_drip)
+    monkeypatch.setattr(raw_protocol, 'finish_event',
+                        lambda event, start_time, bytes_sent, error: finished.append((event, bytes_sent, error)))
+    yield finished
+    scheduler.stop()
+
+
+def run_connection(*chunks, wait=0.2):
+    """Feeds `chunks` to a TarpitProtocol on a fake transport and lets the drips run."""
+    async def scenario():
+        protocol = TarpitProtocol()
+        transport = FakeTransport()
+        protocol.connection_made(transport)
+        for chunk in chunks:
+            protocol.data_received(chunk)
+        await asyncio.sleep(wait)
+        protocol.connection_lost(None)
+        return transport
+    return asyncio.run(scenario())
+
+
+def test_parse_request_head():
+    method, target, version, headers, lower = parse_request_head(
+        b"get /a?b=1 HTTP/1.1\r\nHost: x\r\nX-Forwarded-For: 1.1.1.1\r\nx-forwarded-for: 8.8.8.8\r\nhost: y")
+    assert (method, target, version) == ('GET', '/a?b=1', (1, 1))
+    assert headers == {'Host': 'x', 'X-Forwarded-For': '1.1.1.1', 'x-forwarded-for': '8.8.8.8', 'host': 'y'}
+    assert lower == {'host': 'x', 'x-forwarded-for': '1.1.1.1,8.8.8.8'}
+    for head in (b"GET /", b"GET / HTTP/x.y", b"GET / HTTP/1.1\r\nno colon", b"GET / HTTP/1.1\r\n Folded: x"):
+        with pytest.raises(BadRequest):
+            parse_request_head(head)
+
+
+@pytest.mark.parametrize('request_bytes', [
+    b"NOT A REQUEST\r\n\r\n",
+    b"GET / HTTP/1.1\r\nBroken header\r\n\r\n",
+    b"POST / HTTP/1.1\r\nContent-Length: -5\r\n\r\n",
+])
+def test_malformed_head_gets_400(engine, request_bytes):
+    transport = run_connection(request_bytes, wait=0)
+    assert transport.written.startswith(b"HTTP/1.1 400 Bad Request\r\n")
+    assert transport.closed
+    assert engine == []
+
+
+def test_head_over_size_limit_gets_400(engine, monkeypatch):
+    monkeypatch.setattr(config, 'RAW_MAX_HEADER_BYTES', 1024)
+    transport = run_connection(b"GET / HTTP/1.1\r\n", b"X-Padding: " + b"a" * 1024)
+    assert transport.written.startswith(b"HTTP/1.1 400 Bad Request\r\n")
+    assert transport.closed and engine == []
+
+
+def test_keep_alive_serves_second_request_after_skipping_body(engine):
+    body = b"GET /not-a-request HTTP/1.1\r\n\r\n"
+    first = b"POST /a HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+    second = b"GET /b HTTP/1.1\r\nConnection: close\r\n\r\n"
+    # The body arrives split across reads while the first drip runs.
+    transport = run_connection(first[:50], first[50:] + second)
+
+    assert [event['http_path'] for event, _, _ in engine] == ['/a', '/b']
+    assert [(bytes_sent, error) for _, bytes_sent, error in engine] == [(2, None), (2, None)]
+    response = b"1\r\nx\r\n1\r\nx\r\n0\r\n\r\n"
+    assert transport.written == (
+        b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nConnection: keep-alive\r\n"
+        b"Transfer-Encoding: chunked\r\n\r\n" + response +
+        b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nConnection: close\r\n"
+        b"Transfer-Encoding: chunked\r\n\r\n" + response
+    )
+    assert transport.closed
+
+
+def test_reading_is_paused_during_the_drip(engine):
+    async def scenario():
+        protocol = TarpitProtocol()
+        transport = FakeTransport()
+        protocol.connection_made(transport)
+        protocol.data_received(b"GET /a HTTP/1.1\r\n\r\n")
+        during = transport.paused
+        drip = protocol.drip
+        await drip.future
+        await asyncio.sleep(0)
+        after = transport.paused
+        protocol.connection_lost(None)
+        return during, after, transport
+
+    during, after, transport = asyncio.run(scenario())
+    assert during is True
+    # Keep-alive: reading resumes for the next request once the drip is done.
+    assert after is False and not transport.closed
+    assert transport.pause_calls == 1
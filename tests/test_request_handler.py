@@ -0,0 +1,114 @@
+import asyncio
+import logging
+
+import pytest
+from aiohttp import web
+
+from http_tarpit import config, database, raw_protocol, request_handler
+from http_tarpit.admission import CLOSE, RESET, Hold
+from http_tarpit.raw_protocol import RawTarpitSite
+from http_tarpit.reporting import abuseipdb_reporter
+from http_tarpit.request_handler import handle_request, new_event_log_data
+from http_tarpit.utils.client_address import client_address
+
+REQUEST = b"GET /wp-login.php HTTP/1.1\r\nHost: tarpit\r\nUser-Agent: test-shed\r\n\r\n"
+
+
+@pytest.fixture
+def shed_everyone(monkeypatch):
+    """Makes admission shed every client with the requested action and collects the events written."""
+    events = []
+    action = {'value': CLOSE}
+
+    def admit_client(client):
+        return Hold(client.ip, None, None, action['value'])
+
+    monkeypatch.setattr(request_handler, 'admit_client', admit_client)
+    monkeypatch.setattr(raw_protocol, 'admit_client', admit_client)
+    monkeypatch.setattr(request_handler, 'enqueue_event', events.append)
+    return action, events
+
+
+async def start_aiohttp_site():
+    app = web.Application()
+    app.router.add_route('*', '/{tail:.*}', handle_request)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return site._server.sockets[0].getsockname()[1], runner.cleanup
+
+
+async def start_raw_site():
+    site = RawTarpitSite('127.0.0.1', 0, shutdown_timeout=0)
+    await site.start()
+    return site._server.sockets[0].getsockname()[1], site.stop
+
+
+async def send_request(port: int) -> bytes:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(REQUEST)
+    received = b''
+    try:
+        received = await asyncio.wait_for(reader.read(), 5)
+    except ConnectionResetError:
+        pass
+    writer.close()
+    return received
+
+
+@pytest.mark.parametrize('start_site', [start_aiohttp_site, start_raw_site], ids=['aiohttp', 'protocol'])
+@pytest.mark.parametrize('shed_action', [CLOSE, RESET])
+def test_shed_connection_gets_no_response_but_an_event(shed_everyone, start_site, shed_action, caplog):
+    action, events = shed_everyone
+    action['value'] = shed_action
+
+    async def scenario():
+        port, stop = await start_site()
+        try:
+            received = await send_request(port)
+            await asyncio.sleep(0.05) # let the server finish the handler
+            return received
+        finally:
+            await stop()
+
+    with caplog.at_level(logging.WARNING):
+        received = asyncio.run(scenario())
+    assert received == b''
+    assert len(events) == 1
+    event = events[0]
+    assert event['drip_strategy'] == shed_action
+    assert event['http_path'] == '/wp-login.php'
+    assert event['bytes_sent'] == 0
+    assert event['error_message'] == f"Shed by admission control ({shed_action})"
+    assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
+
+
+class StubReporter:
+    def __init__(self, accept: bool, persist: bool = True):
+        self.accept = accept
+        self.persist = persist
+        self.submitted = []
+
+    def submit(self, ip_address, target_port, comment_details, report_timestamp=None, categories=None):
+        self.submitted.append(ip_address)
+        return self.accept
+
+
+@pytest.mark.parametrize('reporter, reported', [
+    (None, 0), # not running
+    (StubReporter(accept=True), 1),
+    (StubReporter(accept=False), 1), # queue full, deferred to the backlog
+    (StubReporter(accept=False, persist=False), 0),
+])
+def test_report_claim_is_kept_only_when_the_report_will_be_sent(events_db, monkeypatch, reporter, reported):
+    monkeypatch.setattr(config, 'ABUSEIPDB_ENABLED', True)
+    monkeypatch.setattr(abuseipdb_reporter, '_reporter', reporter)
+    monkeypatch.setattr(database, '_reported_ip_cache', database.ReportedIPCache(ttl_seconds=3600, max_entries=100))
+    event = new_event_log_data('8.8.8.8', 40000, 80, 'GET', '/.env', '', '1.1', 'curl/8.0', {})
+
+    asyncio.run(request_handler._handle_abuseipdb_report(client_address('8.8.8.8'), 80, event))
+    assert event['reported_to_abuseipdb'] == reported
+    assert (event['abuseipdb_report_timestamp'] is not None) == bool(reported)
+    # A released claim lets the next request from the IP report it.
+    assert (database.claim_ip_for_report('8.8.8.8') is None) == bool(reported)
